@@ -0,0 +1,444 @@
+"""aktt_receiver.py - The LXC side of aktt_sync_windows.push_to_lxc().
+
+Every push arrives in the incoming directory as loose files with manifest.json
+last, or with push_to_lxc(batch_dirs=True) as a batch directory of its own.
+The receiver claims the batches waiting there, checks every file a manifest says
+was sent against its SHA-256 and size, brings its own copy of the guild data
+up to date and regenerates every guild's reports from it, once per run no
+matter how many pushes it applied.
+
+The data is kept in data_dir as one payload file (current.aktt, see
+payload.py) holding the GBL history and MM export rows, whatever form they
+arrived in: the Lua files, a payload, or GBL rows appended as a delta on top
+of the push whose chain the delta names. That copy is where files the sender
+skipped because they hadn't changed come from. When the manifest's source
+digests, GBL chain and report windows are all the same as for the last
+regeneration, nothing is regenerated.
+
+After every run the source digests and GBL chain of the data held are
+written to .aktt-ack.json in the incoming directory. push_to_lxc reads them
+back and only sends a delta or leaves a file out when they show that the
+receiver applied its last push.
+
+Run it as a service that watches the incoming directory, waits for a burst
+of pushes to settle and handles them together:
+
+    python aktt_receiver.py --watch --incoming /var/lib/aktt-stats/incoming \\
+        --data-dir /var/lib/aktt-stats/data --output-dir /var/lib/aktt-stats/guilds
+
+or without --watch to handle whatever is waiting once, e.g. from a systemd
+path unit or a timer.
+"""
+from __future__ import annotations
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import traceback
+from datetime import datetime, timezone
+
+from aktt_sync_windows import ACK_FILENAME, ACK_VERSION, DELTA_FORMAT, DELTA_VERSION
+from payload import (append_gbl_rows, decode_payload, encode_payload, gbl_table, read_gbl_table,
+                     read_mm_table, read_payload)
+from watch_mode import watch_directory
+
+RECEIVER_STATE_VERSION = 1
+STATE_FILENAME = "receiver_state.json"
+CURRENT_FILENAME = "current.aktt"
+SOURCE_FILES = ("MasterMerchant.lua", "GBLData.lua")
+
+# Layout of the incoming directory: push_to_lxc's batch directories, and the receiver's own.
+BATCH_PREFIX = "push."
+LOOSE_BATCH_PREFIX = "loose."
+CLAIMED_DIRNAME = ".claimed"
+REJECTED_DIRNAME = ".rejected"
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as reader:
+        return hashlib.file_digest(reader, "sha256").hexdigest()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    # A dot name, so a watch on the directory doesn't take the scratch file for a push.
+    fd, partial = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "wb") as writer:
+        writer.write(data)
+    os.replace(partial, path)
+
+
+def manifest_files(manifest: dict) -> dict:
+    """
+    Return the manifest's entry per data file (sha256, bytes, row counts and
+    whether it was sent). Manifests from before the entries existed list only
+    file names, and every file they name was sent.
+    """
+    if "files" in manifest:
+        return manifest["files"]
+    names = [manifest.get(key) for key in ("mm_filename", "gbl_filename", "gbl_delta_filename",
+                                          "payload_filename")]
+    return {name: {"sent": True} for name in names if name}
+
+
+def verify_batch(batch_dir: str, files: dict) -> None:
+    """Raise ValueError unless every file sent in the batch is there with the size and digest it was sent with."""
+    for name, info in files.items():
+        if not info.get("sent"):
+            continue
+        path = os.path.join(batch_dir, name)
+        if not os.path.isfile(path):
+            raise ValueError(f"{name} is missing from the push")
+        if info.get("bytes") is not None and os.path.getsize(path) != info["bytes"]:
+            raise ValueError(f"{name} is {os.path.getsize(path)} bytes, the manifest says {info['bytes']}")
+        if info.get("sha256") is not None and _file_sha256(path) != info["sha256"]:
+            raise ValueError(f"{name} doesn't match its SHA-256 in the manifest")
+
+
+class Receiver:
+    """
+    Parameters
+    ----------
+    data_dir
+        Where the receiver keeps current.aktt and its state between pushes
+    output_dir
+        Every guild's reports are written to its own directory under this
+    engine
+        The ReportEngine the reports are generated with; its user is the ESO
+        account the pushed SavedVariables belong to when a manifest doesn't
+        name one
+    """
+
+    def __init__(self, data_dir: str, output_dir: str, engine):
+        self.data_dir = data_dir
+        self.output_dir = output_dir
+        self.engine = engine
+        self.current_file = os.path.join(data_dir, CURRENT_FILENAME)
+        self.state_file = os.path.join(data_dir, STATE_FILENAME)
+
+    def log(self, message):
+        print("[aktt-recv] " + message)
+
+    def load_state(self) -> dict:
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as reader:
+                state = json.load(reader)
+        except (FileNotFoundError, ValueError):
+            return {"version": RECEIVER_STATE_VERSION}
+        if state.get("version") != RECEIVER_STATE_VERSION or not os.path.isfile(self.current_file):
+            return {"version": RECEIVER_STATE_VERSION}
+        return state
+
+    def save_state(self, state: dict) -> None:
+        _write_atomic(self.state_file, json.dumps(state, indent=2).encode("utf-8"))
+
+    def process(self, batch_dir: str, now: datetime | None = None) -> bool:
+        """
+        Apply the push whose manifest.json is in ``batch_dir`` and regenerate
+        the reports. Returns False without regenerating when the push carries
+        nothing new. Raises ValueError if the batch is incomplete or corrupt, or
+        if it builds on data the receiver doesn't have; nothing is changed then.
+        """
+        manifest = self.ingest(batch_dir)
+        return manifest is not None and self.regenerate(manifest["week"], now)
+
+    def process_batches(self, batch_dirs: list, now: datetime | None = None, finished=None) -> bool:
+        """
+        Coalesce several pushes: apply them one after the other, oldest first,
+        and regenerate the reports once, for the week of the newest. A push that
+        can't be applied is skipped. Returns whether the reports were
+        regenerated.
+
+        ``finished(batch_dir, error)`` is called for every batch as soon as it
+        has been applied (``error`` None) or rejected, so the caller can clear
+        it away even if a later one fails. A batch whose push raises anything
+        but ValueError is rejected too, and the exception is raised on; the
+        batches after it aren't touched.
+        """
+        if finished is None:
+            finished = lambda batch_dir, error: None
+        ordered = []
+        for batch_dir in batch_dirs:
+            try:
+                with open(os.path.join(batch_dir, "manifest.json"), "r", encoding="utf-8") as reader:
+                    ordered.append((json.load(reader).get("ran_at") or "", batch_dir))
+            except (OSError, ValueError) as error:
+                self.log(f"{batch_dir} rejected: {error}")
+                finished(batch_dir, error)
+        week = None
+        for _, batch_dir in sorted(ordered):
+            try:
+                manifest = self.ingest(batch_dir)
+            except ValueError as error:
+                self.log(f"{batch_dir} rejected: {error}")
+                finished(batch_dir, error)
+                continue
+            except Exception as error:
+                self.log(f"{batch_dir} rejected: {error!r}")
+                finished(batch_dir, error)
+                raise
+            finished(batch_dir, None)
+            if manifest is not None:
+                week = manifest["week"]
+        return week is not None and self.regenerate(week, now)
+
+    def ingest(self, batch_dir: str) -> dict | None:
+        """
+        Bring the data held up to date with the push in ``batch_dir`` and return
+        its manifest, or None if the push is older than the data already held.
+        Raises ValueError like process.
+        """
+        with open(os.path.join(batch_dir, "manifest.json"), "r", encoding="utf-8") as reader:
+            manifest = json.load(reader)
+        files = manifest_files(manifest)
+        verify_batch(batch_dir, files)
+
+        sources = {name: files[name].get("sha256") for name in SOURCE_FILES if name in files}
+        chain = manifest.get("gbl_chain")
+        state = self.load_state()
+        if manifest.get("ran_at") and manifest["ran_at"] < (state.get("ran_at") or ""):
+            self.log(f"the push of {manifest['ran_at']} is older than the data held, ignoring it")
+            return None
+        if None not in sources.values() and sources == state.get("sources") and chain == state.get("chain"):
+            self.log(f"nothing changed since the push of {state.get('ran_at')}")
+            return manifest
+
+        try:
+            gbl, mm = self.apply(batch_dir, manifest, files, state)
+        except KeyError as error:
+            raise ValueError(f"the pushed SavedVariables have no {error.args[0]!r} table") from None
+        os.makedirs(self.data_dir, exist_ok=True)
+        _write_atomic(self.current_file, encode_payload(gbl, mm))
+        # The state follows current.aktt; the reports are only recorded once they are written.
+        self.save_state({"version": RECEIVER_STATE_VERSION, "sources": sources, "chain": chain,
+                         "reports": None, "ran_at": manifest.get("ran_at")})
+        return manifest
+
+    def regenerate(self, week: str, now: datetime | None = None) -> bool:
+        """
+        Write every guild's reports for ``week`` from the data held, unless they
+        were already written from the same data for the same report windows.
+        Returns whether they were written.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        windows = self.engine.generate_windows(week, now=now)
+        # A window that ends in the future ends "now", which moves with every push without
+        # changing what is in it; only the start of such a window is compared.
+        reports = [week] + [[window.kind, window.filename, window.start,
+                             window.end if window.end < int(now.timestamp()) else None]
+                            for window in windows]
+        state = self.load_state()
+        if "sources" not in state:
+            raise ValueError("no data has been received yet")
+        if reports == state.get("reports"):
+            self.log("reports are up to date")
+            return False
+
+        self.engine.parse_payload(week, self.current_file, windows, self.output_dir, all_guilds=True)
+        state["reports"] = reports
+        self.save_state(state)
+        return True
+
+    def apply(self, batch_dir: str, manifest: dict, files: dict, state: dict):
+        """Return the (gbl_table, mm_table) the receiver holds once the push is applied."""
+        # Each officer pushes the SavedVariables of their own account.
+        user = manifest.get("user") or self.engine.config.user
+        current_gbl = current_mm = None
+        if "sources" in state:
+            current_gbl, current_mm = read_payload(self.current_file)
+
+        def kept(name):
+            # A source file the sender didn't send again has to be the one already held.
+            if current_gbl is None or state["sources"].get(name) != files[name].get("sha256"):
+                raise ValueError(f"{name} wasn't sent and the receiver doesn't have it; push it in full")
+
+        pushed_gbl = None
+        payload_name = manifest.get("payload_filename")
+        if payload_name:
+            with open(os.path.join(batch_dir, payload_name), "rb") as reader:
+                pushed_gbl, mm = decode_payload(reader.read())
+        elif files.get("MasterMerchant.lua", {}).get("sent"):
+            mm = read_mm_table(os.path.join(batch_dir, "MasterMerchant.lua"), user)
+        else:
+            kept("MasterMerchant.lua")
+            mm = current_mm
+
+        gbl_mode = manifest.get("gbl_mode", "full")
+        if gbl_mode == "full":
+            if pushed_gbl is None and not files.get("GBLData.lua", {}).get("sent"):
+                kept("GBLData.lua")
+                return current_gbl, mm
+            if pushed_gbl is None:
+                pushed_gbl = read_gbl_table(os.path.join(batch_dir, "GBLData.lua"), user)
+            self.log(f"{pushed_gbl.num_rows} GBL rows received in full")
+            return pushed_gbl, mm
+
+        if current_gbl is None or state.get("chain") != manifest.get(
+                "gbl_base_chain" if gbl_mode == "delta" else "gbl_chain"):
+            raise ValueError("the push doesn't follow the GBL history the receiver has; push it in full")
+        if gbl_mode == "unchanged":
+            kept("GBLData.lua")
+            return current_gbl, mm
+        if gbl_mode != "delta":
+            raise ValueError(f"unknown gbl_mode {gbl_mode!r}")
+
+        if pushed_gbl is None:
+            with open(os.path.join(batch_dir, manifest["gbl_delta_filename"]), "rb") as reader:
+                delta = json.loads(gzip.decompress(reader.read()))
+            if delta.get("format") != DELTA_FORMAT or delta.get("version") != DELTA_VERSION:
+                raise ValueError("unsupported GBL delta format")
+            pushed_gbl = gbl_table(delta["guilds"])
+        gbl = append_gbl_rows(current_gbl, pushed_gbl)
+        self.log(f"{gbl.num_rows - current_gbl.num_rows} new GBL rows appended, {gbl.num_rows} in all")
+        return gbl, mm
+
+
+def claim_batches(incoming_dir: str) -> list:
+    """
+    Atomically take every complete push waiting in ``incoming_dir`` and return
+    the batch directories now owned by the caller, oldest claim first.
+
+    A batch directory (push.*) is claimed with a single rename into .claimed,
+    so of two receivers racing for it only one gets it, and scratch
+    directories of pushes still being unpacked (.aktt-push.*) are left alone.
+    Files pushed loose into ``incoming_dir`` (the default layout) are claimed
+    by moving manifest.json, and then the files it says were sent, into a new
+    batch directory. Batches claimed earlier but never finished (the receiver
+    stopped) are returned again.
+    """
+    claimed_dir = os.path.join(incoming_dir, CLAIMED_DIRNAME)
+    os.makedirs(claimed_dir, exist_ok=True)
+    for name in sorted(os.listdir(incoming_dir)):
+        path = os.path.join(incoming_dir, name)
+        if name.startswith(BATCH_PREFIX) and os.path.isdir(path):
+            try:
+                os.rename(path, os.path.join(claimed_dir, name))
+            except FileNotFoundError:
+                pass
+
+    manifest_path = os.path.join(incoming_dir, "manifest.json")
+    if os.path.isfile(manifest_path):
+        batch_dir = tempfile.mkdtemp(prefix=LOOSE_BATCH_PREFIX + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".",
+                                     dir=claimed_dir)
+        try:
+            os.rename(manifest_path, os.path.join(batch_dir, "manifest.json"))
+            with open(os.path.join(batch_dir, "manifest.json"), "r", encoding="utf-8") as reader:
+                files = manifest_files(json.load(reader))
+        except FileNotFoundError:
+            os.rmdir(batch_dir)
+        except ValueError:
+            pass
+        else:
+            for name, info in files.items():
+                if info.get("sent") and os.path.isfile(os.path.join(incoming_dir, name)):
+                    os.rename(os.path.join(incoming_dir, name), os.path.join(batch_dir, name))
+
+    return [os.path.join(claimed_dir, name) for name in sorted(os.listdir(claimed_dir))]
+
+
+def run_once(receiver: Receiver, incoming_dir: str) -> bool:
+    """
+    Claim every push waiting in ``incoming_dir``, apply them all and
+    regenerate the reports at most once. Applied batches are deleted and
+    rejected ones kept under .rejected for a look. If a run fails, the batches
+    it didn't get to stay claimed and are applied by the next run. Returns
+    whether the reports were regenerated.
+    """
+    batch_dirs = claim_batches(incoming_dir)
+    if not batch_dirs:
+        write_ack(receiver, incoming_dir)
+        return False
+    receiver.log(f"{len(batch_dirs)} push(es) to apply")
+    rejected_dir = os.path.join(incoming_dir, REJECTED_DIRNAME)
+
+    def finished(batch_dir, error):
+        if error is None:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+        else:
+            os.makedirs(rejected_dir, exist_ok=True)
+            os.replace(batch_dir, os.path.join(rejected_dir, os.path.basename(batch_dir)))
+
+    try:
+        return receiver.process_batches(batch_dirs, finished=finished)
+    except ValueError as error:
+        receiver.log(f"reports not regenerated: {error}")
+        return False
+    finally:
+        write_ack(receiver, incoming_dir)
+
+
+def write_ack(receiver: Receiver, incoming_dir: str) -> None:
+    """
+    Write the source digests and GBL chain of the data ``receiver`` holds to
+    .aktt-ack.json in ``incoming_dir``, where push_to_lxc reads them back
+    before it builds on its last push. The file is left alone when it already
+    says the same.
+    """
+    state = receiver.load_state()
+    ack = json.dumps({"version": ACK_VERSION, "sources": state.get("sources") or {},
+                      "chain": state.get("chain"), "ran_at": state.get("ran_at")}, indent=2).encode("utf-8")
+    path = os.path.join(incoming_dir, ACK_FILENAME)
+    try:
+        with open(path, "rb") as reader:
+            if reader.read() == ack:
+                return
+    except FileNotFoundError:
+        pass
+    _write_atomic(path, ack)
+
+
+def _run_logged(receiver: Receiver, incoming_dir: str) -> None:
+    # A failed run is logged and the service goes on; run_once leaves what it didn't finish claimed.
+    try:
+        run_once(receiver, incoming_dir)
+    except Exception:
+        receiver.log("run failed, what it didn't finish is retried on the next run:\n" + traceback.format_exc().rstrip())
+
+
+def watch(receiver: Receiver, incoming_dir: str, debounce: float = 30, max_delay: float = 120,
+          poll_interval: float = 300) -> None:
+    """
+    Run ``receiver`` as a service on ``incoming_dir`` until interrupted.
+
+    Pushes that land close together are handled as one: once something
+    arrives, the receiver waits until nothing new has come for ``debounce``
+    seconds (but no longer than ``max_delay`` after the first arrival), then
+    claims everything that is there and regenerates once. Duplicates of data
+    already held and pushes older than it are dropped on the way. The
+    incoming directory is also checked every ``poll_interval`` seconds in
+    case a file system event was missed. A run that fails is logged and the
+    watch goes on.
+    """
+    receiver.log(f"watching {incoming_dir}")
+    # The scratch, claimed and rejected directories all start with a dot.
+    watch_directory(incoming_dir, lambda name: not name.startswith("."),
+                    lambda first_change: _run_logged(receiver, incoming_dir), debounce, max_delay, poll_interval)
+
+
+if __name__ == "__main__":
+    import argparse
+    from guild_stats_web import make_engine, USER
+
+    p = argparse.ArgumentParser(description="Apply the pushes in the incoming directory and regenerate the reports.")
+    p.add_argument("--incoming", default="/var/lib/aktt-stats/incoming")
+    p.add_argument("--data-dir", default="/var/lib/aktt-stats/data")
+    p.add_argument("--output-dir", default="/var/lib/aktt-stats/guilds")
+    p.add_argument("--user", default=USER, help="ESO account the SavedVariables belong to")
+    p.add_argument("--watch", action="store_true",
+                   help="Keep running and handle pushes as they arrive instead of once")
+    p.add_argument("--debounce", type=float, default=30,
+                   help="Seconds without a new push before the waiting pushes are handled")
+    p.add_argument("--max-delay", type=float, default=120,
+                   help="Seconds after a push arrives by which it is handled at the latest")
+    a = p.parse_args()
+
+    receiver = Receiver(a.data_dir, a.output_dir, make_engine(a.user))
+    if a.watch:
+        try:
+            watch(receiver, a.incoming, a.debounce, a.max_delay)
+        except KeyboardInterrupt:
+            pass
+    else:
+        run_once(receiver, a.incoming)
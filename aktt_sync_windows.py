@@ -3,11 +3,21 @@
 After guild_stats.py finishes generating its CSVs, call push_to_lxc() to
 copy MasterMerchant.lua + GBLData.lua + a small manifest.json onto the LXC.
 The manifest is written LAST so it serves as the "ready" trigger that the
-LXC's systemd path unit watches for.
+LXC's systemd path unit watches for. All files travel as one tar stream over
+a single compressed ssh session and are renamed into place on the LXC, data
+files first and the manifest last; transport="scp" copies them one at a time
+in the same order.
+
+With batch_dirs=True the unpacked files are instead renamed in one step to a
+batch directory of their own (incoming/push.<UTC time>.<random>), so every
+push arrives complete and no push overwrites another that hasn't been picked
+up yet. Only aktt_receiver.py on the LXC picks those up.
 
 Requires:
-  * Windows 10/11 with built-in OpenSSH client (`scp` on PATH)
+  * Windows 10/11 with built-in OpenSSH client (`ssh`, or `scp` with
+    transport="scp", on PATH)
   * SSH key auth set up to the LXC (no password prompts at runtime)
+  * `tar` and `mktemp` on the LXC
 
 Quick-start integration in guild_stats.py:
 
@@ -24,17 +34,62 @@ Quick-start integration in guild_stats.py:
         lxc_dir="/var/lib/aktt-stats/incoming",  # must exist on LXC
         ssh_key=None,                   # or r"C:\\Users\\you\\.ssh\\id_ed25519"
     )
+
+Delta mode: pass state_file (and the ESO account as user) and only the GBL
+rows added since the last successful push are sent, as a gzipped JSON
+appendix (GBLData.delta.json.gz) next to the manifest. The state file keeps,
+per LXC target, the digest of the last pushed GBLData.lua, a digest chain
+over everything pushed, and per guild the newest pushed timestamp plus a
+digest of the row that carried it. When that row has disappeared or older
+rows have shown up (the chain is broken), the full GBLData.lua is sent again
+and the chain restarts. An unchanged GBLData.lua isn't sent at all, and
+neither is a MasterMerchant.lua with the digest of the last push.
+
+Nothing is built on a push before the LXC has confirmed it: after every run
+aktt_receiver.py writes what it holds (source digests and GBL chain) to
+.aktt-ack.json in the incoming directory, and push_to_lxc reads that back
+first. Unless it names the chain of the last push to this target, because
+that push was rejected, hasn't been applied yet, or another officer's push
+replaced it, everything is sent in full. A file is only left out when the
+receiver holds one with the same digest.
+
+Every manifest lists the data files with their SHA-256, size, row counts and
+whether they were sent, so aktt_receiver.py on the LXC can fill in the
+unsent ones from its own copy and skip regenerating when nothing changed.
+
+Payload mode: pass payload=True (and user) and no Lua is sent at all. The MM
+export rows and the GBL rows, all of them or just the delta, go as typed
+columns in payload.aktt (see payload.py), which guild_stats_web.py --payload
+reads directly. The manifest names it and carries its schema version, SHA-256
+and size.
 """
 from __future__ import annotations
+import gzip
+import hashlib
+import io
 import json
 import os
+import shlex
 import shutil
 import subprocess
 import sys
+import tarfile
 import tempfile
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 
+from payload import PAYLOAD_FILENAME, PAYLOAD_FORMAT, PAYLOAD_VERSION, encode_payload, read_tables
+from savedvars import iter_child_table_strings, gbl_history_path, mm_export_path
+
+STATE_VERSION = 1
+DELTA_FORMAT = "aktt-gbl-delta"
+DELTA_VERSION = 1
+DELTA_FILENAME = "GBLData.delta.json.gz"
+# Written by aktt_receiver.py into the incoming directory after every run.
+ACK_FILENAME = ".aktt-ack.json"
+ACK_VERSION = 1
+
 
 def _scp(local: str, remote: str, ssh_key: str | None) -> None:
     args = ["scp"]
@@ -48,13 +103,228 @@ def _scp(local: str, remote: str, ssh_key: str | None) -> None:
         raise SystemExit(f"scp {local} -> {remote} failed")
 
 
+def _push_scp(uploads: list, base_target: str, ssh_key: str | None) -> None:
+    # One scp (and SSH handshake) per file, in order.
+    for name, source in uploads:
+        label = " (trigger)" if name == "manifest.json" else ""
+        print(f"[aktt-sync] pushing {name}{label} -> {base_target}/{name}")
+        if isinstance(source, bytes):
+            with tempfile.NamedTemporaryFile("wb", delete=False) as tf:
+                tf.write(source)
+                local = tf.name
+            try:
+                _scp(local, f"{base_target}/{name}", ssh_key)
+            finally:
+                try:
+                    os.remove(local)
+                except OSError:
+                    pass
+        else:
+            _scp(source, f"{base_target}/{name}", ssh_key)
+
+
+def _push_ssh_tar(uploads: list, login: str, target_dir: str, ssh_key: str | None,
+                  batch_dir: bool = False) -> None:
+    # The whole batch is streamed as one tar over a single compressed ssh session. The remote
+    # side unpacks it into a scratch directory inside the target and then renames the files
+    # into place in upload order, so manifest.json still appears last and every file appears
+    # complete. With batch_dir the scratch directory itself is renamed to the batch directory
+    # instead, so the batch appears at once and a push never replaces files of another that
+    # hasn't been picked up yet. tar keeps the mtimes, like scp -p.
+    names = [name for name, _ in uploads]
+    script = (f"set -e; cd {shlex.quote(target_dir)}; "
+              "tmp=$(mktemp -d .aktt-push.XXXXXX); trap 'rm -rf \"$tmp\"' EXIT; "
+              'tar -xf - -C "$tmp"; ')
+    if batch_dir:
+        script += 'chmod 755 "$tmp"; mv "$tmp" "push.$(date -u +%Y%m%dT%H%M%SZ).${tmp#.aktt-push.}"'
+        destination = f"{target_dir}/push.*"
+    else:
+        script += " ".join(f'mv -f "$tmp"/{shlex.quote(name)} {shlex.quote(name)};' for name in names)
+        destination = f"{target_dir} (trigger last)"
+    args = ["ssh", "-C"]
+    if ssh_key:
+        args += ["-i", ssh_key]
+    args += [login, script]
+
+    print(f"[aktt-sync] pushing {', '.join(names)} -> {login}:{destination} over one ssh session")
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE, stderr=errors)
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                for name, source in uploads:
+                    if isinstance(source, bytes):
+                        info = tarfile.TarInfo(name)
+                        info.size = len(source)
+                        info.mtime = int(time.time())
+                        tar.addfile(info, io.BytesIO(source))
+                    else:
+                        tar.add(source, arcname=name)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = proc.wait()
+        errors.seek(0)
+        message = errors.read().decode("utf-8", "replace")
+    if returncode != 0:
+        sys.stderr.write(f"ssh failed: {message}\n")
+        raise SystemExit(f"ssh push to {login}:{target_dir} failed")
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as reader:
+        return hashlib.file_digest(reader, "sha256").hexdigest()
+
+
+def _row_timestamp(row: str) -> int | None:
+    try:
+        return int(row.split("\\t", 1)[0])
+    except ValueError:
+        return None
+
+
+def _count_rows(path: str, key_path) -> int:
+    return sum(1 for _ in iter_child_table_strings(path, key_path))
+
+
+def _source_info(path: str, digest: str, acked: dict | None, count_key: str, count: int | None,
+                 key_path) -> dict:
+    # Digest, size and row count of a source file. The count of a file that was already
+    # pushed is taken from the state; counting needs the user's key path into the file.
+    info = {"sha256": digest, "bytes": os.path.getsize(path)}
+    if acked and acked.get("sha256") == digest and acked.get(count_key) is not None:
+        count = acked[count_key]
+    elif count is None and key_path is not None:
+        try:
+            count = _count_rows(path, key_path)
+        except KeyError:
+            count = 0
+    info[count_key] = count
+    return info
+
+
+def _load_state(state_file: str) -> dict:
+    try:
+        with open(state_file, "r", encoding="utf-8") as reader:
+            state = json.load(reader)
+    except (FileNotFoundError, ValueError):
+        return {"version": STATE_VERSION, "targets": {}}
+    if state.get("version") != STATE_VERSION:
+        return {"version": STATE_VERSION, "targets": {}}
+    return state
+
+
+def _save_state(state_file: str, state: dict) -> None:
+    directory = os.path.dirname(os.path.abspath(state_file))
+    fd, partial = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    with os.fdopen(fd, "w", encoding="utf-8") as writer:
+        json.dump(state, writer, indent=2)
+    os.replace(partial, state_file)
+
+
+def _read_ack(login: str, target_dir: str, ssh_key: str | None) -> dict | None:
+    # What the receiver holds, or None if it can't be read (no aktt_receiver.py on the LXC).
+    args = ["ssh"]
+    if ssh_key:
+        args += ["-i", ssh_key]
+    args += [login, "cat " + shlex.quote(f"{target_dir}/{ACK_FILENAME}")]
+    result = subprocess.run(args, check=False, capture_output=True, stdin=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return None
+    try:
+        ack = json.loads(result.stdout)
+    except ValueError:
+        return None
+    return ack if isinstance(ack, dict) and ack.get("version") == ACK_VERSION else None
+
+
+def _gbl_history(gbl_path: str, user: str) -> dict:
+    history = {}
+    for guild, row in iter_child_table_strings(gbl_path, gbl_history_path(user)):
+        history.setdefault(guild, []).append(row)
+    return history
+
+
+def _guild_state(rows: list) -> dict:
+    # The newest timestamp, a digest of the row carrying it, and how many rows are older.
+    stamped = [(ts, row) for row in rows if (ts := _row_timestamp(row)) is not None]
+    if not stamped:
+        return {"high_water": None, "anchor": None, "older_rows": 0}
+    high_water = max(ts for ts, _ in stamped)
+    anchor = [row for ts, row in stamped if ts == high_water][-1]
+    return {"high_water": high_water, "anchor": _sha256(anchor.encode("utf-8")),
+            "older_rows": sum(1 for ts, _ in stamped if ts < high_water)}
+
+
+def gbl_delta(history: dict, previous: dict) -> dict | None:
+    """Return the GBL rows to send per guild since ``previous``, or None if the chain is broken.
+
+    Every row at or after a guild's last pushed timestamp is included, so
+    transactions sharing that second are never lost; the receiver dedupes them
+    on transaction_id. The chain counts as broken when the last pushed row is
+    gone (the file was replaced, or trimmed past it) or when more rows older
+    than it exist than at the last push (history was backfilled).
+    """
+    delta = {}
+    for guild, rows in history.items():
+        last = previous.get(guild)
+        if last is None or last["high_water"] is None:
+            delta[guild] = rows
+            continue
+        high_water = last["high_water"]
+        newer, older, anchored = [], 0, False
+        for row in rows:
+            ts = _row_timestamp(row)
+            if ts is None or ts >= high_water:
+                newer.append(row)
+                if ts == high_water and not anchored:
+                    anchored = _sha256(row.encode("utf-8")) == last["anchor"]
+            else:
+                older += 1
+        if not anchored or older > last["older_rows"]:
+            return None
+        delta[guild] = newer
+    return delta
+
+
 def push_to_lxc(mm_path: str, gbl_path: str, week: str,
                 lxc_user: str, lxc_host: str, lxc_dir: str,
                 ssh_key: str | None = None,
-                guild_name: str | None = None) -> None:
+                guild_name: str | None = None,
+                state_file: str | None = None,
+                user: str | None = None,
+                full: bool = False,
+                transport: str = "ssh",
+                payload: bool = False,
+                batch_dirs: bool = False) -> None:
     """Copy the two Lua files + a manifest onto the LXC. Manifest goes LAST.
 
-    Raises SystemExit on any scp failure. Safe to call repeatedly - the LXC
+    With ``state_file`` set, GBLData.lua is only sent in full when there is no
+    unbroken chain to the last push (or ``full`` is set); otherwise just the
+    new rows of every guild's history are sent. ``user`` is the ESO account
+    the SavedVariables belong to and is required in that mode. The state is
+    only updated once the manifest has been delivered, and the push it records
+    is only built on once the receiver's acknowledgement in ``lxc_dir`` names
+    its chain; until then everything is sent in full. A file the receiver
+    acknowledges holding with the same digest is not sent again.
+
+    By default everything goes over one compressed ssh session as a tar
+    stream (the LXC needs tar and mktemp); ``transport="scp"`` copies the
+    files one scp at a time instead. With ``batch_dirs`` the ssh transport
+    leaves each push in a new batch directory under ``lxc_dir`` rather than
+    renaming the files into ``lxc_dir`` itself; the LXC has to run
+    aktt_receiver.py to pick those up.
+
+    With ``payload`` (``user`` is required) neither Lua file is sent: the MM
+    export rows and the GBL rows that would have been sent, in full or as a
+    delta, go as typed columns in one compact payload.aktt (see payload.py),
+    and the manifest carries its schema version and checksum. If the rows
+    don't fit the payload schema the Lua files are sent after all.
+
+    Raises SystemExit on any ssh/scp failure. Safe to call repeatedly - the LXC
     side dedupes via transaction_id.
     """
     if not Path(mm_path).is_file():
@@ -64,37 +334,170 @@ def push_to_lxc(mm_path: str, gbl_path: str, week: str,
     if week not in ("this", "last"):
         raise SystemExit(f"week must be 'this' or 'last', got {week!r}")
 
+    if state_file and not user:
+        raise SystemExit("user is required to push GBL deltas")
+    if payload and not user:
+        raise SystemExit("user is required to push a payload")
+
     target_dir = lxc_dir.rstrip("/")
     base_target = f"{lxc_user}@{lxc_host}:{target_dir}"
 
-    # 1. Push the data files first under stable filenames
-    print(f"[aktt-sync] pushing MasterMerchant.lua -> {base_target}/MasterMerchant.lua")
-    _scp(mm_path, f"{base_target}/MasterMerchant.lua", ssh_key)
-    print(f"[aktt-sync] pushing GBLData.lua -> {base_target}/GBLData.lua")
-    _scp(gbl_path, f"{base_target}/GBLData.lua", ssh_key)
+    # Work out whether GBLData.lua can go as a delta against the last push to this target.
+    delta, history, previous, ack = None, None, None, None
+    gbl_digest = _file_sha256(gbl_path)
+    mm_digest = _file_sha256(mm_path)
+    gbl_mode = "full"
+    if state_file:
+        state = _load_state(state_file)
+        previous = state["targets"].get(base_target)
+        if previous and not full:
+            # The last push only counts once the receiver has applied it and nothing has replaced it.
+            ack = _read_ack(f"{lxc_user}@{lxc_host}", target_dir, ssh_key)
+            if ack is None or ack.get("chain") != previous["chain"]:
+                print("[aktt-sync] the LXC hasn't confirmed the last push, sending everything in full")
+                previous = None
+        if previous and not full and previous["gbl_digest"] == gbl_digest:
+            delta, guilds, gbl_mode = {}, previous["guilds"], "unchanged"
+        else:
+            history = _gbl_history(gbl_path, user)
+            guilds = {guild: _guild_state(rows) for guild, rows in history.items()}
+            if previous and not full:
+                delta = gbl_delta(history, previous["guilds"])
+                if delta is None:
+                    print("[aktt-sync] GBL history no longer follows the last push, sending it in full")
+                else:
+                    gbl_mode = "delta"
 
-    # 2. Write manifest.json locally and push it LAST. Its arrival on the LXC
-    #    is the trigger the systemd path unit fires on.
+    # The source files of the last push that the LXC says it still holds. A file whose digest
+    # hasn't changed since is not sent again; the manifest still lists it, marked as not sent.
+    acked = {}
+    if previous and not full:
+        held = ack.get("sources") or {}
+        acked = {name: info for name, info in previous.get("files", {}).items()
+                 if held.get(name) == info.get("sha256")}
+    send_mm = acked.get("MasterMerchant.lua", {}).get("sha256") != mm_digest
+
+    # The rows that are about to be sent, as typed columns instead of Lua.
+    payload_data = None
+    if payload and (send_mm or gbl_mode != "unchanged"):
+        try:
+            gbl_table, mm_table = read_tables(gbl_path, mm_path, user,
+                                              history if delta is None else delta)
+            payload_data = encode_payload(gbl_table, mm_table)
+        except (KeyError, ValueError) as error:
+            print(f"[aktt-sync] can't build {PAYLOAD_FILENAME} ({error}), sending the Lua files")
+
+    # Row counts already known from the work above save another pass over the Lua file.
+    if payload_data is not None:
+        mm_members = mm_table.num_rows
+    else:
+        mm_members = None
+    if history is not None:
+        gbl_rows = sum(len(rows) for rows in history.values())
+    elif payload_data is not None and gbl_mode == "full":
+        gbl_rows = gbl_table.num_rows
+    else:
+        gbl_rows = None
+    files = {
+        "MasterMerchant.lua": _source_info(mm_path, mm_digest, acked.get("MasterMerchant.lua"),
+                                           "mm_members", mm_members, mm_export_path(user) if user else None),
+        "GBLData.lua": _source_info(gbl_path, gbl_digest, acked.get("GBLData.lua"),
+                                    "gbl_rows", gbl_rows, gbl_history_path(user) if user else None),
+    }
+
+    # 1. The data files go first under stable filenames
+    uploads = []
+    if payload_data is not None:
+        uploads.append((PAYLOAD_FILENAME, payload_data))
+        files[PAYLOAD_FILENAME] = {"sha256": _sha256(payload_data), "bytes": len(payload_data),
+                                   "gbl_rows": gbl_table.num_rows, "mm_members": mm_table.num_rows}
+        print(f"[aktt-sync] {gbl_table.num_rows} GBL rows and {mm_table.num_rows} MM rows "
+              f"go in {PAYLOAD_FILENAME} ({len(payload_data)} bytes)")
+    elif send_mm:
+        uploads.append(("MasterMerchant.lua", mm_path))
+        files["MasterMerchant.lua"]["sent"] = True
+    if gbl_mode == "full":
+        if payload_data is None:
+            uploads.append(("GBLData.lua", gbl_path))
+            files["GBLData.lua"]["sent"] = True
+        chain = _sha256(b"full\0" + gbl_digest.encode("ascii"))
+    elif gbl_mode == "delta":
+        if payload_data is None:
+            body = json.dumps({"format": DELTA_FORMAT, "version": DELTA_VERSION, "user": user,
+                               "base_chain": previous["chain"], "guilds": delta},
+                              separators=(",", ":")).encode("utf-8")
+            rows = sum(len(guild_rows) for guild_rows in delta.values())
+            print(f"[aktt-sync] {rows} new GBL rows go in {DELTA_FILENAME}")
+            compressed = gzip.compress(body, mtime=0)
+            uploads.append((DELTA_FILENAME, compressed))
+            files[DELTA_FILENAME] = {"sha256": _sha256(compressed), "bytes": len(compressed),
+                                     "gbl_rows": rows}
+        else:
+            body = payload_data
+        chain = _sha256(previous["chain"].encode("ascii") + b"\0" + _sha256(body).encode("ascii"))
+    else:
+        chain = previous["chain"]
+    for name, info in files.items():
+        info.setdefault("sent", name not in ("MasterMerchant.lua", "GBLData.lua"))
+    if not send_mm and payload_data is None:
+        print("[aktt-sync] MasterMerchant.lua is unchanged since the last push, not sending it")
+    if gbl_mode == "unchanged":
+        print("[aktt-sync] GBLData.lua is unchanged since the last push, not sending it")
+    elif gbl_mode == "delta":
+        print("[aktt-sync] GBLData.lua follows the last push, sending only the new rows as a delta")
+
+    # 2. manifest.json goes LAST. With scp its arrival on the LXC is the trigger
+    #    the receiver waits for.
     manifest = {
         "version": 1,
         "week": week,
-        "ran_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
-        "mm_filename": "MasterMerchant.lua",
-        "gbl_filename": "GBLData.lua",
+        "ran_at": datetime.now(timezone.utc).isoformat(timespec="microseconds"),
+        "mm_filename": "MasterMerchant.lua" if files["MasterMerchant.lua"]["sent"] else None,
+        "gbl_filename": "GBLData.lua" if files["GBLData.lua"]["sent"] else None,
         "guild_name": guild_name,
+        # The ESO account the SavedVariables belong to, for the key paths of the Lua files.
+        "user": user,
         "source_host": os.environ.get("COMPUTERNAME") or "windows",
+        # Digest, size, row counts and whether it was sent, for every data file. The
+        # receiver can skip regenerating when none of the source digests changed.
+        "files": files,
     }
-    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as tf:
-        json.dump(manifest, tf, indent=2)
-        local_manifest = tf.name
-    try:
-        print(f"[aktt-sync] pushing manifest.json (trigger) -> {base_target}/manifest.json")
-        _scp(local_manifest, f"{base_target}/manifest.json", ssh_key)
-    finally:
-        try:
-            os.remove(local_manifest)
-        except OSError:
-            pass
+    if state_file:
+        # The receiver applies a delta on top of the push whose chain matches base_chain.
+        manifest["gbl_mode"] = gbl_mode
+        manifest["gbl_chain"] = chain
+        if gbl_mode == "delta":
+            manifest["version"] = 2
+            manifest["gbl_base_chain"] = previous["chain"]
+            if payload_data is None:
+                manifest["gbl_delta_filename"] = DELTA_FILENAME
+    if payload_data is not None:
+        # Both tables are in the payload; with gbl_mode "delta" its GBL rows are the new ones only.
+        manifest["version"] = 3
+        manifest["payload_filename"] = PAYLOAD_FILENAME
+        manifest["payload_format"] = PAYLOAD_FORMAT
+        manifest["payload_version"] = PAYLOAD_VERSION
+        manifest["payload_sha256"] = files[PAYLOAD_FILENAME]["sha256"]
+        manifest["payload_bytes"] = files[PAYLOAD_FILENAME]["bytes"]
+    if not (files["MasterMerchant.lua"]["sent"] or payload_data is not None) \
+            or gbl_mode == "unchanged":
+        # Some data has to be taken from what the receiver kept of earlier pushes.
+        manifest["version"] = 4
+    uploads.append(("manifest.json", json.dumps(manifest, indent=2).encode("utf-8")))
+
+    if transport == "scp":
+        _push_scp(uploads, base_target, ssh_key)
+    elif transport == "ssh":
+        _push_ssh_tar(uploads, f"{lxc_user}@{lxc_host}", target_dir, ssh_key, batch_dirs)
+    else:
+        raise SystemExit(f"transport must be 'ssh' or 'scp', got {transport!r}")
+
+    if state_file:
+        acked = {name: {key: value for key, value in files[name].items() if key != "sent"}
+                 for name in ("MasterMerchant.lua", "GBLData.lua")}
+        state["targets"][base_target] = {"gbl_digest": gbl_digest, "chain": chain, "guilds": guilds,
+                                         "files": acked}
+        _save_state(state_file, state)
     print("[aktt-sync] done.")
 
 
@@ -109,7 +512,18 @@ if __name__ == "__main__":
     p.add_argument("--lxc-host", required=True)
     p.add_argument("--lxc-dir", default="/var/lib/aktt-stats/incoming")
     p.add_argument("--ssh-key", default=None)
+    p.add_argument("--state-file", default=None,
+                   help="Push only new GBL rows, remembering what was sent in this file")
+    p.add_argument("--user", default=None, help="ESO account the SavedVariables belong to")
+    p.add_argument("--full", action="store_true", help="Send GBLData.lua in full this time")
+    p.add_argument("--transport", default="ssh", choices=("ssh", "scp"))
+    p.add_argument("--payload", action="store_true",
+                   help="Send the rows as a compact payload.aktt instead of the Lua files")
+    p.add_argument("--batch-dirs", action="store_true",
+                   help="Leave each push in a batch directory of its own (needs aktt_receiver.py)")
     a = p.parse_args()
     push_to_lxc(mm_path=a.mm, gbl_path=a.gbl, week=a.week,
                 lxc_user=a.lxc_user, lxc_host=a.lxc_host,
-                lxc_dir=a.lxc_dir, ssh_key=a.ssh_key)
+                lxc_dir=a.lxc_dir, ssh_key=a.ssh_key,
+                state_file=a.state_file, user=a.user, full=a.full,
+                transport=a.transport, payload=a.payload, batch_dirs=a.batch_dirs)
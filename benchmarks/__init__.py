@@ -0,0 +1,4 @@
+"""
+Benchmarks for the guild report scripts. Run them from the repository root,
+e.g. ``python -m benchmarks.concurrency``.
+"""
@@ -0,0 +1,81 @@
+"""
+Concurrency stress benchmark for ReportEngine.
+
+A single engine is shared by a pool of threads, each running complete report
+sessions (this week and last week, alternating) on the same synthetic files.
+Every session's output is compared with a serial reference run, so the
+benchmark doubles as a check that concurrent sessions don't leak state into
+each other. Throughput is reported per thread count.
+
+    python -m benchmarks.concurrency --transactions 20000 --sessions 32 --threads 1 2 4 8
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks import synthetic
+from guild_stats import RAFFLE, DONATION_SUMMARY_FORMAT, EXCLUDE_USERS
+from report_engine import ReportEngine, ReportConfig
+
+WEEKS = ["this", "last"]
+
+
+def make_engine(guild_name: str) -> ReportEngine:
+    # No date line, so that outputs can be compared, and no cache or store, so that every session
+    # does the full amount of work.
+    return ReportEngine(ReportConfig(
+        guild_name=guild_name,
+        user=synthetic.USER,
+        raffle=RAFFLE,
+        donation_summary_format=DONATION_SUMMARY_FORMAT,
+        exclude_users=EXCLUDE_USERS,
+        prefix_date=False,
+        verbose=False,
+    ))
+
+
+def run_session(engine: ReportEngine, gbl_content: str, mm_content: str, week: str, now: datetime) -> dict:
+    return engine.generate_reports(gbl_content, mm_content, engine.generate_windows(week, now=now))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report sessions per second across thread counts.")
+    parser.add_argument('--transactions', type=int, default=20000,
+                        help='GBL history rows per guild')
+    parser.add_argument('--members', type=int, default=500)
+    parser.add_argument('--sessions', type=int, default=32,
+                        help='Report sessions run at each thread count')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    gbl_content = synthetic.gbl_data(args.transactions, args.members, now=int(now.timestamp()))
+    mm_content = synthetic.mm_data(args.members)
+    engine = make_engine(synthetic.GUILD_NAMES[0])
+    expected = {week: run_session(engine, gbl_content, mm_content, week, now) for week in WEEKS}
+
+    print(f"{args.transactions} transactions per guild, {args.members} members, "
+          f"{args.sessions} sessions per run")
+    print(f"{'threads':>7} {'wall s':>8} {'sessions/s':>10} {'speedup':>8}")
+    baseline = None
+    for threads in args.threads:
+        weeks = [WEEKS[index % len(WEEKS)] for index in range(args.sessions)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(
+                lambda week: run_session(engine, gbl_content, mm_content, week, now), weeks))
+        wall = time.perf_counter() - started
+
+        for week, result in zip(weeks, results):
+            if result != expected[week]:
+                raise SystemExit(f"Session output for week {week!r} differs from the serial run "
+                                 f"with {threads} threads")
+        rate = args.sessions / wall
+        baseline = baseline or rate
+        print(f"{threads:>7} {wall:>8.2f} {rate:>10.2f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Time and peak memory of pulling the rows a report run needs out of the
+SavedVariables files: the GBL history of GBLData.lua and the member export of
+MasterMerchant.lua.
+
+    slpp     the whole file read into a str and decoded into Python tables
+    stream   the file read as a text stream and tokenized a chunk at a time
+    mmap     the file memory-mapped and scanned as bytes (what a path gets)
+
+The rows are counted as they come out rather than kept, so the peak is what
+the extraction itself holds. The files hold several guilds and only the
+first guild's rows are extracted, as parse_data does. MasterMerchant.lua
+gets --mm-sales sales and listing records ahead of the export, like the
+settings and data MM keeps there, which the scanners skip without decoding.
+
+    python -m benchmarks.extraction --transactions 500000 --guilds 3 --mm-sales 200000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from slpp import SLPP
+
+from benchmarks import synthetic
+from savedvars import iter_table_strings, gbl_history_path, mm_export_path
+
+# The key path of the rows each file is read for.
+KEY_PATHS = {
+    "GBLData.lua": gbl_history_path,
+    "MasterMerchant.lua": mm_export_path,
+}
+
+
+def measure(extract) -> tuple:
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        rows = extract()
+        return rows, time.perf_counter() - started, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def slpp_rows(path: str, key_path: tuple) -> int:
+    with open(path, 'r') as reader:
+        content = reader.read()
+    table = SLPP().decode("{" + content + "}")
+    for key in key_path:
+        table = table[key]
+    return len(table)
+
+
+def stream_rows(path: str, key_path: tuple) -> int:
+    with open(path, 'r') as reader:
+        return sum(1 for _ in iter_table_strings(reader, key_path))
+
+
+def mapped_rows(path: str, key_path: tuple) -> int:
+    return sum(1 for _ in iter_table_strings(path, key_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the ways of extracting GBL and MM rows.")
+    parser.add_argument('--transactions', type=int, default=200000, help='GBL history rows per guild')
+    parser.add_argument('--members', type=int, default=500, help='MM export members per guild')
+    parser.add_argument('--mm-sales', type=int, default=100000,
+                        help='Sales and listing records in MasterMerchant.lua next to the export')
+    parser.add_argument('--guilds', type=int, default=3)
+    parser.add_argument('--no-slpp', action='store_true', help="skip the slpp decode, which is slow")
+    args = parser.parse_args()
+
+    guilds = synthetic.guild_names(args.guilds)
+    methods = [("stream", stream_rows), ("mmap", mapped_rows)]
+    if not args.no_slpp:
+        methods.insert(0, ("slpp", slpp_rows))
+    with tempfile.TemporaryDirectory() as directory:
+        paths = synthetic.write_files(directory, transactions=args.transactions, member_count=args.members,
+                                      guilds=guilds, mm_sales=args.mm_sales)
+        print(f"{args.guilds} guilds of {args.transactions} GBL rows and {args.members} MM members, "
+              f"{args.mm_sales} MM sales records")
+        print(f"{'':<20} {'MB':>7} {'':<8} {'rows':>9} {'wall s':>8} {'peak MB':>9}")
+        for path in paths:
+            name = os.path.basename(path)
+            key_path = KEY_PATHS[name](synthetic.USER, guilds[0])
+            for method, extract in methods:
+                rows, wall, peak = measure(lambda: extract(path, key_path))
+                print(f"{name:<20} {os.path.getsize(path) / 2 ** 20:>7.1f} {method:<8} {rows:>9} "
+                      f"{wall:>8.2f} {peak / 2 ** 20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
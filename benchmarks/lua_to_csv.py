@@ -0,0 +1,115 @@
+"""
+Benchmark of lua_to_csv.lua2csv against the whole-file regex chain it replaced.
+
+A synthetic GBLData.lua is written to a temporary directory and converted by
+each implementation in a fresh interpreter, so that the reported peak memory
+belongs to that run alone (the peak RSS of a process carries over into the
+programs it starts, so even the input is generated in a child process). Both
+outputs are compared byte for byte.
+
+    python -m benchmarks.lua_to_csv --transactions 500000
+"""
+
+import argparse
+import filecmp
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import synthetic
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def whole_file(source_file: str, dest_file: str):
+    # lua2csv as it was before streaming: the file and the stripped copy are held in full.
+    from lua_to_csv import strip_lua
+
+    with open(source_file, 'r') as reader:
+        orig_lua = reader.read()
+
+    all_content = strip_lua(orig_lua)
+
+    dest_split = dest_file.split('.', 1)
+    dest_file_raffle = dest_split[0] + '_raffle.' + dest_split[1]
+
+    with open(dest_file, 'w') as writer:
+        writer.write(all_content)
+
+    raffle_content = re.sub(r'^[0-9]+\t@.+\t(?:(?!dep_gold).)+\t.*\t.*\t.*\t.*\t.*\t.*\n', '', all_content, flags=re.MULTILINE)
+
+    with open(dest_file_raffle, 'w') as writer:
+        writer.write(raffle_content)
+
+
+def streaming(source_file: str, dest_file: str):
+    from lua_to_csv import lua2csv
+
+    lua2csv(source_file, dest_file)
+
+
+IMPLEMENTATIONS = {
+    "regex chain": whole_file,
+    "streaming": streaming,
+}
+
+
+def run_child(name: str, source_file: str, dest_file: str):
+    started = time.perf_counter()
+    IMPLEMENTATIONS[name](source_file, dest_file)
+    wall = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    print(json.dumps({"wall": wall, "peak_mb": peak}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time lua2csv against the whole-file regex chain.")
+    parser.add_argument('--transactions', type=int, default=500000, help='GBL history rows per guild')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument('--generate', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(*args.child)
+        return
+    if args.generate:
+        with open(args.generate, 'w') as writer:
+            writer.write(synthetic.gbl_data(args.transactions))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        source_file = os.path.join(directory, "GBLData.lua")
+        subprocess.run([sys.executable, "-m", "benchmarks.lua_to_csv", "--generate", source_file,
+                        "--transactions", str(args.transactions)], check=True)
+        size_mb = os.path.getsize(source_file) / 2 ** 20
+        print(f"GBLData.lua: {size_mb:.1f} MB, {args.transactions} transactions per guild")
+        print(f"{'implementation':<14} {'wall s':>8} {'MB/s':>8} {'peak RSS MB':>12}")
+
+        outputs = []
+        for name in IMPLEMENTATIONS:
+            dest_file = os.path.join(directory, name.replace(' ', '_') + ".csv")
+            result = subprocess.run([sys.executable, "-m", "benchmarks.lua_to_csv", "--child",
+                                     name, source_file, dest_file],
+                                    check=True, capture_output=True, text=True)
+            stats = json.loads(result.stdout.splitlines()[-1])
+            peak = f"{stats['peak_mb']:.0f}" if stats["peak_mb"] is not None else "n/a"
+            print(f"{name:<14} {stats['wall']:>8.2f} {size_mb / stats['wall']:>8.1f} {peak:>12}")
+            outputs.append(dest_file)
+
+        reference = outputs[0]
+        for dest_file in outputs[1:]:
+            for suffix in ("", "_raffle"):
+                first, second = (path.replace(".csv", suffix + ".csv") for path in (reference, dest_file))
+                if not filecmp.cmp(first, second, shallow=False):
+                    raise SystemExit(f"{os.path.basename(second)} differs from {os.path.basename(first)}")
+        print("Outputs identical")
+
+
+if __name__ == "__main__":
+    main()
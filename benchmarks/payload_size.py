@@ -0,0 +1,59 @@
+"""
+Size and load time of the compact payload against the raw SavedVariables
+files it replaces, both as they are and compressed the way ssh -C would send
+them.
+
+    python -m benchmarks.payload_size --transactions 200000
+"""
+
+import argparse
+import tempfile
+import time
+import zlib
+
+from benchmarks import synthetic
+from payload import read_tables, encode_payload, decode_payload
+from report_engine import ReportEngine, ReportConfig
+from savedvars import iter_child_table_strings, gbl_history_path
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the payload with the raw Lua files.")
+    parser.add_argument('--transactions', type=int, default=200000, help='GBL history rows per guild')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        gbl_file, mm_file = synthetic.write_files(directory, transactions=args.transactions)
+        raw = b""
+        for path in (gbl_file, mm_file):
+            with open(path, "rb") as reader:
+                raw += reader.read()
+
+        tables, build_wall = timed(read_tables, gbl_file, mm_file, synthetic.USER)
+        data, encode_wall = timed(encode_payload, *tables)
+        decoded, decode_wall = timed(decode_payload, data)
+        if not all(table.equals(expected) for table, expected in zip(decoded, tables)):
+            raise SystemExit("The payload doesn't decode to the tables it was built from")
+
+        # What parse_all_guilds reads out of the Lua files when there is no payload.
+        engine = ReportEngine(ReportConfig(synthetic.GUILD_NAMES[0], synthetic.USER, raffle={},
+                                           verbose=False))
+        _, gbl_wall = timed(list, iter_child_table_strings(gbl_file, gbl_history_path(synthetic.USER)))
+        _, mm_wall = timed(engine.read_mm_exports, mm_file)
+
+        print(f"{'':<22} {'bytes':>12} {'ssh -C bytes':>13}")
+        print(f"{'GBLData + MM .lua':<22} {len(raw):>12} {len(zlib.compress(raw, 6)):>13}")
+        print(f"{'payload.aktt':<22} {len(data):>12} {len(zlib.compress(data, 6)):>13}")
+        print(f"payload is {len(data) / len(raw):.1%} of the Lua files")
+        print(f"sender: read {build_wall:.2f} s, encode {encode_wall:.2f} s")
+        print(f"receiver: decode payload {decode_wall:.3f} s, parse Lua {gbl_wall + mm_wall:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
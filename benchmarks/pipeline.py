@@ -0,0 +1,258 @@
+"""
+Stage by stage benchmark of the whole report pipeline on synthetic data.
+
+GBLData.lua and MasterMerchant.lua are generated at the requested scale (see
+synthetic.py) and every stage of a multi-guild run is then timed on its own,
+in order, each working on the output of the one before:
+
+    read              both files read into memory
+    lua decode        GBL history rows and MM export rows pulled out of the Lua
+    row split         GBL rows split into typed columns (TransactionFrame)
+    aggregation       MM members and per-user totals of the summary windows
+    raffle selection  raffle purchases of the raffle windows
+    csv write         every guild's report files written
+    lua2csv           lua_to_csv.lua2csv on GBLData.lua
+
+For each stage the median wall and CPU time of --repeat runs is reported,
+with the peak memory allocated while it runs (measured in one extra run under
+tracemalloc, which slows Python code down too much to time it at the same
+time) and the rows it handles per second. The report is printed as a markdown
+table and can be saved as JSON and markdown; with --baseline the JSON of an
+earlier run, e.g. of another version, is compared against.
+
+    python -m benchmarks.pipeline --members 5000 --transactions 1000000 --guilds 3 \\
+        --json pipeline.json --markdown pipeline.md
+    python -m benchmarks.pipeline ... --baseline pipeline.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from benchmarks import synthetic
+from guild_stats import RAFFLE, DONATION_SUMMARY_FORMAT, EXCLUDE_USERS
+from gbl_frame import TransactionFrame
+from lua_to_csv import lua2csv
+from report_engine import ReportEngine, ReportConfig, guild_output_dir
+from savedvars import iter_child_table_strings, gbl_history_path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class PipelineRun:
+    """The inputs of one benchmark run and what each stage hands to the next."""
+
+    def __init__(self, gbl_file: str, mm_file: str, output_dir: str, now: datetime):
+        self.gbl_file = gbl_file
+        self.mm_file = mm_file
+        self.output_dir = output_dir
+        self.now = now
+        # No date line and no cache or store, so that every stage does the full amount of work.
+        self.engine = ReportEngine(ReportConfig(
+            guild_name=synthetic.GUILD_NAMES[0],
+            user=synthetic.USER,
+            raffle=RAFFLE,
+            donation_summary_format=DONATION_SUMMARY_FORMAT,
+            exclude_users=EXCLUDE_USERS,
+            prefix_date=False,
+            verbose=False,
+        ))
+        self.gbl_content = self.mm_content = None
+        self.gbl_rows, self.mm_rows, self.transactions, self.windows = {}, {}, {}, {}
+
+    def gbl_row_count(self) -> int:
+        return sum(len(frame.frame) for frame in self.transactions.values())
+
+    def read(self) -> int:
+        with open(self.gbl_file, 'r') as reader:
+            self.gbl_content = reader.read()
+        with open(self.mm_file, 'r') as reader:
+            self.mm_content = reader.read()
+        return self.gbl_content.count('\n') + self.mm_content.count('\n')
+
+    def decode(self) -> int:
+        self.gbl_rows = {}
+        for guild_name, row in iter_child_table_strings(io.StringIO(self.gbl_content),
+                                                        gbl_history_path(synthetic.USER)):
+            self.gbl_rows.setdefault(guild_name, []).append(row)
+        self.mm_rows = self.engine.read_mm_exports(io.StringIO(self.mm_content))
+        return sum(map(len, self.gbl_rows.values())) + sum(map(len, self.mm_rows.values()))
+
+    def split(self) -> int:
+        config = self.engine.config
+        self.transactions = {guild_name: TransactionFrame(rows, config.raffle, config.enable_raffle,
+                                                          config.exclude_users)
+                             for guild_name, rows in self.gbl_rows.items()}
+        return self.gbl_row_count()
+
+    def aggregate(self) -> int:
+        engine = self.engine
+        self.windows = {}
+        for guild_name, transactions in self.transactions.items():
+            self.windows[guild_name] = windows = engine.generate_windows("this", now=self.now)
+            summary_windows = [window for window in windows if window.kind == "summary"]
+            engine.add_mm_rows_to_users(summary_windows, self.mm_rows.get(guild_name, []))
+            for window in summary_windows:
+                engine.add_transactions_to_users(window, transactions)
+        return self.gbl_row_count()
+
+    def select_raffle(self) -> int:
+        for guild_name, transactions in self.transactions.items():
+            for window in self.windows[guild_name]:
+                if window.kind == "raffle":
+                    window.raffle_tix = []
+                    self.engine.add_transactions_to_raffle(window, transactions)
+        return self.gbl_row_count()
+
+    def write_csv(self) -> int:
+        rows = 0
+        for guild_name, windows in self.windows.items():
+            guild_dir = guild_output_dir(self.output_dir, guild_name)
+            os.makedirs(guild_dir, exist_ok=True)
+            for window in windows:
+                self.engine.write_report(window, guild_dir)
+                rows += len(window.users) if window.kind == "summary" else len(window.raffle_tix)
+        return rows
+
+    def lua2csv(self) -> int:
+        lua2csv(self.gbl_file, os.path.join(self.output_dir, "GBLData.csv"),
+                RAFFLE["ticket_price"], RAFFLE["deposit_modifier"])
+        return sum(map(len, self.gbl_rows.values()))
+
+
+STAGES = [
+    ("read", PipelineRun.read),
+    ("lua decode", PipelineRun.decode),
+    ("row split", PipelineRun.split),
+    ("aggregation", PipelineRun.aggregate),
+    ("raffle selection", PipelineRun.select_raffle),
+    ("csv write", PipelineRun.write_csv),
+    ("lua2csv", PipelineRun.lua2csv),
+]
+
+
+def measure(stage, run: PipelineRun, repeat: int, memory: bool) -> dict:
+    walls, cpus = [], []
+    for _ in range(repeat):
+        started, started_cpu = time.perf_counter(), time.process_time()
+        rows = stage(run)
+        walls.append(time.perf_counter() - started)
+        cpus.append(time.process_time() - started_cpu)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            stage(run)
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    wall = statistics.median(walls)
+    return {"wall_s": wall, "cpu_s": statistics.median(cpus), "peak_mb": peak, "rows": rows,
+            "rows_per_s": rows / wall if wall else None}
+
+
+def git_version() -> str | None:
+    try:
+        result = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def markdown(report: dict, baseline: dict | None = None) -> str:
+    params = report["params"]
+    lines = [f"# Pipeline benchmark ({report['version'] or 'unknown version'})", "",
+             f"{params['guilds']} guild(s), {params['members']} members and {params['transactions']} "
+             f"transactions per guild, mix {params['mix']}; GBLData.lua {report['gbl_mb']:.1f} MB, "
+             f"MasterMerchant.lua {report['mm_mb']:.1f} MB; Python {report['python']}", ""]
+    header = "| stage | wall s | CPU s | peak MB | rows | rows/s |"
+    rule = "|---|---:|---:|---:|---:|---:|"
+    if baseline:
+        header += f" speedup vs {baseline['version'] or 'baseline'} |"
+        rule += "---:|"
+    lines += [header, rule]
+    before = {stage["name"]: stage for stage in baseline["stages"]} if baseline else {}
+    for stage in report["stages"]:
+        peak = f"{stage['peak_mb']:.1f}" if stage["peak_mb"] is not None else "n/a"
+        rate = f"{stage['rows_per_s']:,.0f}" if stage["rows_per_s"] else "n/a"
+        line = (f"| {stage['name']} | {stage['wall_s']:.3f} | {stage['cpu_s']:.3f} | {peak} | "
+                f"{stage['rows']:,} | {rate} |")
+        if baseline:
+            old = before.get(stage["name"])
+            line += f" {old['wall_s'] / stage['wall_s']:.2f}x |" if old and stage["wall_s"] else " n/a |"
+        lines.append(line)
+    if report["peak_rss_mb"] is not None:
+        lines += ["", f"Peak RSS of the whole run: {report['peak_rss_mb']:.0f} MB"]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory-profile each stage of the report pipeline.")
+    parser.add_argument('--members', type=int, default=500, help='Guild members per guild')
+    parser.add_argument('--transactions', type=int, default=100000, help='GBL history rows per guild')
+    parser.add_argument('--guilds', type=int, default=2, help='Number of guilds')
+    parser.add_argument('--mix', type=synthetic.parse_mix, default=synthetic.TRANSACTION_MIX,
+                        help='Transaction type weights, e.g. dep_gold=3,dep_item=1,wd_gold=1,wd_item=1')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc run of each stage')
+    parser.add_argument('--json', help='Save the report as JSON to this file')
+    parser.add_argument('--markdown', help='Save the report as markdown to this file')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as reader:
+            baseline = json.load(reader)
+
+    now = datetime.now(timezone.utc)
+    with tempfile.TemporaryDirectory() as directory:
+        gbl_file, mm_file = synthetic.write_files(
+            directory, transactions=args.transactions, member_count=args.members,
+            guilds=synthetic.guild_names(args.guilds), seed=args.seed, mix=args.mix,
+            now=int(now.timestamp()))
+        run = PipelineRun(gbl_file, mm_file, os.path.join(directory, "out"), now)
+        stages = []
+        for name, stage in STAGES:
+            print(f"{name}...", file=sys.stderr)
+            stages.append({"name": name, **measure(stage, run, args.repeat, not args.no_memory)})
+
+        report = {
+            "version": git_version(),
+            "ran_at": now.isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {"members": args.members, "transactions": args.transactions, "guilds": args.guilds,
+                       "mix": args.mix, "seed": args.seed, "repeat": args.repeat},
+            "gbl_mb": os.path.getsize(gbl_file) / 2 ** 20,
+            "mm_mb": os.path.getsize(mm_file) / 2 ** 20,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None,
+            "stages": stages,
+        }
+
+    text = markdown(report, baseline)
+    print(text)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as writer:
+            json.dump(report, writer, indent=2)
+    if args.markdown:
+        with open(args.markdown, "w", encoding="utf-8") as writer:
+            writer.write(text)
+
+
+if __name__ == "__main__":
+    main()
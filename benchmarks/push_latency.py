@@ -0,0 +1,124 @@
+"""
+End-to-end latency of push_to_lxc with the per-file scp transport and with
+the single ssh session tar stream.
+
+With no real LXC at hand the benchmark puts loopback stand-ins for `ssh` and
+`scp` first on PATH. They run the transfer against a local directory, but only
+after sleeping for a simulated SSH handshake and for the time the payload
+would take on a link of the given bandwidth (compressed with zlib, as OpenSSH
+does, when -C is passed). After each push the "remote" files are compared with
+the originals.
+
+    python -m benchmarks.push_latency --handshake-ms 150 --bandwidth-mbit 50
+
+With --login user@host and --remote-dir the real ssh/scp are used instead.
+"""
+
+import argparse
+import filecmp
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from aktt_sync_windows import push_to_lxc
+from benchmarks import synthetic
+
+_SSH_SHIM = '''#!{python}
+import os, subprocess, sys, time, zlib
+args, compress = sys.argv[1:], False
+while args and args[0].startswith("-"):
+    flag = args.pop(0)
+    compress = compress or flag == "-C"
+    if flag in ("-i", "-o", "-p", "-l"):
+        args.pop(0)
+login, command = args[0], " ".join(args[1:])
+data = sys.stdin.buffer.read()
+wire = len(zlib.compress(data, 6)) if compress else len(data)
+time.sleep({handshake} + wire / {bytes_per_second})
+sys.exit(subprocess.run(["sh", "-c", command], input=data).returncode)
+'''
+
+_SCP_SHIM = '''#!{python}
+import os, shutil, sys, time
+args = sys.argv[1:]
+local, remote = args[-2], args[-1]
+time.sleep({handshake} + os.path.getsize(local) / {bytes_per_second})
+shutil.copy2(local, remote.split(":", 1)[1])
+'''
+
+
+def install_shims(directory: str, handshake: float, bytes_per_second: float) -> None:
+    for name, template in (("ssh", _SSH_SHIM), ("scp", _SCP_SHIM)):
+        path = os.path.join(directory, name)
+        with open(path, "w") as writer:
+            writer.write(template.format(python=sys.executable, handshake=handshake,
+                                         bytes_per_second=bytes_per_second))
+        os.chmod(path, 0o755)
+
+
+def check_remote(remote_dir: str, mm_file: str, gbl_file: str) -> None:
+    # With batch_dirs the ssh transport leaves each push in a push.* batch directory; otherwise
+    # the files land loose in the remote directory.
+    batches = [name for name in os.listdir(remote_dir) if name.startswith("push.")]
+    batch_dir = os.path.join(remote_dir, batches[0]) if batches else remote_dir
+    for local, name in ((mm_file, "MasterMerchant.lua"), (gbl_file, "GBLData.lua")):
+        if not filecmp.cmp(local, os.path.join(batch_dir, name), shallow=False):
+            raise SystemExit(f"{name} on the remote side differs from the original")
+    with open(os.path.join(batch_dir, "manifest.json"), encoding="utf-8") as reader:
+        json.load(reader)
+    if batches:
+        shutil.rmtree(batch_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push latency of the scp and ssh tar transports.")
+    parser.add_argument('--transactions', type=int, default=50000, help='GBL history rows per guild')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--handshake-ms', type=float, default=150,
+                        help='Simulated SSH connection setup time')
+    parser.add_argument('--bandwidth-mbit', type=float, default=50, help='Simulated link bandwidth')
+    parser.add_argument('--login', help='Push to this real user@host instead of the loopback')
+    parser.add_argument('--remote-dir', default='/var/lib/aktt-stats/incoming')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        gbl_file, mm_file = synthetic.write_files(directory, transactions=args.transactions)
+        remote_dir = args.remote_dir
+        login = args.login
+        if login is None:
+            shims = os.path.join(directory, "bin")
+            remote_dir = os.path.join(directory, "incoming")
+            os.makedirs(shims)
+            os.makedirs(remote_dir)
+            install_shims(shims, args.handshake_ms / 1000, args.bandwidth_mbit * 1e6 / 8)
+            os.environ["PATH"] = shims + os.pathsep + os.environ["PATH"]
+            login = "aktt@loopback"
+            print(f"loopback: {args.handshake_ms:.0f} ms handshake, {args.bandwidth_mbit:g} Mbit/s")
+        lxc_user, lxc_host = login.split("@", 1)
+        size_mb = (os.path.getsize(gbl_file) + os.path.getsize(mm_file)) / 2 ** 20
+        print(f"payload: {size_mb:.1f} MB (GBLData.lua + MasterMerchant.lua)")
+
+        results = {}
+        for transport in ("scp", "ssh"):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                push_to_lxc(mm_file, gbl_file, "this", lxc_user, lxc_host, remote_dir,
+                            transport=transport)
+                timings.append(time.perf_counter() - started)
+                if args.login is None:
+                    check_remote(remote_dir, mm_file, gbl_file)
+            results[transport] = statistics.median(timings)
+
+        print(f"{'transport':<10} {'median s':>9}")
+        for transport, wall in results.items():
+            print(f"{transport:<10} {wall:>9.2f}")
+        print(f"speedup: {results['scp'] / results['ssh']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
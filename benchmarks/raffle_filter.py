@@ -0,0 +1,54 @@
+"""
+Benchmark of the lua_to_csv raffle filter: the field-based raffle_rows
+against the backtracking regex it replaced, on stripped synthetic ledgers.
+
+    python -m benchmarks.raffle_filter --rows 1000000
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks import synthetic
+from lua_to_csv import raffle_rows, _NOT_GOLD_DEPOSIT
+
+
+def stripped_rows(rows: int, description_length: int, seed: int = 1) -> str:
+    # The rows as lua2csv writes them: real tabs, one transaction per line.
+    rng = random.Random(seed)
+    users = synthetic.members(500)
+    now = int(time.time())
+    padding = "x" * description_length
+    lines = []
+    for index in range(rows):
+        row = synthetic.gbl_row(rng, index, users, now, 30)
+        lines.append(row.replace("Some ", "Some " + padding, 1).replace("\\t", "\t"))
+    return "\n".join(lines) + "\n"
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the field-based raffle filter against the regex.")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--description-lengths', type=int, nargs='+', default=[0, 1000],
+                        help='Extra characters in item descriptions, one run per value')
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'desc +chars':>11} {'regex s':>8} {'fields s':>9} {'speedup':>8}")
+    for length in args.description_lengths:
+        content = stripped_rows(args.rows, length)
+        expected, regex_wall = timed(_NOT_GOLD_DEPOSIT.sub, '', content)
+        result, field_wall = timed(raffle_rows, content)
+        if result != expected:
+            raise SystemExit("raffle_rows output differs from the regex")
+        print(f"{args.rows:>9} {length:>11} {regex_wall:>8.2f} {field_wall:>9.2f} "
+              f"{regex_wall / field_wall:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
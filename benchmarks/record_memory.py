@@ -0,0 +1,85 @@
+"""
+Memory held per member by the donation summary and per entry by the raffle.
+
+The MM export rows of a synthetic guild are loaded into a summary window the
+way a report run does (ReportEngine.add_mm_rows_to_users), and the raffle
+purchases of a synthetic ledger into a raffle window
+(ReportEngine.add_transactions_to_raffle). tracemalloc measures what each
+window holds afterwards, from the strings of the MM rows themselves (which
+are dropped once loaded) to the records built from them.
+
+    python -m benchmarks.record_memory --members 100000
+"""
+
+import argparse
+import gc
+import io
+import tracemalloc
+
+from benchmarks import synthetic
+from gbl_frame import TransactionFrame
+from guild_stats import RAFFLE, DONATION_SUMMARY_FORMAT, EXCLUDE_USERS
+from report_engine import ReportEngine, ReportConfig, ReportWindow
+from savedvars import iter_gbl_history
+
+
+def held(build) -> tuple:
+    # Bytes still allocated once build() returns, with the result kept alive.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per summary member and per raffle entry.")
+    parser.add_argument('--members', type=int, default=100000)
+    parser.add_argument('--transactions', type=int, default=200000, help='GBL history rows')
+    args = parser.parse_args()
+
+    engine = ReportEngine(ReportConfig(
+        guild_name=synthetic.GUILD_NAMES[0],
+        user=synthetic.USER,
+        raffle=RAFFLE,
+        donation_summary_format=DONATION_SUMMARY_FORMAT,
+        exclude_users=EXCLUDE_USERS,
+        verbose=False,
+    ))
+    guilds = synthetic.GUILD_NAMES[:1]
+    # The rows as they come out of the Lua decode, each a string of its own.
+    mm_rows = engine.read_mm_export(io.StringIO(synthetic.mm_data(args.members, guilds)))
+
+    def summary():
+        window = ReportWindow("summary", 0, 2 ** 40, "donation_summary.csv")
+        rows = list(mm_rows)
+        engine.add_mm_rows_to_users([window], rows)
+        return window
+
+    mm_rows_bytes = held(lambda: [row.encode().decode() for row in mm_rows])[1]
+    window, summary_bytes = held(summary)
+    members = len(window.users)
+    print(f"{members} members: MM rows {mm_rows_bytes / members:.0f} B/member as strings, "
+          f"summary window {summary_bytes / members:.0f} B/member")
+
+    gbl_content = synthetic.gbl_data(args.transactions, args.members, guilds,
+                                     mix={"dep_gold": 1})
+    transactions = TransactionFrame(iter_gbl_history(io.StringIO(gbl_content), synthetic.USER, guilds[0]),
+                                    RAFFLE, True, EXCLUDE_USERS)
+    del gbl_content
+
+    def raffle():
+        window = ReportWindow("raffle", 0, 2 ** 40, "raffle.csv")
+        engine.add_transactions_to_raffle(window, transactions)
+        return window
+
+    window, raffle_bytes = held(raffle)
+    entries = len(window.raffle_tix)
+    print(f"{entries} raffle entries: {raffle_bytes / entries:.0f} B/entry")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Synthetic GBLData.lua and MasterMerchant.lua contents for benchmarks.
+
+The files mimic the layout ESO writes: a settings table ahead of the history,
+one history table per guild of "\\t"-separated transaction rows, and one MM
+export table per guild of "&"-separated member rows. They are generated a
+line at a time, so files with millions of rows can be written without holding
+them in memory:
+
+    python -m benchmarks.synthetic --out data --members 5000 --transactions 1000000 --guilds 5
+"""
+
+import argparse
+import os
+import random
+import time
+
+GUILD_NAMES = ["AK Tamriel Trade", "Other Guild"]
+USER = "@jeffk42"
+
+# Relative frequency of each GBL transaction type.
+TRANSACTION_MIX = {
+    "dep_gold": 3,
+    "dep_item": 1,
+    "wd_gold": 1,
+    "wd_item": 1,
+}
+
+# Gold deposit amounts; with the default raffle rules the ones ending in 1 are ticket purchases.
+DEPOSITS = [5001, 10001, 2500, 3001, 1000, 20001, 777]
+
+
+def members(count: int) -> list:
+    return ["@user%d" % i for i in range(count)] + ["@aktt.guild"]
+
+
+def guild_names(count: int) -> list:
+    """Return ``count`` guild names, starting with GUILD_NAMES."""
+    return (GUILD_NAMES + ["Guild %d" % i for i in range(len(GUILD_NAMES) + 1, count + 1)])[:count]
+
+
+def parse_mix(text: str) -> dict:
+    """Parse a transaction mix given as "dep_gold=3,dep_item=1,..." into a TRANSACTION_MIX-like dict."""
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in TRANSACTION_MIX:
+            raise ValueError(f"unknown transaction type {kind.strip()!r}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def gbl_row(rng: random.Random, index: int, users: list, now: int, days: int,
+            mix: dict = TRANSACTION_MIX, timestamp: int | None = None) -> str:
+    if timestamp is None:
+        timestamp = now - rng.randint(0, days * 86400)
+    # A few deposits come from accounts that have left the guild and aren't in the MM export.
+    username = rng.choice(users) if rng.random() < 0.98 else "@stranger%d" % rng.randint(0, 20)
+    kind = rng.choices(list(mix), weights=list(mix.values()))[0]
+    transaction_id = 1000000 + index
+    if kind == "dep_gold":
+        return f'{timestamp}\\t{username}\\t{kind}\\t{rng.choice(DEPOSITS)}\\tnil\\tnil\\tnil\\tnil\\t{transaction_id}'
+    if kind == "dep_item":
+        return (f'{timestamp}\\t{username}\\t{kind}\\tnil\\t{rng.randint(1, 200)}\\tSome \\"Quoted\\" Item'
+                f'\\t|H1:item:{index}:0|h|h\\t{rng.random() * 500:.2f}\\t{transaction_id}')
+    return f'{timestamp}\\t{username}\\t{kind}\\t{rng.randint(1, 9999)}\\tnil\\tnil\\tnil\\tnil\\t{transaction_id}'
+
+
+def iter_gbl_data(transactions: int = 5000, member_count: int = 300, guilds=GUILD_NAMES, user: str = USER,
+                  days: int = 30, seed: int = 1, now: int | None = None, mix: dict = TRANSACTION_MIX):
+    """
+    Parameters
+    ----------
+    transactions
+        Number of history rows per guild
+    member_count
+        Number of guild members making the transactions
+    guilds
+        Names of the guilds with a history table
+    user
+        The account that saved the file
+    days
+        The history covers this many days before ``now``
+    seed
+        Seed for the random generator, so runs are repeatable
+    now
+        Epoch seconds of the newest possible transaction, default the current time
+    mix
+        Relative frequency of each transaction type, see TRANSACTION_MIX
+
+    Yields the contents of a GBLData.lua file line by line. The rows are in
+    ledger order, oldest first.
+    """
+    rng = random.Random(seed)
+    now = int(time.time()) if now is None else now
+    users = members(member_count)
+    span = days * 86400
+    yield ('GBLDataSavedVariables =\n{\n    ["Default"] = \n    {\n'
+           f'        ["{user}"] = \n        {{\n            ["$AccountWide"] = \n            {{\n'
+           '                ["settings"] = \n                {\n'
+           '                    ["enabled"] = true,\n                },\n'
+           '                ["history"] = \n                {\n')
+    for guild_name in guilds:
+        yield f'                    ["{guild_name}"] = \n                    {{\n'
+        # Each row gets a random time inside its own slot of the history, so the rows come out
+        # in timestamp order without being sorted.
+        slot = max(1, span // max(1, transactions))
+        for index in range(transactions):
+            timestamp = now - span + index * span // transactions + rng.randrange(slot)
+            row = gbl_row(rng, index, users, now, days, mix, min(timestamp, now))
+            yield f'                        [{index + 1}] = "{row}",\n'
+        yield '                    },\n'
+    yield ('                },\n                ["version"] = 1,\n'
+           '            },\n        },\n    },\n}\n')
+
+
+def gbl_data(*args, **options) -> str:
+    """Return the contents of a GBLData.lua file, see iter_gbl_data for the options."""
+    return ''.join(iter_gbl_data(*args, **options))
+
+
+def iter_mm_data(member_count: int = 300, guilds=GUILD_NAMES, user: str = USER, seed: int = 1,
+                 sales: int = 0):
+    """
+    Yield the contents of a MasterMerchant.lua file exporting ``member_count``
+    members per guild. ``sales`` adds that many records of the other
+    account-wide data MM keeps next to the export (settings, sales and
+    listings), ahead of it in the file.
+    """
+    rng = random.Random(seed)
+    yield ('ShopkeeperSavedVars =\n{\n    ["Default"] = \n    {\n'
+           f'        ["{user}"] = \n        {{\n            ["$AccountWide"] = \n            {{\n')
+    if sales:
+        yield from iter_mm_account_data(rng, sales, guilds)
+    yield '                ["EXPORT"] = \n                {\n'
+    for guild_name in guilds:
+        yield f'                    ["{guild_name}"] = \n                    {{\n'
+        for index, username in enumerate(members(member_count), 1):
+            sales, purchases = rng.randint(0, 10 ** 6), rng.randint(0, 10 ** 5)
+            # Older MM versions export no taxes column.
+            if index % 7 == 0:
+                row = f'{username}&{sales}&{purchases}&{rng.randint(1, 10)}'
+            else:
+                row = f'{username}&{sales}&{purchases}&{rng.randint(0, 10 ** 4)}&{rng.randint(1, 10)}'
+            yield f'                        [{index}] = "{row}",\n'
+        yield '                    },\n'
+    yield ('                },\n                ["version"] = 3,\n'
+           '            },\n        },\n    },\n}\n')
+
+
+def iter_mm_account_data(rng: random.Random, sales: int, guilds):
+    # Settings of all kinds of values, then nested sales and listing records.
+    yield ('                ["showChatAlerts"] = true,\n                ["historyDepth"] = 30,\n'
+           '                ["priceCalcFactor"] = -0.25,\n                ["dateFormatMonthDay"] = "%m/%d",\n'
+           '                ["windowFont"] = "ProseAntique", -- { not a table\n')
+    for table in ("SalesData", "ListingsData"):
+        yield f'                ["{table}"] = \n                {{\n'
+        for index in range(1, sales + 1):
+            item_link = f"|H0:item:{rng.randint(1, 200000)}:30:1:0:0:0:0:0:0:0:0:0:0:0:0:0:0:0:0:0|h|h"
+            yield (f'                    [{index}] = \n                    {{\n'
+                   f'                        ["itemLink"] = "{item_link}",\n'
+                   f'                        ["buyer"] = "@user{rng.randint(0, 9999)}",\n'
+                   f'                        ["seller"] = "@user{rng.randint(0, 9999)}",\n'
+                   f'                        ["guild"] = "{rng.choice(guilds)}",\n'
+                   f'                        ["price"] = {rng.randint(1, 10 ** 6)},\n'
+                   f'                        ["quant"] = {rng.randint(1, 200)},\n'
+                   f'                        ["timestamp"] = {1700000000 + index * 60},\n'
+                   f'                        ["wasKiosk"] = {"true" if index % 3 else "false"},\n'
+                   f'                        ["id"] = "{rng.getrandbits(40)}",\n'
+                   '                    },\n')
+        yield '                },\n'
+
+
+def mm_data(*args, **options) -> str:
+    """Return the contents of a MasterMerchant.lua file, see iter_mm_data for the options."""
+    return ''.join(iter_mm_data(*args, **options))
+
+
+def write_files(directory: str, **options) -> tuple:
+    """
+    Write GBLData.lua and MasterMerchant.lua into ``directory`` and return
+    their paths. ``options`` are those of iter_gbl_data; the MM export uses
+    the ones that apply to it, and ``mm_sales`` as its ``sales``.
+    """
+    gbl_file = os.path.join(directory, "GBLData.lua")
+    mm_file = os.path.join(directory, "MasterMerchant.lua")
+    mm_options = {key: options[key] for key in ("member_count", "guilds", "user", "seed") if key in options}
+    mm_options["sales"] = options.pop("mm_sales", 0)
+    with open(gbl_file, 'w') as writer:
+        writer.writelines(iter_gbl_data(**options))
+    with open(mm_file, 'w') as writer:
+        writer.writelines(iter_mm_data(**mm_options))
+    return gbl_file, mm_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic GBLData.lua and MasterMerchant.lua files.")
+    parser.add_argument('--out', default='.', help='Directory to write the files to')
+    parser.add_argument('--members', type=int, default=300, help='Guild members per guild')
+    parser.add_argument('--transactions', type=int, default=5000, help='GBL history rows per guild')
+    parser.add_argument('--guilds', type=int, default=len(GUILD_NAMES), help='Number of guilds')
+    parser.add_argument('--mix', type=parse_mix, default=TRANSACTION_MIX,
+                        help='Transaction type weights, e.g. dep_gold=3,dep_item=1,wd_gold=1,wd_item=1')
+    parser.add_argument('--days', type=int, default=30, help='Days of history')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mm-sales', type=int, default=0,
+                        help='Sales and listing records in MasterMerchant.lua next to the export')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    started = time.perf_counter()
+    paths = write_files(args.out, transactions=args.transactions, member_count=args.members,
+                        guilds=guild_names(args.guilds), days=args.days, seed=args.seed, mix=args.mix,
+                        mm_sales=args.mm_sales)
+    for path in paths:
+        print(f"{path}: {os.path.getsize(path) / 2 ** 20:.1f} MB")
+    print(f"written in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
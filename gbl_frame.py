@@ -0,0 +1,232 @@
+"""
+Columnar aggregation of Guild Bank Ledger transactions.
+
+The raw GBL history rows are split once into typed NumPy/pandas columns
+(int64 timestamps and amounts, categorical user and transaction type), and
+the donation summary totals and raffle purchases are then computed with
+array operations instead of one Python call per row and field.
+"""
+
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+# Field order of a GBL history row
+FIELDS = [
+    "timestamp",
+    "username",
+    "transactionType",
+    "goldAmount",
+    "itemCount",
+    "itemDescription",
+    "itemLink",
+    "itemValue",
+    "transactionId",
+]
+
+
+# Column types handed to the CSV parser. The numeric fields are read as float64
+# so that "nil" can come through as NaN before they are narrowed to int64.
+_DTYPES = {
+    "timestamp": np.int64,
+    "username": "category",
+    "transactionType": "category",
+    "goldAmount": np.float64,
+    "itemCount": np.float64,
+    "itemValue": np.float64,
+    "transactionId": object,
+}
+_NIL = {"goldAmount": ["nil"], "itemCount": ["nil"], "itemValue": ["nil"]}
+# The item description and link are never aggregated, so they aren't parsed.
+_USECOLS = [name for name in FIELDS if name in _DTYPES]
+
+
+def _parse_rows(text: str) -> pd.DataFrame:
+    # The C CSV parser splits and converts every column in one pass, which is
+    # far cheaper than splitting each row in Python.
+    try:
+        return pd.read_csv(io.StringIO(text), sep="\t", header=None, names=FIELDS,
+                           usecols=_USECOLS, dtype=_DTYPES, na_values=_NIL, keep_default_na=False,
+                           quoting=csv.QUOTE_NONE, engine="c")
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in _DTYPES.items()})
+    except pd.errors.ParserError:
+        # A row with extra separators; fall back to splitting in Python and
+        # keeping the first nine fields like the per-row code did.
+        raw = pd.DataFrame([line.split("\t")[:len(FIELDS)] for line in text.split("\n")],
+                           columns=FIELDS, dtype=object)[_USECOLS]
+        return raw.replace({name: {"nil": np.nan} for name in _NIL}).astype(_DTYPES)
+
+
+def load_transactions(rows, exclude_users=()) -> pd.DataFrame:
+    """
+    Parameters
+    ----------
+    rows
+        Iterable of raw GBL history rows ("ts\\t@user\\ttype\\t..."), or a frame
+        of the same fields already parsed (see payload.gbl_frames)
+    exclude_users
+        Usernames whose transactions are dropped entirely
+
+    Returns a frame with one typed column per GBL field, sorted by timestamp.
+    The numeric fields are int64 with a companion has* mask standing in for
+    "nil", and ledgerIndex records each row's position in the ledger.
+    """
+    if isinstance(rows, pd.DataFrame):
+        raw = rows
+    else:
+        text = "\n".join(rows)
+        if "\t" in text:
+            # A real tab inside a field would be mistaken for a separator below.
+            text = text.replace("\t", " ")
+        raw = _parse_rows(text.replace("\\t", "\t"))
+    raw = raw[~raw["username"].isin(list(exclude_users))]
+
+    gold = raw["goldAmount"].to_numpy()
+    item_count = raw["itemCount"].to_numpy()
+    item_value = raw["itemValue"].to_numpy()
+    has_gold = ~np.isnan(gold)
+    has_item = ~np.isnan(item_count) & ~np.isnan(item_value)
+
+    frame = pd.DataFrame({
+        "timestamp": raw["timestamp"].to_numpy(),
+        "username": raw["username"].cat.remove_unused_categories().array,
+        "transactionType": raw["transactionType"].array,
+        "goldAmount": np.where(has_gold, gold, 0).astype(np.int64),
+        "hasGold": has_gold,
+        "itemCount": np.where(has_item, item_count, 0).astype(np.int64),
+        # Item values are fractional; they are truncated like int(float(value)).
+        "itemValue": np.where(has_item, item_value, 0).astype(np.int64),
+        "hasItem": has_item,
+        "transactionId": raw["transactionId"].to_numpy(),
+        "ledgerIndex": np.arange(len(raw), dtype=np.int64),
+    })
+
+    # Keep the frame ordered by timestamp so that a time window is a contiguous
+    # slice found by binary search. The ledger is normally already in order, in
+    # which case the sort is skipped.
+    timestamps = frame["timestamp"].to_numpy()
+    if len(timestamps) > 1 and not (timestamps[:-1] <= timestamps[1:]).all():
+        frame = frame.iloc[np.argsort(timestamps, kind="stable")].reset_index(drop=True)
+    return frame
+
+
+def mark_raffle_purchases(frame: pd.DataFrame, raffle: dict, enable_raffle: bool) -> None:
+    """
+    Add the raffleAmount and raffleEligible columns to ``frame``, following the
+    ticket price and deposit modifier rules in ``raffle`` (see RAFFLE).
+    """
+    gold = frame["goldAmount"].to_numpy()
+    if raffle["enable_requirements"]:
+        amount = gold - raffle["deposit_modifier"]
+        divisible = amount % raffle["ticket_price"] == 0
+    else:
+        amount = gold
+        divisible = np.ones(len(frame), dtype=bool)
+    deposit = (frame["transactionType"] == "dep_gold").to_numpy() & frame["hasGold"].to_numpy()
+    frame["raffleAmount"] = amount
+    frame["raffleEligible"] = deposit & divisible & enable_raffle
+
+
+def usernames(frame: pd.DataFrame) -> list:
+    """Return the distinct usernames in ``frame`` in ledger order of first appearance."""
+    first_seen = frame.groupby("username", observed=True)["ledgerIndex"].min()
+    return first_seen.sort_values().index.tolist()
+
+
+def window_rows(frame: pd.DataFrame, start: int, end: int) -> slice:
+    """Return the slice of the timestamp-sorted ``frame`` with start <= timestamp <= end."""
+    timestamps = frame["timestamp"].to_numpy()
+    return slice(int(np.searchsorted(timestamps, start, side="left")),
+                 int(np.searchsorted(timestamps, end, side="right")))
+
+
+def user_totals(frame: pd.DataFrame, rows: slice) -> pd.DataFrame:
+    """
+    Sum the deposits, raffle and donations columns of the donation summary for
+    every user with transactions in ``rows``. Gold deposits that are raffle
+    purchases count towards raffle instead of deposits.
+    """
+    return summary_amounts(frame.iloc[rows]).groupby("username", observed=True).sum()
+
+
+def summary_amounts(window: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return what each transaction in ``window`` adds to the deposits, raffle
+    and donations columns of the donation summary, one row per transaction.
+    """
+    eligible = window["raffleEligible"].to_numpy()
+    gold_deposit = (window["transactionType"] == "dep_gold").to_numpy() & window["hasGold"].to_numpy()
+    item_deposit = (window["transactionType"] == "dep_item").to_numpy() & window["hasItem"].to_numpy()
+    return pd.DataFrame({
+        "username": window["username"],
+        "deposits": np.where(gold_deposit & ~eligible, window["goldAmount"].to_numpy(), 0),
+        "raffle": np.where(eligible, window["raffleAmount"].to_numpy(), 0),
+        "donations": np.where(item_deposit,
+                              window["itemCount"].to_numpy() * window["itemValue"].to_numpy(), 0),
+    })
+
+
+def week_numbers(timestamps, week_starts) -> np.ndarray:
+    """
+    Return, for every timestamp, the position in the sorted ``week_starts``
+    of the week it falls in (week_starts[i] <= timestamp < week_starts[i + 1]),
+    or -1 for a timestamp before the first week.
+    """
+    return np.searchsorted(np.asarray(week_starts, dtype=np.int64), timestamps, side="right") - 1
+
+
+def weekly_totals(amounts: pd.DataFrame, timestamps, week_starts) -> pd.DataFrame:
+    """
+    Sum the per-transaction ``amounts`` (see summary_amounts) per user and
+    week, in one pass over all the weeks. Returns a frame indexed by
+    (username, week), week being a position in ``week_starts``.
+    """
+    amounts = amounts.assign(week=week_numbers(timestamps, week_starts))
+    return amounts[amounts["week"] >= 0].groupby(["username", "week"], observed=True).sum()
+
+
+def raffle_purchases(frame: pd.DataFrame, rows: slice) -> pd.DataFrame:
+    """Return the raffle-eligible deposits in ``rows``, in ledger order."""
+    window = frame.iloc[rows]
+    purchases = window.loc[window["raffleEligible"].to_numpy(),
+                           ["timestamp", "username", "raffleAmount", "transactionId", "ledgerIndex"]]
+    return purchases.sort_values("ledgerIndex", kind="stable")
+
+
+class TransactionFrame:
+    """
+    The GBL transactions of one guild held in memory, answering the report
+    queries for any window. TransactionStore in txn_store.py offers the same
+    methods over a persistent SQLite history.
+    """
+
+    def __init__(self, rows, raffle: dict, enable_raffle: bool, exclude_users=()):
+        self.frame = load_transactions(rows, exclude_users)
+        mark_raffle_purchases(self.frame, raffle, enable_raffle)
+
+    def usernames(self) -> list:
+        return usernames(self.frame)
+
+    def user_totals(self, start: int, end: int) -> pd.DataFrame:
+        return user_totals(self.frame, window_rows(self.frame, start, end))
+
+    def raffle_purchases(self, start: int, end: int) -> pd.DataFrame:
+        return raffle_purchases(self.frame, window_rows(self.frame, start, end))
+
+    def time_range(self):
+        timestamps = self.frame["timestamp"].to_numpy()
+        return (int(timestamps[0]), int(timestamps[-1])) if len(timestamps) else None
+
+    def weekly_totals(self, week_starts) -> pd.DataFrame:
+        return weekly_totals(summary_amounts(self.frame), self.frame["timestamp"].to_numpy(), week_starts)
+
+    def weekly_raffle(self, week_starts) -> pd.DataFrame:
+        purchases = self.frame[self.frame["raffleEligible"].to_numpy()]
+        amounts = pd.DataFrame({"username": purchases["username"], "raffle": purchases["raffleAmount"]})
+        return weekly_totals(amounts, purchases["timestamp"].to_numpy(), week_starts)
+
+    def close(self) -> None:
+        pass
@@ -1,12 +1,12 @@
 # The Guild_Stats script imports data from data files and generates csv's with information compiled
 # for specific uses.
 # Author: ESO @jeffk42
-from slpp import slpp as lua
 import argparse
-from datetime import datetime, timezone, timedelta
-from zoneinfo import ZoneInfo
 from shutil import copy2
+from report_engine import ReportEngine, ReportConfig
+from profiling import NULL_PROFILER, Profiler
 from aktt_sync_windows import push_to_lxc
+from watch_mode import ReportWatcher
 import os
 # from pydrive.auth import GoogleAuth
 # from pydrive.drive import GoogleDrive
@@ -140,6 +140,24 @@ EXCLUDE_USERS = [
     "@aktt.guild"
 ]
 
+# Rows pulled out of GBLData.lua and MasterMerchant.lua are cached in this directory, so that
+# re-running on files that haven't changed skips the Lua parsing entirely. The cache is keyed on
+# the file contents and the oldest entries are removed once it grows past CACHE_MAX_BYTES.
+# Set CACHE_DIR to None to disable the cache.
+CACHE_DIR = ".guild_stats_cache"
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Optional SQLite file that keeps every GBL transaction seen so far, e.g. "gbl_history.db".
+# Each run then only adds the transactions newer than what is already stored, the reports
+# are answered from the stored history, and old transactions survive ESO trimming them
+# from GBLData.lua. Set to None to build the reports from GBLData.lua alone.
+TRANSACTION_STORE = None
+
+# The formats every report is written in. Each format gets its own file next to the others,
+# e.g. donation_summary.csv and donation_summary.parquet. Available: "csv", "parquet" (typed
+# columns, for pandas/pyarrow and the like) and "jsonl" (one JSON object per line).
+OUTPUT_FORMATS = ["csv"]
+
 
 ##############################################################################################
 # Values above can be easily modified to meet specific needs, but below this point it's
@@ -151,285 +169,28 @@ SOURCE_FILES = {
     "mm": "MasterMerchant.lua"
 }
 
-# Defines a UserData object, which includes all available fields for the donation summary.
-class UserData:
-    def __init__(self, username):
-        self.username = username
-        self.sales = 0
-        self.purchases = 0
-        self.taxes = 0
-        self.rank = 0
-        self.raffle = 0
-        self.deposits = 0
-        self.donations = 0
-
-# Defines a RaffleEntry object, which includes all available fields for the raffle.
-class RaffleEntry:
-    def __init__(self, username):
-        self.username = username
-        self.date = 0
-        self.amount = 0
-        self.transactionId = 0
-
-
-# GBL indices for the array created by each line
-GBL = {
-    "timestamp": 0,
-    "username": 1,
-    "transactionType": 2,
-    "goldAmount": 3,
-    "itemCount": 4,
-    "itemDescription": 5,
-    "itemLink": 6,
-    "itemValue": 7,
-    "transactionId": 8
-}
-
-users = {}
-raffle_tix = []
-
 # Drive Info
 # uploadDir = "1xx6Hqs6jOr-z01Pu0e_ZwBit0KBJ_NSZ"
 # gauth = GoogleAuth()           
 # drive = GoogleDrive(gauth)
 
-# define date ranges for GBL data
-startRange = datetime.fromtimestamp(0, timezone.utc)
-endRange = datetime.now(tz=ZoneInfo('UTC'))
-startRaffle = datetime.fromtimestamp(0, timezone.utc)
-endRaffle = datetime.now(tz=ZoneInfo('UTC'))
-
-def convert_datetime_timezone(dt, tz2):
-    dt = dt.astimezone(ZoneInfo(tz2))
-    return dt
-
-def parse_data(week, gbl_file: str, mm_file: str, raffle_only:bool, raffle_final: bool):
-    global raffle_tix
-
-    raffle_tix = []
-    if not raffle_only:
-        print('Attempting to generate report for week: ' + week + '\n')
-    else:
-        print("This is a raffle-only round")
-
-    if not raffle_only:
-        ###############################################
-        ##         Parse MasterMerchant.lua          ##
-        ###############################################
-
-        mm_content = ""
-
-        with open(mm_file, 'r') as reader:
-            mm_content = reader.read()
-        export_file = lua.decode("{" + mm_content + "}")
-
-        mm_array = export_file["ShopkeeperSavedVars"]["Default"][USER]["$AccountWide"]["EXPORT"][GUILD_NAME]
-        for mm_line in mm_array:
-            user_values = mm_array[mm_line].split('&')
-            new_user = UserData(user_values[0])
-            new_user.sales = user_values[1]
-            new_user.purchases = user_values[2]
-            if len(user_values) == 5:
-                new_user.taxes = user_values[3]
-                new_user.rank = user_values[4]
-            else:
-                new_user.taxes = 0
-                new_user.rank = user_values[3]
-
-            users[user_values[0]] = new_user
-
-    ###############################################
-    ##            Parse GBLData.lua              ##
-    ###############################################
-
-    gbl_content = ""
-    gbl_lines = []
-    gbl_line_pos = 1
-    with open(gbl_file, 'r') as reader:
-        gbl_content = reader.read()
-    gbl_export = lua.decode("{" + gbl_content + "}")
-    gbl_array = gbl_export["GBLDataSavedVariables"]["Default"][USER]["$AccountWide"]["history"][GUILD_NAME]
-
-    for gbl_line in gbl_array:
-        line_split = gbl_array[gbl_line].split("\\t")
-        transaction_time = datetime.fromtimestamp(
-                int(line_split[GBL["timestamp"]]), timezone.utc)
-        if line_split[GBL["username"]] not in EXCLUDE_USERS:
-            add_transaction_to_user(line_split, transaction_time)
-            add_transaction_to_raffle(line_split, transaction_time)
-
-    # Output summary of financial data in a comma separated file matching DONATION_SUMMARY_FORMAT.
-    if not raffle_only:
-        with open('donation_summary.csv', 'w') as writer:
-            if PREFIX_DATE:
-                writer.write(datetime.now(timezone.utc).strftime(
-                    '%m/%d/%y %H:%M:%S') + '\n')
-            print_headers(writer, DONATION_SUMMARY_FORMAT)
-            for key in users.keys():
-                pos = 1
-                if key not in EXCLUDE_USERS:
-                    for column in DONATION_SUMMARY_FORMAT:
-                        if (res := str(getattr(users[key], column, "nil"))) != "nil":
-                            writer.write(res)
-                        if pos < len(DONATION_SUMMARY_FORMAT):
-                            writer.write(",")
-                            pos = pos + 1
-                        else:
-                            writer.write("\n")
-
-    if ENABLE_RAFFLE:
-        # Output raffle data in a comma separated file matching RAFFLE_ENTRY_FORMAT.
-        raffle_filename = 'raffle-last.csv' if raffle_final else 'raffle.csv'
-        with open(raffle_filename, 'w') as writer:
-            print_headers(writer, RAFFLE["raffle_format"])
-            for raffle_entry in raffle_tix:
-                pos = 1
-
-                for column in RAFFLE["raffle_format"]:
-                    if (res := str(getattr(raffle_entry, column, "nil"))) != "nil":
-                        writer.write(res)
-                    if pos < len(RAFFLE["raffle_format"]):
-                        writer.write(",")
-                        pos = pos + 1
-                    else:
-                        writer.write("\n")
-
-# Print the column headers at the top of the output files, if ENABLE_HEADERS is set.
-def print_headers(writer, header_obj):
-    pos = 1
-    if ENABLE_HEADERS:
-        for header in header_obj:
-            writer.write(header)
-            if pos < len(header_obj):
-                writer.write(",")
-                pos = pos + 1
-            else:
-                writer.write("\n")
-
-# This method builds the user dictionary with the username as the key and the associated UserData
-# object as the value. It then updates the totals.
-def add_transaction_to_user(user_array, transaction_time):
-    username = user_array[GBL["username"]]
-    xn_type = user_array[GBL["transactionType"]]
-    gold_amount = user_array[GBL["goldAmount"]]
-    item_count = user_array[GBL["itemCount"]]
-    item_value = user_array[GBL["itemValue"]]
-    
-    if username not in users.keys():
-        print('User not found: ' + username)
-    elif startRange <= transaction_time and endRange >= transaction_time:
-        if (xn_type == 'dep_gold') and gold_amount != "nil":
-            raffle_entry = get_raffle_purchase(user_array)
-            if raffle_entry != None:
-                users[username].raffle = users[username].raffle + raffle_entry.amount
-            else:
-                users[username].deposits = users[username].deposits + \
-                    int(gold_amount)
-        elif (xn_type == 'dep_item' and item_count != "nil" and item_value != "nil"):
-            users[username].donations = users[username].donations + \
-                (int(item_count) * int(float(item_value)))
-
-# This method adds the gold deposit transaction to the raffle list, if the transaction meets the raffle requirements
-def add_transaction_to_raffle(user_array, transaction_time):
-    if not ENABLE_RAFFLE:
-        return
-    if startRaffle <= transaction_time and endRaffle >= transaction_time:
-        xn_type = user_array[GBL["transactionType"]]
-        gold_amount = user_array[GBL["goldAmount"]]
-        if xn_type == "dep_gold" and gold_amount != "nil":
-            entry = get_raffle_purchase(user_array)
-            if entry != None:
-                raffle_tix.append(entry)
-
-# This method returns a RaffleEntry object if the transaction meets the raffle requirements.
-# Otherwise it returns None.
-def get_raffle_purchase(user_array):
-    username = user_array[GBL["username"]]
-    xn_type = user_array[GBL["transactionType"]]
-    xn_id = user_array[GBL["transactionId"]]
-    gold_amount = user_array[GBL["goldAmount"]]
-    timestamp = user_array[GBL["timestamp"]]
-    if not ENABLE_RAFFLE:
-        return None
-    if xn_type == "dep_gold" and gold_amount != "nil":
-        amount = int(gold_amount) - \
-            (RAFFLE["deposit_modifier"] if RAFFLE["enable_requirements"] else 0)
-        if not RAFFLE["enable_requirements"] or (amount % RAFFLE["ticket_price"] == 0):
-            entry = RaffleEntry(username)
-            entry.amount = amount
-            entry.transactionId = xn_id
-            entry.date = datetime.fromtimestamp(int(timestamp),
-                                                timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-            return entry
-        else:
-            return None
-
-# Generate the appropriate date boundaries for the request. For the donation summary, depending on "week",
-# this is either from the most recent trader rollover until now, or from the previous rollover to the most recent.
-# Raffles have a different schedule so for now we'll just get from last raffle to now.
-def generate_date_ranges(week, raffle_final=False):
-    global startRange, endRange, startRaffle, endRaffle
-    # Set boundaries for transaction time, so we're not picking up
-    # transactions for the wrong week.
-    today = datetime.now(tz=ZoneInfo('UTC'))
-
-    if week == "this" or week == "last":
-        offset = (today.weekday() - 1) % 7
-        last_tuesday = today - timedelta(days=offset)
-        # Today is considered "last Tuesday" if it's Tuesday, and that makes today the
-        # start boundary for reading transactions. That's okay for any time
-        # after rollover, but before rollover we should still be in the previous week.
-        # Easy, ugly fix: If it's before rollover, pretend it's still yesterday for
-        # the purposes of start range calculation.
-        if (today.day == last_tuesday.day) and (today.hour < 19):
-            today = today - timedelta(days=1)
-            offset = (today.weekday() - 1) % 7
-            last_tuesday = today - timedelta(days=offset)
-        if week == "this":
-            startRange = datetime(last_tuesday.year, last_tuesday.month,
-                                  last_tuesday.day, 19, 00, 00, 00, timezone.utc)
-        elif week == "last":
-            endRange = datetime(last_tuesday.year, last_tuesday.month,
-                                last_tuesday.day, 19, 00, 00, 00, timezone.utc)
-            startRange = endRange - timedelta(days=7)
-
-    print('Setting summary start date of: ' + str(startRange))
-    print('Setting summary end date of: ' + str(endRange))
-
-    # Raffles go from Saturday 00:00 UTC to Saturday 00:00 UTC
-    raffle_time_array = RAFFLE["time"].split(':')
-    
-    
-    # negative number modulo positive number is positive
-    localNow = convert_datetime_timezone(today, RAFFLE["timezone"])
-    offset = (localNow.weekday() - RAFFLE["day"]) % 7
-    last_week = localNow - timedelta(days=offset)
-
-    raffleDeadline = datetime(last_week.year, last_week.month, last_week.day,
-                               int(raffle_time_array[0]),
-                               int(raffle_time_array[1]),
-                               int(raffle_time_array[2]), 00, ZoneInfo(RAFFLE["timezone"]))
-
-    # when it's not yet the raffle deadline, but it's the same day as the raffle deadline,
-    # we need to manually back up the start point to a week earlier.
-    if raffleDeadline > localNow and offset == 0:
-        offset = 7
-        last_week = localNow - timedelta(days=offset)
-
-    if not raffle_final:
-        startRaffle = datetime(last_week.year, last_week.month, last_week.day,
-                               int(raffle_time_array[0]),
-                               int(raffle_time_array[1]),
-                               int(raffle_time_array[2]), 00, ZoneInfo(RAFFLE["timezone"]))
-    else:
-        endRaffle = datetime(last_week.year, last_week.month, last_week.day,
-                               int(raffle_time_array[0]),
-                               int(raffle_time_array[1]),
-                               int(raffle_time_array[2]), 00, ZoneInfo(RAFFLE["timezone"]))
-        startRaffle = endRaffle - timedelta(days=7)
-
-    print('Setting raffle start date of: ' + str(startRaffle))
-    print('Setting raffle end date of: ' + str(endRaffle))
+# Builds the report engine from the settings above.
+def make_engine(user=USER, output_formats=None):
+    return ReportEngine(ReportConfig(
+        guild_name=GUILD_NAME,
+        user=user,
+        raffle=RAFFLE,
+        enable_raffle=ENABLE_RAFFLE,
+        output_last_raffle=OUTPUT_LAST_RAFFLE,
+        donation_summary_format=DONATION_SUMMARY_FORMAT,
+        exclude_users=EXCLUDE_USERS,
+        enable_headers=ENABLE_HEADERS,
+        prefix_date=PREFIX_DATE,
+        cache_dir=CACHE_DIR,
+        cache_max_bytes=CACHE_MAX_BYTES,
+        transaction_store=TRANSACTION_STORE,
+        output_formats=output_formats or OUTPUT_FORMATS,
+    ))
 
 # Copy the data files automatically when the script is run. If this option is not selected, the files
 # will need to be manually copied to the script directory prior to running.
@@ -444,6 +205,29 @@ def copy_datafiles(noCopy=False):
     print("File copied: " + output)
 
 
+# Send the data files to the LXC, which regenerates the reports there (see aktt_sync_windows.py).
+def push_reports(week):
+    push_to_lxc(
+        mm_path=os.path.abspath(SOURCE_FILES["mm"]),
+        gbl_path=os.path.abspath(SOURCE_FILES["gbl"]),
+        week=week,
+        lxc_user="akttuser",
+        lxc_host="aktt-web-user",       # <-- your LXC hostname or IP
+        lxc_dir="/var/lib/aktt-stats/incoming",
+        ssh_key=None, #r"C:\Users\you\.ssh\aktt_lxc",   # or None to use default key
+        # Set to e.g. ".aktt_sync_state.json" to only send the GBL rows added since the last push,
+        # and no file that hasn't changed since. The LXC has to run aktt_receiver.py to use this.
+        state_file=None,
+        user=USER,
+        # Set to True to send the rows as a compact payload.aktt instead of the Lua files. The
+        # LXC has to run aktt_receiver.py or guild_stats_web.py --payload to use this.
+        payload=False,
+        # Set to True to leave every push in a batch directory of its own on the LXC, so pushes
+        # made close together never overwrite each other. The LXC has to run aktt_receiver.py.
+        batch_dirs=False,
+    )
+
+
 # MAIN #
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -480,6 +264,34 @@ if __name__ == "__main__":
     # To get the results from rollover to now, use 'this'.
     parser.add_argument('--week', default='this')
 
+    # Instead of this or last week's reports, write a user x week matrix of the deposits, raffle and
+    # donations over the whole GBL history (or everything in TRANSACTION_STORE), by trader week
+    # and by raffle week: history_deposits.csv, history_raffle.csv, history_donations.csv and
+    # history_raffle_weeks.csv.
+    parser.add_argument('--history', action='store_true')
+
+    # Generate the reports of every guild found in the data files instead of only GUILD_NAME.
+    # Each guild's files are written to its own directory under --output-dir.
+    parser.add_argument('--all-guilds', action='store_true')
+    parser.add_argument('--output-dir', default='guilds')
+
+    # Write the reports in these formats instead of OUTPUT_FORMATS, e.g. --format csv parquet
+    parser.add_argument('--format', nargs='+', choices=['csv', 'parquet', 'jsonl'], default=None)
+
+    # Print how long each stage of the run took (wall and CPU time), the peak memory it allocated
+    # and how many rows it handled. --profile-json also saves those numbers to a JSON file.
+    parser.add_argument('--profile', action='store_true')
+    parser.add_argument('--profile-json', default=None)
+
+    # Keep running and regenerate (and push) the reports every time ESO saves new data to
+    # GBLData.lua or MasterMerchant.lua, e.g. after a /reloadui, until stopped with Ctrl+C.
+    # A regeneration starts once the files have been quiet for --debounce seconds, and only
+    # reads the file(s) whose contents changed. --latency-log appends the time from each
+    # write to the updated reports to a JSON lines file.
+    parser.add_argument('--watch', action='store_true')
+    parser.add_argument('--debounce', type=float, default=2)
+    parser.add_argument('--latency-log', default=None)
+
     # Parse the args (argparse automatically grabs the values from
     # sys.argv)
     args = parser.parse_args()
@@ -490,15 +302,38 @@ if __name__ == "__main__":
     week = args.week
     raffle_final = args.raffle_final
 
-    copy_datafiles(args.no_copy)
-    if OUTPUT_LAST_RAFFLE:
-        generate_date_ranges(week, False)
-        parse_data(week, gbl_file, mm_file, raffle_only=raffle_only, raffle_final=False)
-        generate_date_ranges(week, True)
-        parse_data(week, gbl_file, mm_file, raffle_only=True, raffle_final=True)
+    if args.history and args.watch:
+        parser.error("--history can't be combined with --watch")
+    if args.watch:
+        saved_dir = SOURCE_DIR + "\\live\\SavedVariables\\"
+        sources = {kind: ((path if args.no_copy else saved_dir + SOURCE_FILES[kind]), path)
+                   for kind, path in (("gbl", gbl_file), ("mm", mm_file))}
+        watcher = ReportWatcher(make_engine(USER, args.format), week, sources,
+                                args.output_dir if args.all_guilds else "", args.all_guilds,
+                                raffle_only, raffle_final, args.latency_log, after=lambda: push_reports(week))
+        try:
+            watcher.watch(args.debounce)
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit(0)
+
+    profiler = Profiler() if args.profile or args.profile_json else NULL_PROFILER
+    with profiler.stage("copy"):
+        copy_datafiles(args.no_copy)
+    engine = make_engine(USER, args.format)
+    windows = [] if args.history else engine.generate_windows(week, raffle_only, raffle_final)
+    if args.history:
+        engine.parse_history(gbl_file, args.output_dir if args.all_guilds else "", args.all_guilds, profiler)
+    elif args.all_guilds:
+        engine.parse_all_guilds(week, gbl_file, mm_file, windows, args.output_dir, profiler=profiler)
     else:
-        generate_date_ranges(week, raffle_final)
-        parse_data(week, gbl_file, mm_file, raffle_only, raffle_final)
+        engine.parse_data(week, gbl_file, mm_file, windows, profiler=profiler)
+
+    if profiler.enabled:
+        profiler.close()
+        print(profiler.table())
+        if args.profile_json:
+            profiler.write_json(args.profile_json)
 
     # after files are complete, upload to google
     # upload_file_list = ['donation_summary.csv', 'raffle.csv', 'raffle-last.csv']
@@ -508,13 +343,5 @@ if __name__ == "__main__":
     #     gfile.SetContentFile(upload_file)
     #     gfile.Upload() # Upload the file.
 
-
-    push_to_lxc(
-        mm_path=os.path.abspath(SOURCE_FILES["mm"]),
-        gbl_path=os.path.abspath(SOURCE_FILES["gbl"]),
-        week=week,
-        lxc_user="akttuser",
-        lxc_host="aktt-web-user",       # <-- your LXC hostname or IP
-        lxc_dir="/var/lib/aktt-stats/incoming",
-        ssh_key=None #r"C:\Users\you\.ssh\aktt_lxc",   # or None to use default key
-    )
+    if not args.history:
+        push_reports(week)
@@ -8,6 +8,22 @@ import argparse
 import os
 import re
 
+# Number of characters read from the source file at a time.
+CHUNK_SIZE = 1 << 22
+
+# A line starting with an integer key ("[12] = ...") is never removed by strip_lua and can't be
+# part of a match that spans lines, so the file can be split in front of one and each piece
+# stripped on its own with exactly the result of stripping the whole file at once.
+_SAFE_LINE = re.compile(r'[^\S\n]*\[[0-9]')
+
+# Number of tab-separated fields in a GBL history row, and the ones the raffle filter looks at.
+GBL_FIELD_COUNT = 9
+TIMESTAMP, USERNAME, TRANSACTION_TYPE, GOLD_AMOUNT = 0, 1, 2, 3
+
+# The original definition of a row that isn't a gold deposit. Only rows with extra tabs, whose
+# fields can be split more than one way, are still checked against it.
+_NOT_GOLD_DEPOSIT = re.compile(r'^[0-9]+\t@.+\t(?:(?!dep_gold).)+\t.*\t.*\t.*\t.*\t.*\t.*\n', flags=re.MULTILINE)
+
 
 def strip_lua(input_str: str) -> str:
     r_str = re.sub(r'^GBLDataSavedVariables\s*=\n', '', input_str, flags=re.MULTILINE)
@@ -20,7 +36,87 @@ def strip_lua(input_str: str) -> str:
     return r_str
 
 
-def lua2csv(source_file: str, dest_file: str):
+def iter_stripped(reader, chunk_size: int = CHUNK_SIZE):
+    """
+    Parameters
+    ----------
+    reader
+        Text stream of the Lua source
+    chunk_size
+        Number of characters to read at a time
+
+    Yields the output of strip_lua over the whole stream in consecutive pieces,
+    each made of complete lines, while holding at most about two chunks of the
+    source in memory.
+    """
+    pending = ''
+    while chunk := reader.read(chunk_size):
+        # Lines that were already complete on an earlier read were already checked for a cut point.
+        scanned = max(pending.rfind('\n'), 0)
+        pending += chunk
+        cut = _last_cut(pending, scanned)
+        if cut:
+            yield strip_lua(pending[:cut])
+            pending = pending[cut:]
+    if pending:
+        yield strip_lua(pending)
+
+
+def _last_cut(text: str, start: int) -> int:
+    end = len(text)
+    while (newline := text.rfind('\n', start, end)) >= 0:
+        if _SAFE_LINE.match(text, newline + 1):
+            return newline + 1
+        end = newline
+    return 0
+
+
+def raffle_rows(content: str, ticket_price: int | None = None, deposit_modifier: int = 0) -> str:
+    """
+    Parameters
+    ----------
+    content
+        Stripped GBL rows, one per line
+    ticket_price
+        If given, gold deposits are also required to follow the raffle rules:
+        the deposit minus ``deposit_modifier`` must be a multiple of the price
+    deposit_modifier
+        The amount every raffle purchase has to end in (see RAFFLE in guild_stats.py)
+
+    Returns ``content`` without the rows that aren't gold deposits. Without a
+    ticket price the result is what _NOT_GOLD_DEPOSIT.sub('', content) gives.
+    """
+    lines = content.split('\n')
+    # An unterminated last line can't match the pattern, which requires the newline.
+    last = lines.pop()
+    kept = [line for line in lines if _is_raffle_row(line, ticket_price, deposit_modifier)]
+    kept.append(last)
+    return '\n'.join(kept)
+
+
+def _is_raffle_row(line: str, ticket_price: int | None, deposit_modifier: int) -> bool:
+    fields = line.split('\t')
+    if len(fields) > GBL_FIELD_COUNT:
+        return not _NOT_GOLD_DEPOSIT.match(line + '\n')
+    if len(fields) < GBL_FIELD_COUNT:
+        return True
+
+    timestamp, username, xn_type = fields[TIMESTAMP], fields[USERNAME], fields[TRANSACTION_TYPE]
+    if not (timestamp.isascii() and timestamp.isdigit()) or len(username) < 2 or username[0] != '@':
+        # Not a history row, so it is left alone.
+        return True
+    if "dep_gold" not in xn_type:
+        return not xn_type
+    if ticket_price is None:
+        return True
+    try:
+        amount = int(fields[GOLD_AMOUNT]) - deposit_modifier
+    except ValueError:
+        return False
+    return xn_type == "dep_gold" and amount % ticket_price == 0
+
+
+def lua2csv(source_file: str, dest_file: str, ticket_price: int | None = None, deposit_modifier: int = 0):
     """
     Parameters
     ----------
@@ -28,22 +124,30 @@ def lua2csv(source_file: str, dest_file: str):
         The path to the source file to be converted
     dest_file
         The path to the converted file for output
-    """
-    with open(source_file, 'r') as reader:
-        orig_lua = reader.read()
-
-    all_content = strip_lua(orig_lua)
+    ticket_price, deposit_modifier
+        Optional raffle rules for the raffle file (see raffle_rows)
 
+    The source is read once, a chunk at a time, and both output files are
+    written as it goes, so memory use doesn't depend on the size of the ledger.
+    """
     dest_split = dest_file.split('.', 1)
     dest_file_raffle = dest_split[0] + '_raffle.' + dest_split[1]
 
-    with open(dest_file, 'w') as writer:
-        writer.write(all_content)
+    with open(source_file, 'r') as reader, open(dest_file, 'w') as writer, \
+            open(dest_file_raffle, 'w') as raffle_writer:
+        convert_stream(reader, writer, raffle_writer, ticket_price, deposit_modifier)
 
-    raffle_content = re.sub(r'^[0-9]+\t@.+\t(?:(?!dep_gold).)+\t.*\t.*\t.*\t.*\t.*\t.*\n', '', all_content, flags=re.MULTILINE)
 
-    with open(dest_file_raffle, 'w') as writer:
-        writer.write(raffle_content)
+def convert_stream(reader, writer, raffle_writer=None, ticket_price: int | None = None,
+                   deposit_modifier: int = 0):
+    """
+    Same as lua2csv, between open text streams: the stripped source is written
+    to ``writer`` and, unless it is None, the raffle file to ``raffle_writer``.
+    """
+    for content in iter_stripped(reader):
+        writer.write(content)
+        if raffle_writer is not None:
+            raffle_writer.write(raffle_rows(content, ticket_price, deposit_modifier))
 
 
 if __name__ == "__main__":
@@ -68,6 +172,11 @@ if __name__ == "__main__":
         default=None
     )
 
+    # Optionally keep only the gold deposits that are valid raffle ticket purchases, following
+    # the same ticket price and deposit modifier rules as the raffle in guild_stats.py.
+    parser.add_argument('--ticket-price', type=int, default=None)
+    parser.add_argument('--deposit-modifier', type=int, default=0)
+
     # Parse the args (argparse automatically grabs the values from
     # sys.argv)
     args = parser.parse_args()
@@ -81,4 +190,4 @@ if __name__ == "__main__":
         file_path, file_extension = os.path.splitext(s_file)
         d_file = f'{file_path}_unix{file_extension}'
 
-    lua2csv(s_file, d_file)
\ No newline at end of file
+    lua2csv(s_file, d_file, args.ticket_price, args.deposit_modifier)
\ No newline at end of file
@@ -0,0 +1,313 @@
+"""
+Compact, versioned payload of the rows push_to_lxc sends to the LXC.
+
+Instead of the raw SavedVariables files, the GBL history rows and Master
+Merchant export rows they hold can be sent already split into typed columns.
+Both tables go into one file as zstd-compressed Parquet, with the repetitive
+text columns dictionary-encoded and the timestamps delta-encoded, so the
+receiver loads them straight into Arrow tables without parsing any Lua, and
+the file is a fraction of the size of GBLData.lua and MasterMerchant.lua even
+after those have been compressed.
+
+Layout (integers are little-endian):
+
+    magic            8 bytes, b"AKTTPAY\\0"
+    schema version   uint32
+    GBL table        uint64 length, then a Parquet file
+    MM table         uint64 length, then a Parquet file
+    checksum         32 bytes, SHA-256 of everything before it
+"""
+
+import hashlib
+import io
+import struct
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from savedvars import iter_child_table_strings, gbl_history_path, mm_export_path
+
+PAYLOAD_FORMAT = "aktt-payload"
+# Bump when a column is added, removed or changes type.
+PAYLOAD_VERSION = 1
+PAYLOAD_FILENAME = "payload.aktt"
+
+MAGIC = b"AKTTPAY\0"
+_HEADER = struct.Struct("<8sI")
+_LENGTH = struct.Struct("<Q")
+_CHECKSUM_SIZE = 32
+
+# Field order of a GBL history row, as in gbl_frame.FIELDS. "nil" in a numeric
+# field is stored as null; text fields are kept exactly as they were.
+GBL_FIELD_TYPES = {
+    "timestamp": pa.int64(),
+    "username": pa.string(),
+    "transactionType": pa.string(),
+    "goldAmount": pa.int64(),
+    "itemCount": pa.int64(),
+    "itemDescription": pa.string(),
+    "itemLink": pa.string(),
+    "itemValue": pa.float64(),
+    "transactionId": pa.string(),
+}
+_DICTIONARY_FIELDS = ("username", "transactionType")
+_NUMERIC_FIELDS = ("timestamp", "goldAmount", "itemCount", "itemValue")
+
+_METADATA = {"format": PAYLOAD_FORMAT, "version": str(PAYLOAD_VERSION)}
+
+GBL_SCHEMA = pa.schema(
+    [pa.field("guild", pa.dictionary(pa.int32(), pa.string()))]
+    + [pa.field(name, pa.dictionary(pa.int32(), pa.string()) if name in _DICTIONARY_FIELDS else kind)
+       for name, kind in GBL_FIELD_TYPES.items()],
+    metadata=_METADATA)
+
+# Master Merchant export rows are "user&sales&purchases&taxes&rank", or
+# "user&sales&purchases&rank" when there are no taxes (taxes is then null).
+MM_SCHEMA = pa.schema([
+    pa.field("guild", pa.dictionary(pa.int32(), pa.string())),
+    pa.field("username", pa.string()),
+    pa.field("sales", pa.string()),
+    pa.field("purchases", pa.string()),
+    pa.field("taxes", pa.string()),
+    pa.field("rank", pa.string()),
+], metadata=_METADATA)
+
+
+def _guild_column(guilds: list, counts: list) -> pa.Array:
+    indices = pa.array([index for index, count in enumerate(counts) for _ in range(count)], pa.int32())
+    return pa.DictionaryArray.from_arrays(indices, pa.array(guilds, pa.string()))
+
+
+def _split_rows(text: str) -> pa.Table:
+    # A row with extra separators; keep the first nine fields like gbl_frame does.
+    columns = {name: [] for name in GBL_FIELD_TYPES}
+    for line in text.split("\n"):
+        if not line:
+            continue
+        fields = line.split("\t")[:len(GBL_FIELD_TYPES)]
+        fields += [None] * (len(GBL_FIELD_TYPES) - len(fields))
+        for (name, kind), value in zip(GBL_FIELD_TYPES.items(), fields):
+            if name in _NUMERIC_FIELDS:
+                value = None if value in (None, "nil") else (int(value) if kind == pa.int64() else float(value))
+            columns[name].append(value)
+    return pa.table({name: pa.array(values, GBL_FIELD_TYPES[name]) for name, values in columns.items()})
+
+
+def _parse_gbl_rows(rows: list) -> pa.Table:
+    text = "\n".join(rows)
+    if "\t" in text:
+        # A real tab inside a field would be mistaken for a separator below.
+        text = text.replace("\t", " ")
+    text = text.replace("\\t", "\t")
+    if not text.strip("\n"):
+        return pa.table({name: pa.array([], kind) for name, kind in GBL_FIELD_TYPES.items()})
+    try:
+        return pa_csv.read_csv(
+            io.BytesIO(text.encode("utf-8")),
+            read_options=pa_csv.ReadOptions(column_names=list(GBL_FIELD_TYPES)),
+            parse_options=pa_csv.ParseOptions(delimiter="\t", quote_char=False, escape_char=False),
+            convert_options=pa_csv.ConvertOptions(column_types=GBL_FIELD_TYPES, null_values=["nil"],
+                                                  strings_can_be_null=False))
+    except pa.ArrowInvalid:
+        return _split_rows(text)
+
+
+def gbl_table(history: dict) -> pa.Table:
+    """
+    Parameters
+    ----------
+    history
+        Raw GBL history rows ("ts\\t@user\\ttype\\t...") keyed by guild name
+
+    Returns the rows of every guild as one table with a guild column, in
+    ledger order. Raises ValueError if a numeric field holds anything but a
+    number or "nil".
+    """
+    guilds, counts, tables = [], [], []
+    for guild, rows in history.items():
+        try:
+            table = _parse_gbl_rows(rows)
+        except pa.ArrowInvalid as error:
+            raise ValueError(f"GBL history of {guild!r} doesn't fit the payload schema: {error}") from None
+        guilds.append(guild)
+        counts.append(table.num_rows)
+        tables.append(table)
+    if tables:
+        table = pa.concat_tables(tables)
+    else:
+        table = pa.table({name: pa.array([], kind) for name, kind in GBL_FIELD_TYPES.items()})
+    if table["timestamp"].null_count:
+        raise ValueError("GBL history row without a timestamp")
+
+    columns = {"guild": _guild_column(guilds, counts)}
+    for name in GBL_FIELD_TYPES:
+        column = table[name].combine_chunks()
+        columns[name] = pc.dictionary_encode(column) if name in _DICTIONARY_FIELDS else column
+    return pa.table(columns, schema=GBL_SCHEMA)
+
+
+def mm_table(exports: dict) -> pa.Table:
+    """
+    Parameters
+    ----------
+    exports
+        Master Merchant export member rows ("user&sales&purchases&taxes&rank")
+        keyed by guild name
+
+    Returns the rows of every guild as one table with a guild column.
+    """
+    guilds, counts = [], []
+    columns = {name: [] for name in MM_SCHEMA.names[1:]}
+    for guild, rows in exports.items():
+        guilds.append(guild)
+        counts.append(len(rows))
+        for row in rows:
+            values = row.split("&")
+            if len(values) == 4:
+                values.insert(3, None)
+            elif len(values) != 5:
+                raise ValueError(f"MM export row of {guild!r} doesn't fit the payload schema: {row!r}")
+            for name, value in zip(columns, values):
+                columns[name].append(value)
+    return pa.table([_guild_column(guilds, counts)] + [pa.array(values, pa.string())
+                                                       for values in columns.values()],
+                    schema=MM_SCHEMA)
+
+
+def read_gbl_table(gbl_path: str, user: str) -> pa.Table:
+    """Read the GBL history rows of every guild in GBLData.lua in one pass and return gbl_table of them."""
+    history = {}
+    for guild, row in iter_child_table_strings(gbl_path, gbl_history_path(user)):
+        history.setdefault(guild, []).append(row)
+    return gbl_table(history)
+
+
+def read_mm_table(mm_path: str, user: str) -> pa.Table:
+    """Read the MM export rows of every guild in MasterMerchant.lua in one pass and return mm_table of them."""
+    exports = {}
+    for guild, row in iter_child_table_strings(mm_path, mm_export_path(user)):
+        exports.setdefault(guild, []).append(row)
+    return mm_table(exports)
+
+
+def read_tables(gbl_path: str, mm_path: str, user: str, history: dict | None = None):
+    """
+    Read the GBL history and MM export rows of every guild ``user`` has data
+    for, each in a single pass over its file, and return (gbl_table, mm_table).
+    ``history`` can hand over GBL rows that were already read.
+    """
+    gbl = read_gbl_table(gbl_path, user) if history is None else gbl_table(history)
+    return gbl, read_mm_table(mm_path, user)
+
+
+def append_gbl_rows(gbl: pa.Table, new: pa.Table) -> pa.Table:
+    """
+    Return ``gbl`` with the rows of ``new`` (both gbl_table tables) appended,
+    leaving out those whose transactionId the same guild already has.
+    """
+    def keys(table):
+        return pc.binary_join_element_wise(table["guild"].cast(pa.string()), table["transactionId"], "\0")
+
+    fresh = new.filter(pc.invert(pc.is_in(keys(new), value_set=keys(gbl).combine_chunks())))
+    return pa.concat_tables([gbl, fresh]).unify_dictionaries().combine_chunks()
+
+
+# Parquet dictionary pages for the columns that repeat a few values (item descriptions and
+# links included), and delta encoding for the timestamps, which mostly only grow by a little.
+_PARQUET_DICTIONARY = ["guild", "username", "transactionType", "itemDescription", "itemLink"]
+_PARQUET_ENCODING = {"timestamp": "DELTA_BINARY_PACKED"}
+
+
+def _parquet(table: pa.Table, use_dictionary=True, column_encoding=None) -> bytes:
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression="zstd", compression_level=9,
+                   use_dictionary=use_dictionary, column_encoding=column_encoding)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_payload(gbl: pa.Table, mm: pa.Table) -> bytes:
+    """Return the payload file holding the ``gbl`` and ``mm`` tables."""
+    parts = [_HEADER.pack(MAGIC, PAYLOAD_VERSION)]
+    for section in (_parquet(gbl, _PARQUET_DICTIONARY, _PARQUET_ENCODING), _parquet(mm)):
+        parts += [_LENGTH.pack(len(section)), section]
+    body = b"".join(parts)
+    return body + hashlib.sha256(body).digest()
+
+
+def decode_payload(data: bytes):
+    """
+    Return the (gbl_table, mm_table) held in the payload ``data``. Raises
+    ValueError if it isn't a payload, was written with another schema version
+    or fails its checksum.
+    """
+    if len(data) < _HEADER.size + _CHECKSUM_SIZE or data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an AKTT payload")
+    _, version = _HEADER.unpack_from(data)
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Payload schema version {version} is not supported (expected {PAYLOAD_VERSION})")
+    body = memoryview(data)[:-_CHECKSUM_SIZE]
+    if hashlib.sha256(body).digest() != data[-_CHECKSUM_SIZE:]:
+        raise ValueError("Payload checksum mismatch")
+
+    tables = []
+    offset = _HEADER.size
+    for schema in (GBL_SCHEMA, MM_SCHEMA):
+        (length,) = _LENGTH.unpack_from(body, offset)
+        offset += _LENGTH.size
+        table = pq.read_table(pa.BufferReader(pa.py_buffer(body[offset:offset + length])))
+        if not table.schema.equals(schema, check_metadata=False):
+            raise ValueError("Payload table doesn't match the schema of version " + str(PAYLOAD_VERSION))
+        tables.append(table)
+        offset += length
+    return tuple(tables)
+
+
+def read_payload(payload_file: str):
+    """Same as decode_payload, for a payload file on disk."""
+    with open(payload_file, "rb") as reader:
+        return decode_payload(reader.read())
+
+
+def _by_guild(table: pa.Table) -> dict:
+    guilds = table["guild"].combine_chunks()
+    return {guild: table.filter(pc.equal(guilds.indices, index)).drop_columns(["guild"])
+            for index, guild in enumerate(guilds.dictionary.to_pylist())}
+
+
+def gbl_frames(gbl: pa.Table) -> dict:
+    """
+    Return the GBL history of each guild as a pandas frame of the parsed
+    columns that gbl_frame.load_transactions accepts in place of raw rows.
+    """
+    frames = {}
+    for guild, table in _by_guild(gbl).items():
+        frame = table.drop_columns(["itemDescription", "itemLink"]).to_pandas()
+        # The numeric fields come back as float64 with NaN for "nil", like the CSV parser gives.
+        for name in ("goldAmount", "itemCount", "itemValue"):
+            frame[name] = frame[name].astype("float64")
+        frames[guild] = frame
+    return frames
+
+
+def _field_text(value) -> str:
+    if value is None:
+        return "nil"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def gbl_rows(gbl: pa.Table) -> dict:
+    """Return the GBL history of each guild as raw rows again, for TransactionStore."""
+    return {guild: ["\\t".join(_field_text(value) for value in fields)
+                    for fields in zip(*(table[name].to_pylist() for name in GBL_FIELD_TYPES))]
+            for guild, table in _by_guild(gbl).items()}
+
+
+def mm_rows(mm: pa.Table) -> dict:
+    """Return the MM export member rows of each guild, exactly as they were exported."""
+    return {guild: ["&".join(value for value in fields if value is not None)
+                    for fields in zip(*(table[name].to_pylist() for name in MM_SCHEMA.names[1:]))]
+            for guild, table in _by_guild(mm).items()}
@@ -0,0 +1,143 @@
+"""
+Per-stage profile of a report run, behind the --profile option of
+guild_stats.py and guild_stats_web.py and the profile panel of the streamlit
+app.
+
+The report engine wraps each stage of a run (Lua decode, row split,
+aggregation, raffle selection, report write, ...) in Profiler.stage(), which
+records its wall time, CPU time, peak memory allocated while it ran (from
+tracemalloc) and how many rows it handled. A stage that runs more than once,
+e.g. once per guild, is summed. The engine is given NULL_PROFILER when no
+profile is wanted, which records nothing.
+
+tracemalloc slows pure Python code down noticeably, so the times of a run
+profiled with memory=True are higher than those of a normal run; the split
+between the stages is what they are for. tracemalloc is also process-wide,
+so runs profiled at the same time in different threads (streamlit sessions)
+see each other's allocations in their memory peaks.
+"""
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageTiming:
+    """What was recorded for one stage. ``rows`` can be set while the stage runs."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak = None
+        self.rows = None
+
+    def add(self, other):
+        self.calls += other.calls
+        self.wall += other.wall
+        self.cpu += other.cpu
+        if other.peak is not None:
+            self.peak = max(self.peak or 0, other.peak)
+        if other.rows is not None:
+            self.rows = (self.rows or 0) + other.rows
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "wall_s": self.wall,
+            "cpu_s": self.cpu,
+            "peak_mb": None if self.peak is None else self.peak / 2 ** 20,
+            "rows": self.rows,
+            "rows_per_s": self.rows / self.wall if self.rows is not None and self.wall else None,
+        }
+
+
+class Profiler:
+    """
+    Parameters
+    ----------
+    enabled
+        Record the stages; a disabled profiler (see NULL_PROFILER) does nothing
+    memory
+        Trace the peak memory of each stage with tracemalloc
+    """
+
+    def __init__(self, enabled=True, memory=True):
+        self.enabled = enabled
+        self.memory = memory
+        self.stages = {}
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Time the block as stage ``name``. The StageTiming yielded is only
+        for this call; set its ``rows`` if the count isn't known up front.
+        """
+        timing = StageTiming(name)
+        timing.rows = rows
+        if not self.enabled:
+            yield timing
+            return
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        started, started_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield timing
+        finally:
+            timing.wall = time.perf_counter() - started
+            timing.cpu = time.process_time() - started_cpu
+            timing.calls = 1
+            if self.memory:
+                timing.peak = max(0, tracemalloc.get_traced_memory()[1] - base)
+            self.record(timing)
+
+    def record(self, timing):
+        self.stages.setdefault(timing.name, StageTiming(timing.name)).add(timing)
+
+    def merge(self, other):
+        """Add the stages of ``other``, e.g. a profile sent back by a worker process."""
+        if other is not None:
+            for timing in other.stages.values():
+                self.record(timing)
+
+    def close(self):
+        """Stop tracemalloc if this profiler started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def to_dict(self) -> dict:
+        stages = [timing.to_dict() for timing in self.stages.values()]
+        total = StageTiming("total")
+        for timing in self.stages.values():
+            total.add(timing)
+        # Stages count different things, so their rows aren't added up.
+        total.rows = None
+        return {"stages": stages, "total": total.to_dict()}
+
+    def table(self) -> str:
+        """The profile as a plain text table, one line per stage and a total."""
+        profile = self.to_dict()
+        lines = [f"{'stage':<18} {'calls':>5} {'wall s':>8} {'CPU s':>8} {'peak MB':>8} {'rows':>10} {'rows/s':>11}"]
+        for stage in profile["stages"] + [profile["total"]]:
+            peak = f"{stage['peak_mb']:.1f}" if stage["peak_mb"] is not None else "n/a"
+            rows = f"{stage['rows']}" if stage["rows"] is not None else ""
+            rate = f"{stage['rows_per_s']:.0f}" if stage["rows_per_s"] is not None else ""
+            lines.append(f"{stage['name']:<18} {stage['calls']:>5} {stage['wall_s']:>8.3f} {stage['cpu_s']:>8.3f} "
+                         f"{peak:>8} {rows:>10} {rate:>11}")
+        return "\n".join(lines)
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as writer:
+            json.dump(self.to_dict(), writer, indent=2)
+
+
+NULL_PROFILER = Profiler(enabled=False)
@@ -0,0 +1,191 @@
+"""
+Library API over in-memory data.
+
+guild_stats.py and guild_stats_web.py read the SavedVariables files from disk
+and write the reports into the current directory. The functions here take the
+data the way an embedding program already has it and return the results as
+objects, without creating a file anywhere:
+
+    GBLData.lua / MasterMerchant.lua
+        bytes, a str holding the Lua source, or an open text or binary
+        stream (e.g. an upload); streams are read as they are consumed
+    already extracted rows
+        a list of GBL history rows ("ts\\t@user\\ttype\\t...") or MM export
+        rows ("user&sales&purchases&taxes&rank"); GBL rows may also be a
+        parsed frame (see payload.gbl_frames)
+
+run_reports() returns the filled report windows as a ReportResult, which
+hands out the donation summary and raffle entries as records (UserData,
+RaffleEntry), DataFrames, ReportTables or rendered output files.
+
+    from guild_stats_web import make_engine
+    result = report_api.run_reports(make_engine("@user").config, gbl_bytes, mm_bytes)
+    result.summary_frame()
+
+Only a configured transaction_store is written to, since keeping the history
+in it is what it is for.
+"""
+
+import codecs
+import io
+
+import pandas as pd
+
+from profiling import NULL_PROFILER
+from report_engine import ReportEngine, ReportConfig, UserData, RaffleEntry
+from report_sinks import ReportTable, make_sinks, render_table
+from lua_to_csv import convert_stream
+from savedvars import iter_gbl_history
+
+
+class ReportResult:
+    """
+    The report windows of a run, filled in and keyed by output file name
+    (donation_summary.csv, raffle.csv, raffle-last.csv).
+    """
+
+    def __init__(self, engine: ReportEngine, windows: list):
+        self.engine = engine
+        self.windows = {window.filename: window for window in windows}
+
+    def summary(self, filename: str = "donation_summary.csv") -> list:
+        """The UserData of every member, in MM export order, without the excluded users."""
+        exclude_users = self.engine.config.exclude_users
+        return [user for username, user in self.windows[filename].users.items()
+                if username not in exclude_users]
+
+    def raffle(self, filename: str = "raffle.csv") -> list:
+        """The RaffleEntry of every ticket purchase, in ledger order."""
+        return list(self.windows[filename].raffle_tix)
+
+    def summary_frame(self, filename: str = "donation_summary.csv") -> pd.DataFrame:
+        """The donation summary as a DataFrame with one column per UserData field."""
+        return _records_frame(self.summary(filename), UserData.__slots__)
+
+    def raffle_frame(self, filename: str = "raffle.csv") -> pd.DataFrame:
+        """The raffle entries as a DataFrame with one column per RaffleEntry field."""
+        return _records_frame(self.raffle(filename), RaffleEntry.__slots__)
+
+    def table(self, filename: str) -> ReportTable:
+        """The report of ``filename`` laid out as configured, ready for any output sink."""
+        return self.engine.report_table(self.windows[filename])
+
+    def render(self, formats=None) -> dict:
+        """
+        Return every report as output file name -> text (bytes for Parquet),
+        in ``formats`` or else the configured output formats.
+        """
+        config = self.engine.config
+        sinks = self.engine.sinks if formats is None else make_sinks(formats, config.enable_headers)
+        reports = {}
+        for filename in self.windows:
+            reports.update(render_table(self.table(filename), sinks, filename))
+        return reports
+
+
+def run_reports(config: ReportConfig, gbl, mm=None, week: str = "this", raffle_only: bool = False,
+                raffle_final: bool = False, now=None, windows=None, profiler=NULL_PROFILER) -> ReportResult:
+    """
+    Parameters
+    ----------
+    config
+        The reports to build (e.g. make_engine(user).config from guild_stats_web.py)
+    gbl
+        GBLData.lua, or the configured guild's GBL history rows
+    mm
+        MasterMerchant.lua, or the guild's MM export rows; only needed for a
+        donation summary
+    week, raffle_only, raffle_final, now
+        As for a single run (see ReportEngine.generate_windows)
+    windows
+        ReportWindows to fill instead of the ones those would give
+    profiler
+        Records each stage of the run (see profiling.py)
+    """
+    engine = ReportEngine(config)
+    if windows is None:
+        windows = engine.generate_windows(week, raffle_only, raffle_final, now)
+    mm_rows = []
+    if any(window.kind == "summary" for window in windows):
+        if mm is None:
+            raise ValueError("a donation summary needs the Master Merchant export")
+        with profiler.stage("mm decode") as stage:
+            mm_rows = read_mm_rows(engine, mm)
+            stage.rows = len(mm_rows)
+    with profiler.stage("gbl decode") as stage:
+        gbl_rows = read_gbl_rows(engine, gbl)
+        stage.rows = len(gbl_rows)
+    engine.fill_windows(config.guild_name, gbl_rows, mm_rows, windows, profiler)
+    return ReportResult(engine, windows)
+
+
+def weekly_history(config: ReportConfig, gbl, profiler=NULL_PROFILER) -> dict:
+    """
+    The whole-history weekly matrices of the configured guild (see
+    ReportEngine.history_tables) as DataFrames indexed by username, with a
+    column per week, keyed by history_deposits, history_raffle,
+    history_donations and history_raffle_weeks.
+    """
+    engine = ReportEngine(config)
+    with profiler.stage("gbl decode") as stage:
+        gbl_rows = read_gbl_rows(engine, gbl)
+        stage.rows = len(gbl_rows)
+    frames = {}
+    for filename, table in engine.history_tables(config.guild_name, gbl_rows, profiler).items():
+        frame = pd.DataFrame(table.rows, columns=table.columns).set_index("username")
+        frames[filename.rsplit(".", 1)[0]] = frame
+    return frames
+
+
+def lua_to_csv(source, ticket_price: int | None = None, deposit_modifier: int = 0) -> tuple:
+    """
+    Return GBLData.lua as lua2csv converts it and its raffle rows, as two
+    strings (see lua_to_csv.py).
+    """
+    writer = io.StringIO()
+    raffle_writer = io.StringIO()
+    convert_stream(_text_stream(source), writer, raffle_writer, ticket_price, deposit_modifier)
+    return writer.getvalue(), raffle_writer.getvalue()
+
+
+def read_gbl_rows(engine: ReportEngine, gbl):
+    """The configured guild's GBL history rows out of ``gbl`` (see run_reports)."""
+    config = engine.config
+    if not _is_source(gbl):
+        return gbl if isinstance(gbl, pd.DataFrame) else list(gbl)
+    return list(iter_gbl_history(_lua_source(gbl), config.user, config.guild_name))
+
+
+def read_mm_rows(engine: ReportEngine, mm) -> list:
+    """The configured guild's MM export rows out of ``mm`` (see run_reports)."""
+    if not _is_source(mm):
+        return list(mm)
+    return engine.read_mm_export(_lua_source(mm))
+
+
+def _is_source(data) -> bool:
+    return isinstance(data, (str, bytes, bytearray, memoryview)) or hasattr(data, "read")
+
+
+def _lua_source(source):
+    # Bytes are scanned where they are; anything else is read as text.
+    return source if isinstance(source, (bytes, bytearray, memoryview)) else _text_stream(source)
+
+
+def _text_stream(source):
+    # The Lua readers take text streams. A binary stream is decoded as it is read, through a
+    # reader that leaves the caller's stream open.
+    if isinstance(source, str):
+        return io.StringIO(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.StringIO(bytes(source).decode("utf-8"))
+    if isinstance(source, io.TextIOBase):
+        return source
+    if isinstance(source, (io.RawIOBase, io.BufferedIOBase)) or "b" in getattr(source, "mode", ""):
+        return codecs.getreader("utf-8")(source)
+    return source
+
+
+def _records_frame(records: list, fields) -> pd.DataFrame:
+    return pd.DataFrame({field: [getattr(record, field) for record in records] for field in fields},
+                        columns=list(fields))
@@ -0,0 +1,766 @@
+"""
+The donation summary and raffle report engine shared by guild_stats.py and
+guild_stats_web.py.
+
+A ReportEngine owns a ReportConfig and nothing else: the date boundaries,
+report windows and per-user totals of a run are created by that run and
+handed back to the caller. Nothing is kept at module level or on the engine
+between calls, so one engine can serve any number of reports at the same time
+from different threads.
+"""
+
+import io
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
+
+from gbl_frame import TransactionFrame
+from payload import read_payload, gbl_frames, gbl_rows as payload_gbl_rows, mm_rows as payload_mm_rows
+from profiling import NULL_PROFILER, Profiler
+from report_sinks import ReportTable, make_sinks, write_table, render_table
+from savedvars import (iter_gbl_history, iter_table_strings, iter_child_table_strings, gbl_history_path,
+                       mm_export_path)
+from snapshot_cache import cached_rows
+from txn_store import TransactionStore
+
+# A trader week rollover (Tuesday 19:00 UTC); every other one is a whole number of weeks away.
+TRADER_ROLLOVER = datetime(1970, 1, 6, 19, 0, 0, 0, timezone.utc)
+
+
+class UserData:
+    """
+    All available fields of one user's row in the donation summary. The MM
+    fields are ints parsed from the export, the username is interned so every
+    window and report shares one copy of it.
+    """
+    # One instance per member and summary window, so there is no per-instance __dict__.
+    __slots__ = ("username", "sales", "purchases", "taxes", "rank", "raffle", "deposits", "donations")
+
+    def __init__(self, username):
+        self.username = username
+        self.sales = 0
+        self.purchases = 0
+        self.taxes = 0
+        self.rank = 0
+        self.raffle = 0
+        self.deposits = 0
+        self.donations = 0
+
+
+class RaffleEntry:
+    """
+    All available fields of one raffle ticket purchase. The purchase time is
+    kept as epoch seconds and only formatted when the date is asked for.
+    """
+    __slots__ = ("username", "timestamp", "amount", "transactionId")
+
+    def __init__(self, username, timestamp=0, amount=0, transactionId=0):
+        self.username = username
+        self.timestamp = timestamp
+        self.amount = amount
+        self.transactionId = transactionId
+
+    @property
+    def date(self):
+        return datetime.fromtimestamp(self.timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class ReportWindow:
+    """
+    One time range of GBL transactions (inclusive epoch seconds) and the report
+    built from it. "summary" windows total each user's deposits into their own
+    copy of the MM user list, "raffle" windows collect the eligible raffle
+    purchases. Each window is written to its own output file.
+    """
+
+    def __init__(self, kind, start, end, filename):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.filename = filename
+        self.users = {}
+        self.raffle_tix = []
+
+
+class DateRanges:
+    """The summary and raffle boundaries of a run, as timezone-aware datetimes."""
+
+    def __init__(self, start_range, end_range, start_raffle, end_raffle):
+        self.start_range = start_range
+        self.end_range = end_range
+        self.start_raffle = start_raffle
+        self.end_raffle = end_raffle
+
+
+class ReportConfig:
+    """
+    Parameters
+    ----------
+    guild_name
+        The guild reported on, as named in the GBL history and MM export
+    user
+        The ESO account that saved the SavedVariables files
+    raffle
+        The raffle rules (see RAFFLE in guild_stats.py)
+    enable_raffle
+        If False no raffle files are generated
+    output_last_raffle
+        Also generate raffle-last.csv for the raffle week that just ended
+    donation_summary_format
+        The columns of the donation summary
+    exclude_users
+        Usernames left out of every report
+    enable_headers
+        Print the column headers at the top of the output files
+    prefix_date
+        Print the time of the run as the first line of the donation summary
+    cache_dir, cache_max_bytes
+        Location and size limit of the extracted row cache, or None to disable it
+    transaction_store
+        Optional SQLite file holding the GBL history across runs
+    verbose
+        Print progress and unknown users to stdout
+    output_formats
+        Formats each report is written in, any of "csv", "parquet" and "jsonl"
+        (see report_sinks.py)
+    """
+
+    def __init__(self, guild_name, user, raffle, enable_raffle=True, output_last_raffle=True,
+                 donation_summary_format=(), exclude_users=(), enable_headers=False,
+                 prefix_date=True, cache_dir=None, cache_max_bytes=0, transaction_store=None,
+                 verbose=True, output_formats=("csv",)):
+        self.guild_name = guild_name
+        self.user = user
+        self.raffle = dict(raffle)
+        self.enable_raffle = enable_raffle
+        self.output_last_raffle = output_last_raffle
+        self.donation_summary_format = list(donation_summary_format)
+        self.exclude_users = list(exclude_users)
+        self.enable_headers = enable_headers
+        self.prefix_date = prefix_date
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.transaction_store = transaction_store
+        self.verbose = verbose
+        self.output_formats = list(output_formats)
+
+
+class ReportEngine:
+    """
+    Generates the donation summary and raffle reports described by a
+    ReportConfig. The engine never changes after construction; every method
+    works only on its arguments and the windows it is given, so concurrent
+    calls don't interfere.
+    """
+
+    def __init__(self, config: ReportConfig):
+        self.config = config
+        self.sinks = make_sinks(config.output_formats, config.enable_headers)
+
+    def log(self, message):
+        if self.config.verbose:
+            print(message)
+
+    ###############################################
+    ##            Windows and dates              ##
+    ###############################################
+
+    def generate_date_ranges(self, week, raffle_final=False, now=None) -> DateRanges:
+        """
+        Work out the boundaries for the request. For the donation summary,
+        depending on ``week``, this is either from the most recent trader
+        rollover until ``now``, or from the previous rollover to the most
+        recent. Raffles have a different schedule: from the last raffle deadline
+        to ``now``, or with ``raffle_final`` the raffle week ending at that
+        deadline.
+        """
+        raffle = self.config.raffle
+        # Set boundaries for transaction time, so we're not picking up
+        # transactions for the wrong week.
+        today = now if now is not None else datetime.now(tz=ZoneInfo('UTC'))
+        start_range = datetime.fromtimestamp(0, timezone.utc)
+        end_range = today
+        start_raffle = datetime.fromtimestamp(0, timezone.utc)
+        end_raffle = today
+
+        if week == "this" or week == "last":
+            offset = (today.weekday() - 1) % 7
+            last_tuesday = today - timedelta(days=offset)
+            # Today is considered "last Tuesday" if it's Tuesday, and that makes today the
+            # start boundary for reading transactions. That's okay for any time
+            # after rollover, but before rollover we should still be in the previous week.
+            # Easy, ugly fix: If it's before rollover, pretend it's still yesterday for
+            # the purposes of start range calculation.
+            if (today.day == last_tuesday.day) and (today.hour < 19):
+                today = today - timedelta(days=1)
+                offset = (today.weekday() - 1) % 7
+                last_tuesday = today - timedelta(days=offset)
+            if week == "this":
+                start_range = datetime(last_tuesday.year, last_tuesday.month,
+                                       last_tuesday.day, 19, 00, 00, 00, timezone.utc)
+            elif week == "last":
+                end_range = datetime(last_tuesday.year, last_tuesday.month,
+                                     last_tuesday.day, 19, 00, 00, 00, timezone.utc)
+                start_range = end_range - timedelta(days=7)
+
+        self.log('Setting summary start date of: ' + str(start_range))
+        self.log('Setting summary end date of: ' + str(end_range))
+
+        raffle_time_array = raffle["time"].split(':')
+
+        # negative number modulo positive number is positive
+        local_now = today.astimezone(ZoneInfo(raffle["timezone"]))
+        offset = (local_now.weekday() - raffle["day"]) % 7
+        last_week = local_now - timedelta(days=offset)
+
+        raffle_deadline = datetime(last_week.year, last_week.month, last_week.day,
+                                   int(raffle_time_array[0]),
+                                   int(raffle_time_array[1]),
+                                   int(raffle_time_array[2]), 00, ZoneInfo(raffle["timezone"]))
+
+        # when it's not yet the raffle deadline, but it's the same day as the raffle deadline,
+        # we need to manually back up the start point to a week earlier.
+        if raffle_deadline > local_now and offset == 0:
+            offset = 7
+            last_week = local_now - timedelta(days=offset)
+
+        deadline = datetime(last_week.year, last_week.month, last_week.day,
+                            int(raffle_time_array[0]),
+                            int(raffle_time_array[1]),
+                            int(raffle_time_array[2]), 00, ZoneInfo(raffle["timezone"]))
+        if not raffle_final:
+            start_raffle = deadline
+        else:
+            end_raffle = deadline
+            start_raffle = end_raffle - timedelta(days=7)
+
+        self.log('Setting raffle start date of: ' + str(start_raffle))
+        self.log('Setting raffle end date of: ' + str(end_raffle))
+        return DateRanges(start_range, end_range, start_raffle, end_raffle)
+
+    def generate_windows(self, week, raffle_only=False, raffle_final=False, now=None) -> list:
+        """
+        Build the report windows for a run. With output_last_raffle the open
+        raffle and the one that just closed are both included, so raffle.csv and
+        raffle-last.csv come out of the same pass.
+        """
+        config = self.config
+        if now is None:
+            now = datetime.now(tz=ZoneInfo('UTC'))
+        windows = []
+        ranges = self.generate_date_ranges(week, raffle_final and not config.output_last_raffle, now)
+        if not raffle_only:
+            windows.append(ReportWindow("summary", _epoch(ranges.start_range),
+                                        _epoch(ranges.end_range), 'donation_summary.csv'))
+        if config.enable_raffle:
+            if config.output_last_raffle:
+                windows.append(ReportWindow("raffle", _epoch(ranges.start_raffle),
+                                            _epoch(ranges.end_raffle), 'raffle.csv'))
+                ranges = self.generate_date_ranges(week, True, now)
+                windows.append(ReportWindow("raffle", _epoch(ranges.start_raffle),
+                                            _epoch(ranges.end_raffle), 'raffle-last.csv'))
+            else:
+                windows.append(ReportWindow("raffle", _epoch(ranges.start_raffle),
+                                            _epoch(ranges.end_raffle),
+                                            'raffle-last.csv' if raffle_final else 'raffle.csv'))
+        return windows
+
+    ###############################################
+    ##               Report runs                 ##
+    ###############################################
+
+    def parse_data(self, week, gbl_file: str, mm_file: str, windows: list, output_dir: str = "",
+                   profiler=NULL_PROFILER):
+        """
+        Generate the reports of the configured guild from the two SavedVariables
+        files. Each stage of the run is recorded in ``profiler`` (see profiling.py).
+        """
+        config = self.config
+        summary_windows = [window for window in windows if window.kind == "summary"]
+        if summary_windows:
+            self.log('Attempting to generate report for week: ' + week + '\n')
+        else:
+            self.log("This is a raffle-only round")
+
+        mm_rows = []
+        if summary_windows:
+            with profiler.stage("mm decode") as stage:
+                mm_rows = list(cached_rows(mm_file, mm_export_path(config.user, config.guild_name),
+                                           lambda: self.read_mm_export(mm_file),
+                                           config.cache_dir, config.cache_max_bytes))
+                stage.rows = len(mm_rows)
+
+        # The history rows are streamed straight out of the file (or out of the row cache, when
+        # the file hasn't changed since the last run) instead of decoding the whole SavedVariables
+        # table, so memory use doesn't grow with the ledger.
+        with profiler.stage("gbl decode") as stage:
+            gbl_rows = cached_rows(gbl_file, gbl_history_path(config.user, config.guild_name),
+                                   lambda: iter_gbl_history(gbl_file, config.user, config.guild_name),
+                                   config.cache_dir, config.cache_max_bytes)
+            gbl_rows = _profiled_rows(gbl_rows, stage, profiler)
+
+        self.build_reports(config.guild_name, gbl_rows, mm_rows, windows, output_dir, profiler)
+
+    def parse_all_guilds(self, week, gbl_file: str, mm_file: str, windows: list, output_dir: str,
+                         profiler=NULL_PROFILER):
+        """
+        Multi-guild mode: GBLData.lua and MasterMerchant.lua hold the data of
+        every guild the account belongs to, so each file is read once for all of
+        them. Every guild's reports are then built and written by its own worker
+        process, into its own directory under ``output_dir``.
+        """
+        config = self.config
+        summary_windows = [window for window in windows if window.kind == "summary"]
+        if summary_windows:
+            self.log('Attempting to generate reports for all guilds for week: ' + week + '\n')
+        else:
+            self.log("This is a raffle-only round")
+
+        gbl_rows = {}
+        with profiler.stage("gbl decode") as stage:
+            for guild_name, row in iter_child_table_strings(gbl_file, gbl_history_path(config.user)):
+                gbl_rows.setdefault(guild_name, []).append(row)
+            stage.rows = sum(map(len, gbl_rows.values()))
+        mm_rows = {}
+        if summary_windows:
+            with profiler.stage("mm decode") as stage:
+                mm_rows = self.read_mm_exports(mm_file)
+                stage.rows = sum(map(len, mm_rows.values()))
+        self.build_all_guilds(gbl_rows, mm_rows, windows, output_dir, profiler)
+
+    def parse_payload(self, week, payload_file: str, windows: list, output_dir: str = "",
+                      all_guilds: bool = False, profiler=NULL_PROFILER):
+        """
+        Generate the reports from a payload file sent by push_to_lxc (see
+        payload.py) instead of the two SavedVariables files, so no Lua is
+        parsed. Without ``all_guilds`` only the configured guild's reports are
+        written, into ``output_dir`` like parse_data; with it every guild's are,
+        like parse_all_guilds.
+        """
+        config = self.config
+        summary_windows = [window for window in windows if window.kind == "summary"]
+        if summary_windows:
+            self.log('Attempting to generate report from ' + payload_file + ' for week: ' + week + '\n')
+        else:
+            self.log("This is a raffle-only round")
+
+        with profiler.stage("payload decode") as stage:
+            gbl, mm = read_payload(payload_file)
+            # The transaction store ingests raw rows; otherwise the parsed columns are used as they are.
+            gbl_rows = payload_gbl_rows(gbl) if config.transaction_store else gbl_frames(gbl)
+            mm_rows = payload_mm_rows(mm) if summary_windows else {}
+            stage.rows = gbl.num_rows + mm.num_rows
+        if all_guilds:
+            self.build_all_guilds(gbl_rows, mm_rows, windows, output_dir, profiler)
+        else:
+            self.build_reports(config.guild_name, gbl_rows.get(config.guild_name, []),
+                               mm_rows[config.guild_name] if summary_windows else [], windows, output_dir,
+                               profiler)
+
+    def build_all_guilds(self, gbl_rows: dict, mm_rows: dict, windows: list, output_dir: str,
+                         profiler=NULL_PROFILER):
+        """
+        Build and write the reports of every guild in ``gbl_rows`` or
+        ``mm_rows``, each by its own worker process, into its own directory
+        under ``output_dir``. The workers profile into profilers of their own,
+        which are merged into ``profiler``.
+        """
+        summary_windows = [window for window in windows if window.kind == "summary"]
+        jobs = []
+        for guild_name in list(gbl_rows) + [guild for guild in mm_rows if guild not in gbl_rows]:
+            guild_windows = windows
+            if summary_windows and guild_name not in mm_rows:
+                self.log('No Master Merchant export for ' + str(guild_name)
+                         + ', skipping its donation summary')
+                guild_windows = [window for window in windows if window.kind != "summary"]
+            if guild_windows:
+                jobs.append((guild_name, guild_windows))
+        if not jobs:
+            self.log('No guild data found')
+            return
+
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+            futures = []
+            for guild_name, guild_windows in jobs:
+                guild_dir = guild_output_dir(output_dir, guild_name)
+                futures.append((guild_name, guild_dir, pool.submit(
+                    self.build_reports, guild_name, gbl_rows.pop(guild_name, []),
+                    mm_rows.get(guild_name, []), guild_windows, guild_dir,
+                    Profiler(memory=profiler.memory) if profiler.enabled else NULL_PROFILER)))
+            for guild_name, guild_dir, future in futures:
+                worker_profiler = future.result()
+                if profiler.enabled:
+                    profiler.merge(worker_profiler)
+                self.log('Reports for ' + str(guild_name) + ' written to ' + guild_dir)
+
+    def generate_reports(self, gbl_content: str, mm_content: str, windows: list,
+                         profiler=NULL_PROFILER) -> dict:
+        """
+        Build the reports of the configured guild straight from the contents of
+        GBLData.lua and MasterMerchant.lua, without reading or writing any
+        files. Returns a dict of output file name -> report, as text (bytes
+        for Parquet), with one entry per window and output format.
+        """
+        config = self.config
+        mm_rows = []
+        if any(window.kind == "summary" for window in windows):
+            with profiler.stage("mm decode") as stage:
+                mm_rows = self.read_mm_export(io.StringIO(mm_content))
+                stage.rows = len(mm_rows)
+        with profiler.stage("gbl decode") as stage:
+            gbl_rows = iter_gbl_history(io.StringIO(gbl_content), config.user, config.guild_name)
+            gbl_rows = _profiled_rows(gbl_rows, stage, profiler)
+        self.fill_windows(config.guild_name, gbl_rows, mm_rows, windows, profiler)
+
+        reports = {}
+        with profiler.stage("report write") as stage:
+            for window in windows:
+                reports.update(render_table(self.report_table(window), self.sinks, window.filename))
+            stage.rows = _report_rows(windows)
+        return reports
+
+    def build_reports(self, guild_name, gbl_rows, mm_rows, windows: list, output_dir: str = "",
+                      profiler=NULL_PROFILER):
+        """
+        Build every window's report for one guild from its GBL history rows and
+        MM export rows, and write the output files into ``output_dir``. Returns
+        ``profiler``, so that a worker process hands its profile back.
+        """
+        self.fill_windows(guild_name, gbl_rows, mm_rows, windows, profiler)
+
+        with profiler.stage("report write") as stage:
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            for window in windows:
+                self.write_report(window, output_dir)
+            stage.rows = _report_rows(windows)
+        return profiler
+
+    def fill_windows(self, guild_name, gbl_rows, mm_rows, windows: list, profiler=NULL_PROFILER):
+        """Fill in the users of the summary windows and the entries of the raffle windows."""
+        summary_windows = [window for window in windows if window.kind == "summary"]
+        with profiler.stage("mm users", rows=len(mm_rows)):
+            self.add_mm_rows_to_users(summary_windows, mm_rows)
+
+        # The rows are loaded into typed columns once, sorted by timestamp, and every window is
+        # then a binary-searched slice evaluated with array operations, so the history is only read
+        # once no matter how many reports are produced.
+        # With a transaction store, only the rows newer than the stored history are added to it and
+        # the windows are answered by range queries over everything stored so far.
+        with profiler.stage("row split", rows=len(gbl_rows) if profiler.enabled else None):
+            transactions = self.load_transactions(guild_name, gbl_rows)
+        try:
+            for window in windows:
+                if window.kind == "summary":
+                    with profiler.stage("unknown users"):
+                        self.log_unknown_users(window, transactions)
+                    with profiler.stage("aggregation") as stage:
+                        stage.rows = self.add_transactions_to_users(window, transactions)
+                else:
+                    with profiler.stage("raffle selection") as stage:
+                        stage.rows = self.add_transactions_to_raffle(window, transactions)
+        finally:
+            transactions.close()
+
+    def load_transactions(self, guild_name, gbl_rows):
+        """
+        Load the guild's GBL history rows into a TransactionFrame, or add them to
+        the transaction store when one is configured and return that.
+        """
+        config = self.config
+        if config.transaction_store:
+            transactions = TransactionStore(config.transaction_store, guild_name, config.raffle,
+                                            config.enable_raffle, config.exclude_users)
+            self.log('Stored ' + str(transactions.ingest(gbl_rows)) + ' new transactions')
+            return transactions
+        return TransactionFrame(gbl_rows, config.raffle, config.enable_raffle, config.exclude_users)
+
+    def add_mm_rows_to_users(self, summary_windows, mm_rows):
+        """Add a UserData for every member in the MM export rows to each summary window."""
+        for mm_line in mm_rows:
+            user_values = mm_line.split('&')
+            username = sys.intern(user_values[0])
+            sales = _mm_int(user_values[1])
+            purchases = _mm_int(user_values[2])
+            if len(user_values) == 5:
+                taxes = _mm_int(user_values[3])
+                rank = _mm_int(user_values[4])
+            else:
+                taxes = 0
+                rank = _mm_int(user_values[3])
+            for window in summary_windows:
+                new_user = UserData(username)
+                new_user.sales = sales
+                new_user.purchases = purchases
+                new_user.taxes = taxes
+                new_user.rank = rank
+
+                window.users[username] = new_user
+
+    def log_unknown_users(self, window, transactions):
+        """Log every user with transactions who isn't in the summary window's MM export."""
+        if not self.config.verbose:
+            return
+        users = window.users
+        for username in transactions.usernames():
+            if username not in users:
+                self.log('User not found: ' + username)
+
+    def add_transactions_to_users(self, window, transactions):
+        """
+        Update the totals of each user in the summary window's user dictionary,
+        which holds the username as the key and the UserData object as the value.
+        Returns the number of users with transactions in the window.
+        """
+        users = window.users
+        totals = transactions.user_totals(window.start, window.end)
+        for username, deposits, raffle, donations in zip(totals.index, totals["deposits"].tolist(),
+                                                         totals["raffle"].tolist(),
+                                                         totals["donations"].tolist()):
+            if username in users:
+                users[username].deposits = users[username].deposits + deposits
+                users[username].raffle = users[username].raffle + raffle
+                users[username].donations = users[username].donations + donations
+        return len(totals)
+
+    def add_transactions_to_raffle(self, window, transactions):
+        """
+        Add the window's gold deposits that meet the raffle requirements to its
+        entries. Returns the number of entries added.
+        """
+        if not self.config.enable_raffle:
+            return 0
+        purchases = transactions.raffle_purchases(window.start, window.end)
+        window.raffle_tix.extend(map(RaffleEntry, purchases["username"].tolist(),
+                                     purchases["timestamp"].tolist(),
+                                     purchases["raffleAmount"].tolist(),
+                                     purchases["transactionId"].tolist()))
+        return len(purchases)
+
+    ###############################################
+    ##              Weekly history               ##
+    ###############################################
+
+    def trader_weeks(self, first: int, last: int) -> list:
+        """
+        The start of every trader week (the Tuesday 19:00 UTC rollover), from
+        the week epoch second ``first`` falls in to the one ``last`` falls in.
+        """
+        week = timedelta(days=7)
+        start = TRADER_ROLLOVER + (datetime.fromtimestamp(first, timezone.utc) - TRADER_ROLLOVER) // week * week
+        weeks = []
+        while _epoch(start) <= last:
+            weeks.append(start)
+            start += week
+        return weeks
+
+    def raffle_weeks(self, first: int, last: int) -> list:
+        """
+        The raffle deadline opening every raffle week, from the week epoch
+        second ``first`` falls in to the one ``last`` falls in. The deadlines
+        follow the raffle's local time across daylight saving changes, the
+        same way generate_date_ranges places them.
+        """
+        raffle = self.config.raffle
+        zone = ZoneInfo(raffle["timezone"])
+        hour, minute, second = (int(part) for part in raffle["time"].split(':'))
+        local_first = datetime.fromtimestamp(first, zone)
+        day = local_first.date() - timedelta(days=(local_first.weekday() - raffle["day"]) % 7)
+        if datetime(day.year, day.month, day.day, hour, minute, second, 0, zone) > local_first:
+            day -= timedelta(days=7)
+        weeks = []
+        while True:
+            deadline = datetime(day.year, day.month, day.day, hour, minute, second, 0, zone)
+            if _epoch(deadline) > last:
+                return weeks
+            weeks.append(deadline)
+            day += timedelta(days=7)
+
+    def parse_history(self, gbl_file: str, output_dir: str = "", all_guilds: bool = False,
+                      profiler=NULL_PROFILER):
+        """
+        Write the weekly history of the configured guild (of every guild with
+        ``all_guilds``, each into its own directory under ``output_dir``) from
+        GBLData.lua. See build_history.
+        """
+        config = self.config
+        self.log('Attempting to generate the weekly history\n')
+        if not all_guilds:
+            with profiler.stage("gbl decode") as stage:
+                gbl_rows = cached_rows(gbl_file, gbl_history_path(config.user, config.guild_name),
+                                       lambda: iter_gbl_history(gbl_file, config.user, config.guild_name),
+                                       config.cache_dir, config.cache_max_bytes)
+                gbl_rows = _profiled_rows(gbl_rows, stage, profiler)
+            self.build_history(config.guild_name, gbl_rows, output_dir, profiler)
+            return
+
+        gbl_rows = {}
+        with profiler.stage("gbl decode") as stage:
+            for guild_name, row in iter_child_table_strings(gbl_file, gbl_history_path(config.user)):
+                gbl_rows.setdefault(guild_name, []).append(row)
+            stage.rows = sum(map(len, gbl_rows.values()))
+        if not gbl_rows:
+            self.log('No guild data found')
+        for guild_name in list(gbl_rows):
+            guild_dir = guild_output_dir(output_dir, guild_name)
+            self.build_history(guild_name, gbl_rows.pop(guild_name), guild_dir, profiler)
+            self.log('History for ' + str(guild_name) + ' written to ' + guild_dir)
+
+    def build_history(self, guild_name, gbl_rows, output_dir: str = "", profiler=NULL_PROFILER):
+        """
+        Write the weekly history tables of one guild (see history_tables) into
+        ``output_dir``. Returns ``profiler``.
+        """
+        tables = self.history_tables(guild_name, gbl_rows, profiler)
+        with profiler.stage("report write") as stage:
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            # The week columns are what the matrices are read by, so they always get a header line.
+            sinks = make_sinks(self.config.output_formats, headers=True)
+            for filename, table in tables.items():
+                write_table(table, sinks, output_dir, filename)
+            stage.rows = sum(len(table.rows) for table in tables.values())
+        return profiler
+
+    def history_tables(self, guild_name, gbl_rows, profiler=NULL_PROFILER) -> dict:
+        """
+        Bucket every transaction of the guild's history into its trader week
+        and its raffle week, and build one user x week matrix per column of the
+        donation summary, keyed by output file name:
+
+            history_deposits, history_raffle, history_donations
+                by trader week, as the donation summary would total them
+            history_raffle_weeks
+                the raffle purchases by raffle week, as raffle.csv lists them
+
+        Each week is labelled with the date it starts on and runs up to the
+        start of the next one. All the weeks are summed in the same pass over
+        the transactions, however long the history is. With a transaction
+        store, the history is everything stored so far.
+        """
+        config = self.config
+        with profiler.stage("row split", rows=len(gbl_rows) if profiler.enabled else None):
+            transactions = self.load_transactions(guild_name, gbl_rows)
+        try:
+            time_range = transactions.time_range()
+            if time_range is None:
+                self.log('No transactions for ' + str(guild_name))
+                return {}
+            with profiler.stage("weekly aggregation") as stage:
+                users = transactions.usernames()
+                trader_weeks = self.trader_weeks(*time_range)
+                totals = transactions.weekly_totals([_epoch(week) for week in trader_weeks])
+                tables = {"history_" + column + ".csv": history_table(totals[column], users, trader_weeks)
+                          for column in ("deposits", "raffle", "donations")}
+                if config.enable_raffle:
+                    raffle_weeks = self.raffle_weeks(*time_range)
+                    raffle = transactions.weekly_raffle([_epoch(week) for week in raffle_weeks])
+                    tables["history_raffle_weeks.csv"] = history_table(raffle["raffle"], users, raffle_weeks)
+                stage.rows = len(totals)
+        finally:
+            transactions.close()
+        return tables
+
+    ###############################################
+    ##          MasterMerchant.lua               ##
+    ###############################################
+
+    def read_mm_export(self, mm_source):
+        """
+        Return the member rows ("user&sales&purchases&taxes&rank") of the
+        guild's MM export. ``mm_source`` is the path of MasterMerchant.lua,
+        its contents as bytes, or an open text stream of it.
+        """
+        # MasterMerchant.lua also holds MM's settings and other account-wide tables; the scanner
+        # goes straight to the export and skips everything else without decoding it.
+        return list(iter_table_strings(mm_source, mm_export_path(self.config.user, self.config.guild_name)))
+
+    def read_mm_exports(self, mm_source):
+        """Return the MM export member rows of every guild, keyed by guild name."""
+        mm_rows = {}
+        for guild_name, row in iter_child_table_strings(mm_source, mm_export_path(self.config.user)):
+            mm_rows.setdefault(guild_name, []).append(row)
+        return mm_rows
+
+    ###############################################
+    ##               Output files                ##
+    ###############################################
+
+    def write_report(self, window, output_dir=""):
+        """Write the window's report into ``output_dir`` in every configured output format."""
+        write_table(self.report_table(window), self.sinks, output_dir, window.filename)
+
+    def report_table(self, window) -> ReportTable:
+        """Build the window's report as a table, ready for any of the output sinks."""
+        if window.kind == "summary":
+            return self.summary_table(window)
+        return self.raffle_table(window)
+
+    def summary_table(self, window) -> ReportTable:
+        """The donation summary: one row per user in the MM export, in donation_summary_format order."""
+        config = self.config
+        columns = config.donation_summary_format
+        title = None
+        if config.prefix_date:
+            title = datetime.now(timezone.utc).strftime('%m/%d/%y %H:%M:%S')
+        rows = [tuple(getattr(user, column, None) for column in columns)
+                for username, user in window.users.items() if username not in config.exclude_users]
+        return ReportTable(columns, rows, title)
+
+    def raffle_table(self, window) -> ReportTable:
+        """The raffle entries, one row per ticket purchase, in raffle_format order."""
+        columns = self.config.raffle["raffle_format"]
+        rows = [tuple(getattr(entry, column, None) for column in columns) for entry in window.raffle_tix]
+        return ReportTable(columns, rows)
+
+
+def guild_output_dir(output_dir: str, guild_name) -> str:
+    """
+    The directory a guild's reports are written to in multi-guild mode, with
+    any characters that aren't allowed in file names replaced.
+    """
+    return os.path.join(output_dir, re.sub(r'[<>:"/\\|?*]', '_', str(guild_name)).strip(' .') or '_')
+
+
+def history_table(values, users: list, weeks: list) -> ReportTable:
+    """
+    Lay out ``values``, indexed by (username, week position), as a table with
+    a row per user in ``users`` and a column per week in ``weeks``.
+    """
+    matrix = values.unstack("week", fill_value=0)
+    matrix.index = matrix.index.astype(object)
+    matrix = matrix.reindex(index=users, columns=range(len(weeks)), fill_value=0)
+    columns = ["username"] + [week.strftime('%Y-%m-%d') for week in weeks]
+    rows = [(username,) + tuple(counts) for username, counts in zip(matrix.index, matrix.to_numpy().tolist())]
+    return ReportTable(columns, rows)
+
+
+def _mm_int(value):
+    # MM exports whole numbers; anything else is kept the way it was exported.
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _profiled_rows(rows, stage, profiler):
+    # GBL rows are normally streamed into the row split as they are read. When profiling, they
+    # are read in full here instead, so that the decode is timed on its own.
+    if not profiler.enabled:
+        return rows
+    rows = list(rows)
+    stage.rows = len(rows)
+    return rows
+
+
+def _report_rows(windows: list) -> int:
+    return sum(len(window.users) if window.kind == "summary" else len(window.raffle_tix)
+               for window in windows)
+
+
+def _epoch(moment: datetime) -> int:
+    # Transactions are compared against the windows as plain epoch seconds.
+    return int(moment.timestamp())
@@ -0,0 +1,145 @@
+"""
+Output formats of the donation summary and raffle reports.
+
+Each report is built once as a ReportTable: the columns picked by
+DONATION_SUMMARY_FORMAT or raffle_format and one tuple of values per row,
+None where a field has no value. The table is then handed to a sink per
+output format, each of which writes it out in bulk:
+
+    csv      the classic report files, through csv.writer
+    parquet  one typed column per field (pyarrow)
+    jsonl    one JSON object per row
+
+so asking for more formats doesn't build the report again. A sink writes the
+report under the window's file name with its own extension, e.g.
+donation_summary.parquet next to donation_summary.csv.
+"""
+
+import csv
+import io
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class ReportTable:
+    """
+    Parameters
+    ----------
+    columns
+        Column names in output order; "" is a blank spacer column
+    rows
+        One tuple of values per row, None for a missing value
+    title
+        Line printed above the CSV report (the run date), or None
+    """
+
+    def __init__(self, columns, rows, title=None):
+        self.columns = list(columns)
+        self.rows = rows
+        self.title = title
+
+    def data_columns(self) -> list:
+        """Positions of the named columns; the blank spacer columns only matter to the CSV layout."""
+        seen = set()
+        positions = []
+        for position, name in enumerate(self.columns):
+            if name and name not in seen:
+                seen.add(name)
+                positions.append(position)
+        return positions
+
+
+class CsvSink:
+    """The report as comma separated text, optionally with a header line."""
+
+    name = "csv"
+    extension = ".csv"
+    binary = False
+
+    def __init__(self, headers=False):
+        self.headers = headers
+
+    def write(self, table: ReportTable, stream) -> None:
+        if table.title is not None:
+            stream.write(table.title + "\n")
+        writer = csv.writer(stream, lineterminator="\n")
+        if self.headers:
+            writer.writerow(table.columns)
+        writer.writerows(table.rows)
+
+
+class JsonlSink:
+    """The report as one JSON object per line, keyed by column name."""
+
+    name = "jsonl"
+    extension = ".jsonl"
+    binary = False
+
+    def write(self, table: ReportTable, stream) -> None:
+        positions = table.data_columns()
+        names = [table.columns[position] for position in positions]
+        stream.writelines(json.dumps(dict(zip(names, (row[position] for position in positions))),
+                                     ensure_ascii=False) + "\n"
+                          for row in table.rows)
+
+
+class ParquetSink:
+    """The report as a Parquet file with one typed column per field."""
+
+    name = "parquet"
+    extension = ".parquet"
+    binary = True
+
+    def write(self, table: ReportTable, stream) -> None:
+        arrays = {}
+        for position in table.data_columns():
+            values = [row[position] for row in table.rows]
+            try:
+                arrays[table.columns[position]] = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # A column mixing numbers and text is kept as text.
+                arrays[table.columns[position]] = pa.array([None if value is None else str(value)
+                                                            for value in values], pa.string())
+        metadata = {"title": table.title} if table.title is not None else None
+        pq.write_table(pa.table(arrays, metadata=metadata), stream, compression="zstd")
+
+
+SINKS = {sink.name: sink for sink in (CsvSink, ParquetSink, JsonlSink)}
+
+
+def make_sinks(formats, headers=False) -> list:
+    """
+    Return a sink for each of the ``formats`` (names in SINKS). ``headers``
+    adds the header line to CSV output.
+    """
+    sinks = []
+    for name in formats:
+        if name not in SINKS:
+            raise ValueError(f"unknown output format {name!r}, expected one of {', '.join(SINKS)}")
+        sinks.append(CsvSink(headers) if SINKS[name] is CsvSink else SINKS[name]())
+    return sinks
+
+
+def output_name(filename: str, sink) -> str:
+    """The file name ``sink`` writes the report of ``filename`` (e.g. raffle.csv) to."""
+    return os.path.splitext(filename)[0] + sink.extension
+
+
+def write_table(table: ReportTable, sinks: list, output_dir: str, filename: str) -> None:
+    """Write ``table`` into ``output_dir`` once per sink."""
+    for sink in sinks:
+        with open(os.path.join(output_dir, output_name(filename, sink)), 'wb' if sink.binary else 'w') as writer:
+            sink.write(table, writer)
+
+
+def render_table(table: ReportTable, sinks: list, filename: str) -> dict:
+    """Return the output of each sink as output file name -> str (or bytes for binary formats)."""
+    outputs = {}
+    for sink in sinks:
+        stream = io.BytesIO() if sink.binary else io.StringIO()
+        sink.write(table, stream)
+        outputs[output_name(filename, sink)] = stream.getvalue()
+    return outputs
@@ -0,0 +1,322 @@
+"""
+Streaming reader for ESO SavedVariables files (GBLData.lua, MasterMerchant.lua).
+
+Instead of decoding the whole file into nested Python objects with slpp, the
+file is tokenized a chunk at a time and only the table found at the requested
+key path is visited. The string values in that table are yielded one by one,
+exactly as slpp would have decoded them, so memory use stays flat regardless
+of how much history the file holds.
+
+A file given by path is memory-mapped and scanned as bytes (as are contents
+given as bytes) instead of being read through a text stream: the tables that
+aren't wanted are jumped over with a single regular expression search per
+brace, and only the keys on the way and the strings of the wanted table are
+ever decoded to str. Open streams are tokenized a chunk at a time.
+"""
+
+import mmap
+import re
+
+# Number of characters read from the source file at a time.
+CHUNK_SIZE = 1 << 20
+
+# Leading whitespace and `--` comments are folded into every token match so
+# that they never have to be yielded. The possessive `*+` keeps a long run of
+# indentation cut off by a chunk boundary from backtracking exponentially.
+_TOKEN = re.compile(r'''
+    (?:\s+|--[^\n]*)*+
+    (?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<number>-?(?:0[xX][0-9A-Fa-f]+|[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?))
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<punct>[{}\[\]=,;])
+    )
+''', re.VERBOSE | re.DOTALL)
+_TRAILING = re.compile(r'(?:\s+|--[^\n]*)*+\Z')
+_LOOKAHEAD = 32
+
+# The same tokens over the bytes of a memory-mapped file.
+_BYTE_TOKEN = re.compile(_TOKEN.pattern.encode('ascii'), re.VERBOSE | re.DOTALL)
+_BYTE_TRAILING = re.compile(_TRAILING.pattern.encode('ascii'))
+# Everything up to the next brace that isn't inside a string or a comment.
+_BYTE_SKIP = re.compile(rb'''(?:[^{}"'-]++|"(?:[^"\\]|\\.)*+"|'(?:[^'\\]|\\.)*+'|--[^\n]*+|-)*+''',
+                        re.DOTALL)
+# One `[n] = "value",` (or bare `"value",`) entry of a table of strings, the
+# shape of every GBL history row and MM export row.
+_BYTE_ARRAY_STRING = re.compile(
+    rb'''(?:\s+|--[^\n]*)*+(?:\[\s*[0-9]+\s*\]\s*=\s*)?"((?:[^"\\]|\\.)*+)"\s*[,;]?''', re.DOTALL)
+
+
+class _Lexer:
+    """Tokenizes a text stream incrementally, one buffered chunk at a time."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.pushed = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pushed is not None:
+            token, self.pushed = self.pushed, None
+            return token
+        while True:
+            m = _TOKEN.match(self.buf, self.pos)
+            # Numbers and names could continue past the end of the buffer, so
+            # only trust them once enough lookahead has been read behind them.
+            if m is not None and (self.eof or m.lastgroup in ('string', 'punct')
+                                  or m.end() + _LOOKAHEAD < len(self.buf)):
+                self.pos = m.end()
+                return m.lastgroup, m.group(m.lastgroup)
+            if self.eof:
+                if _TRAILING.match(self.buf, self.pos):
+                    raise StopIteration
+                raise ValueError('Unexpected character in Lua source: '
+                                 + repr(self.buf[self.pos:self.pos + 20]))
+            chunk = self.reader.read(CHUNK_SIZE)
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+            else:
+                self.eof = True
+
+    def push(self, token):
+        self.pushed = token
+
+    def expect(self, text):
+        token = next(self, (None, None))
+        if token[1] != text:
+            raise ValueError(f'Expected {text!r} in Lua source, got {token[1]!r}')
+
+    def array_string(self):
+        # Only the mapped lexer has a fast path for table entries.
+        return None
+
+    def skip_table(self):
+        """Skip the rest of the table whose opening brace was just consumed."""
+        depth = 1
+        for kind, text in self:
+            if kind == 'punct':
+                if text == '{':
+                    depth += 1
+                elif text == '}':
+                    depth -= 1
+                    if depth == 0:
+                        return
+        raise ValueError('Unexpected end of table in Lua source')
+
+
+class _MappedLexer(_Lexer):
+    """
+    Tokenizes the bytes of a whole memory-mapped file. Tokens are decoded to
+    str as they are returned; tables that are skipped are never decoded.
+    """
+
+    def __init__(self, buf):
+        super().__init__(None)
+        self.buf = buf
+        self.eof = True
+
+    def __next__(self):
+        if self.pushed is not None:
+            token, self.pushed = self.pushed, None
+            return token
+        m = _BYTE_TOKEN.match(self.buf, self.pos)
+        if m is None:
+            if _BYTE_TRAILING.match(self.buf, self.pos):
+                raise StopIteration
+            raise ValueError('Unexpected character in Lua source: '
+                             + repr(self.buf[self.pos:self.pos + 20]))
+        self.pos = m.end()
+        return m.lastgroup, m.group(m.lastgroup).decode('utf-8')
+
+    def array_string(self):
+        """
+        Consume the next entry of a table of strings and return its value as
+        slpp would decode it, or None if the next entry is anything else.
+        """
+        if self.pushed is not None:
+            return None
+        m = _BYTE_ARRAY_STRING.match(self.buf, self.pos)
+        if m is None:
+            return None
+        self.pos = m.end()
+        return m.group(1).replace(b'\\"', b'"').decode('utf-8')
+
+    def skip_table(self):
+        depth = 1
+        buf = self.buf
+        while True:
+            pos = _BYTE_SKIP.match(buf, self.pos).end()
+            if pos >= len(buf):
+                raise ValueError('Unexpected end of table in Lua source')
+            self.pos = pos + 1
+            if buf[pos] == ord('{'):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+
+def _literal(kind, text):
+    # slpp only unescapes the quote character that delimits the string; every
+    # other backslash sequence (notably the GBL "\t" separators) is kept as-is.
+    if kind == 'string':
+        quote = text[0]
+        return text[1:-1].replace('\\' + quote, quote)
+    if kind == 'number':
+        try:
+            return int(text, 0)
+        except ValueError:
+            return float(text)
+    return {'true': True, 'false': False, 'nil': None}.get(text, text)
+
+
+def _walk_table(lexer, key_path, found, top_level=False, children=False):
+    """
+    Walk the table whose opening brace was just consumed. While ``key_path``
+    is not empty, descend into the entry matching its first key and skip all
+    others; once it is empty, yield the table's string values, or with
+    ``children`` the (key, value) pairs of the strings in each subtable.
+    """
+    index = 1
+    leaf = not key_path and not children
+    while True:
+        if leaf:
+            value = lexer.array_string()
+            if value is not None:
+                yield value
+                continue
+        kind, text = next(lexer, (None, None))
+        if kind is None:
+            break
+        if kind == 'punct':
+            if text == '}' and not top_level:
+                return
+            if text in (',', ';'):
+                continue
+            if text == '[':
+                key = _literal(*next(lexer))
+                lexer.expect(']')
+                lexer.expect('=')
+                kind, text = next(lexer)
+            elif text == '{':
+                key = index
+                index += 1
+            else:
+                raise ValueError(f'Unexpected {text!r} in Lua source')
+        elif kind == 'name':
+            following = next(lexer, (None, None))
+            if following[1] == '=':
+                key = text
+                kind, text = next(lexer)
+            else:
+                lexer.push(following)
+                key = index
+                index += 1
+        else:
+            key = index
+            index += 1
+
+        if kind == 'punct' and text == '{':
+            if key_path and key == key_path[0]:
+                # Everything we need lives under this entry, so there is no
+                # reason to read the rest of the file.
+                found.append(key)
+                yield from _walk_table(lexer, key_path[1:], found, children=children)
+                return
+            if children and not key_path:
+                for value in _walk_table(lexer, (), []):
+                    yield key, value
+            else:
+                lexer.skip_table()
+        elif kind == 'string' and not key_path and not children:
+            yield _literal(kind, text)
+    if not top_level:
+        raise ValueError('Unexpected end of table in Lua source')
+
+
+def iter_table_strings(source, key_path):
+    """
+    Parameters
+    ----------
+    source
+        Path to a SavedVariables file, its contents as bytes, or an open text
+        stream
+    key_path
+        Keys leading from the top-level variable down to the wanted table,
+        e.g. ("GBLDataSavedVariables", "Default", "@user", "$AccountWide",
+        "history", "Guild Name")
+
+    Yields the string values of that table in file order. Raises KeyError
+    naming the first key that could not be found.
+    """
+    key_path = tuple(key_path)
+    if hasattr(source, 'read'):
+        yield from _iter_stream(source, key_path)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield from _iter_stream(None, key_path, lexer=_MappedLexer(source))
+    else:
+        yield from _iter_mapped(source, key_path)
+
+
+def iter_child_table_strings(source, key_path):
+    """
+    Like iter_table_strings, but for a table of tables such as the GBL history
+    of every guild: yields (child key, value) for the string values of each
+    subtable of the table at ``key_path``, in a single pass over the file.
+    """
+    key_path = tuple(key_path)
+    if hasattr(source, 'read'):
+        yield from _iter_stream(source, key_path, children=True)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield from _iter_stream(None, key_path, children=True, lexer=_MappedLexer(source))
+    else:
+        yield from _iter_mapped(source, key_path, children=True)
+
+
+def _iter_stream(reader, key_path, children=False, lexer=None):
+    found = []
+    yield from _walk_table(lexer or _Lexer(reader), key_path, found, top_level=True, children=children)
+    if len(found) < len(key_path):
+        raise KeyError(key_path[len(found)])
+
+
+def _iter_mapped(path, key_path, children=False):
+    with open(path, 'rb') as reader:
+        try:
+            mapped = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can't be mapped.
+            yield from _iter_stream(None, key_path, children, lexer=_MappedLexer(b''))
+            return
+        with mapped:
+            yield from _iter_stream(None, key_path, children, lexer=_MappedLexer(mapped))
+
+
+def gbl_history_path(user, guild_name=None):
+    """
+    Key path of the GBL history table of ``guild_name`` as saved by ``user``,
+    or of the table holding every guild's history if ``guild_name`` is None.
+    """
+    path = ("GBLDataSavedVariables", "Default", user, "$AccountWide", "history")
+    return path if guild_name is None else path + (guild_name,)
+
+
+def mm_export_path(user, guild_name=None):
+    """
+    Key path of the Master Merchant member export of ``guild_name`` made by
+    ``user``, or of the table holding every guild's export if ``guild_name`` is None.
+    """
+    path = ("ShopkeeperSavedVars", "Default", user, "$AccountWide", "EXPORT")
+    return path if guild_name is None else path + (guild_name,)
+
+
+def iter_gbl_history(source, user, guild_name):
+    """Yield the raw GBL history rows of ``guild_name`` as saved by ``user``."""
+    return iter_table_strings(source, gbl_history_path(user, guild_name))
@@ -0,0 +1,122 @@
+"""
+On-disk cache of the rows extracted from ESO SavedVariables files.
+
+Pulling the history rows out of GBLData.lua or the export rows out of
+MasterMerchant.lua means walking the whole Lua file. The rows themselves are
+a small fraction of that, so after the first extraction they are stored in
+a flat UTF-8 file, one row per line, keyed on the SHA-256 of the source file
+and the key path they were taken from. Running again on unchanged files then
+only has to hash the source and stream the rows back.
+
+The cache directory is kept under a size limit by evicting the least
+recently used snapshots.
+"""
+
+import hashlib
+import os
+import tempfile
+
+# Bump when the snapshot layout changes so old entries are never read back.
+CACHE_VERSION = 1
+
+CACHE_SUFFIX = ".rows"
+
+
+def source_digest(source_file: str) -> str:
+    """Return the SHA-256 hex digest of the contents of ``source_file``."""
+    with open(source_file, 'rb') as reader:
+        return hashlib.file_digest(reader, 'sha256').hexdigest()
+
+
+def cache_key(digest: str, key_path) -> str:
+    key = hashlib.sha256(f"{CACHE_VERSION}\0{digest}".encode('utf-8'))
+    for part in key_path:
+        key.update(b"\0" + str(part).encode('utf-8'))
+    return key.hexdigest()
+
+
+def cached_rows(source_file: str, key_path, extract, cache_dir: str | None, max_bytes: int):
+    """
+    Parameters
+    ----------
+    source_file
+        The SavedVariables file the rows come from
+    key_path
+        The key path of the table being extracted; part of the cache key
+    extract
+        Called with no arguments on a cache miss, returns an iterable of rows
+    cache_dir
+        Directory holding the snapshots, or None to disable caching
+    max_bytes
+        Upper bound on the total size of the snapshots in ``cache_dir``
+
+    Yields the extracted rows, streaming them from the snapshot on a hit and
+    recording them into a new snapshot on a miss.
+    """
+    if not cache_dir:
+        yield from extract()
+        return
+
+    snapshot = os.path.join(cache_dir, cache_key(source_digest(source_file), key_path) + CACHE_SUFFIX)
+    try:
+        reader = open(snapshot, 'r', encoding='utf-8', newline='\n')
+    except FileNotFoundError:
+        pass
+    else:
+        with reader:
+            # Refresh the mtime so eviction treats this snapshot as recently used.
+            os.utime(snapshot)
+            for line in reader:
+                yield line[:-1]
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, partial = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    complete = False
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as writer:
+            cacheable = True
+            for row in extract():
+                if cacheable:
+                    if '\n' in row:
+                        cacheable = False
+                    else:
+                        writer.write(row)
+                        writer.write('\n')
+                yield row
+        # Only a fully consumed extraction is published, and the rename keeps
+        # other readers from ever seeing a half-written snapshot.
+        if cacheable:
+            os.replace(partial, snapshot)
+            complete = True
+    finally:
+        if not complete:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+    if complete:
+        evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir: str, max_bytes: int) -> None:
+    """Delete the least recently used snapshots until the cache fits in ``max_bytes``."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(CACHE_SUFFIX):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        total -= size
@@ -1,7 +1,36 @@
 # streamlit_app.py
 import streamlit as st
-import os
-import subprocess
+import hashlib
+import time
+from guild_stats_web import make_engine
+from profiling import NULL_PROFILER, Profiler
+import report_api
+from report_engine import ReportWindow
+
+# The files offered for download for each week.
+DOWNLOADS = {
+    "This": ["donation_summary.csv", "raffle.csv"],
+    "Last": ["donation_summary.csv", "raffle.csv", "raffle-last.csv"],
+}
+
+# Runs the reports in-process. Streamlit caches the result on the upload digests, the export user
+# and the report windows (which follow from the week), so re-running with the same files and
+# options returns immediately. The upload contents themselves are left out of the cache key.
+# Windows that are still open end "now", which would change the key every second, so their end
+# is passed as None and filled in here; the uploads can't hold anything newer anyway.
+# With profile, the per-stage numbers of the run (see profiling.py) are returned with the reports.
+@st.cache_data(show_spinner=False)
+def run_reports(gbl_digest, mm_digest, week, user, bounds, profile, _gbl_content, _mm_content):
+    now = int(time.time())
+    windows = [ReportWindow(kind, start, now if end is None else end, filename)
+               for kind, start, end, filename in bounds]
+    profiler = Profiler() if profile else NULL_PROFILER
+    try:
+        reports = report_api.run_reports(make_engine(user).config, _gbl_content, _mm_content,
+                                         windows=windows, profiler=profiler).render()
+    finally:
+        profiler.close()
+    return reports, profiler.to_dict() if profile else None
 
 # Initialize session state flag
 if "ready_for_download" not in st.session_state:
@@ -23,42 +52,34 @@ genre = st.radio(
 gbl_file = st.file_uploader("Upload GBLData.lua", type="lua")
 mm_file = st.file_uploader("Upload MasterMerchant.lua", type="lua")
 
-if gbl_file and mm_file:
-    with open("GBLData.lua", "wb") as f:
-        f.write(gbl_file.read())
-    with open("MasterMerchant.lua", "wb") as f:
-        f.write(mm_file.read())
+profile_run = st.checkbox("Show the time and memory each stage of the run takes")
 
+reports = profile = None
+if gbl_file and mm_file:
     if st.button("Run Guild Stats"):
-        subprocess.run(["python", "guild_stats_web.py", "--week=" + genre.lower(), "--user=@jeffk42", "--no-copy"])
         st.session_state.ready_for_download = True
+
+    if st.session_state.ready_for_download:
+        gbl_bytes = gbl_file.getvalue()
+        mm_bytes = mm_file.getvalue()
+        week = genre.lower()
+        now = int(time.time())
+        bounds = tuple((window.kind, window.start, None if window.end >= now else window.end,
+                        window.filename)
+                       for window in make_engine(title).generate_windows(week))
+        reports, profile = run_reports(hashlib.sha256(gbl_bytes).hexdigest(),
+                                       hashlib.sha256(mm_bytes).hexdigest(),
+                                       week, title, bounds, profile_run, gbl_bytes, mm_bytes)
         st.success("CSV files generated successfully!")
-        
-#        with open("donation_summary.csv", "rb") as f:
-#            st.download_button("Download donation_summary.csv", f, file_name="donation_summary.csv")
-#        with open("raffle.csv", "rb") as f:
-#            st.download_button("Download raffle.csv", f, file_name="raffle.csv")
 
 # Show download buttons if ready
-if st.session_state.ready_for_download:
-    if genre == "This":
-        col1, col2 = st.columns(2)
-        with col1:
-            with open("donation_summary.csv", "rb") as f:
-                st.download_button("Download donation_summary.csv", f, file_name="donation_summary.csv")
-        with col2:
-            with open("raffle.csv", "rb") as f:
-                st.download_button("Download raffle.csv", f, file_name="raffle.csv")
-    else:
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            with open("donation_summary.csv", "rb") as f:
-                st.download_button("Download donation_summary.csv", f, file_name="donation_summary.csv")
-        with col2:
-            with open("raffle.csv", "rb") as f:
-                st.download_button("Download raffle.csv", f, file_name="raffle.csv")
-        with col3:
-            with open("raffle-last.csv", "rb") as f:
-                st.download_button("Download raffle-last.csv", f, file_name="raffle-last.csv")
-
+if reports:
+    files = [name for name in DOWNLOADS[genre] if name in reports]
+    for column, name in zip(st.columns(len(files)), files):
+        with column:
+            st.download_button("Download " + name, reports[name], file_name=name, mime="text/csv")
 
+# A cached result shows the profile of the run that produced it.
+if profile:
+    st.subheader("Run profile")
+    st.dataframe(profile["stages"] + [profile["total"]], hide_index=True)
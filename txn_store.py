@@ -0,0 +1,209 @@
+"""
+Optional SQLite store of Guild Bank Ledger transactions.
+
+GBLData.lua only holds as much history as ESO hands back to the add-on, and
+every run re-reads all of it. The store keeps every transaction it has ever
+been given, deduplicated on transactionId, and remembers a per-guild
+high-water mark so that later runs only insert rows at or after the newest
+timestamp already stored. The donation summary and raffle reports are then
+answered with indexed range queries instead of a rescan of the ledger.
+"""
+
+import sqlite3
+
+import pandas as pd
+
+from gbl_frame import weekly_totals
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    guild TEXT NOT NULL,
+    transaction_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    transaction_type TEXT NOT NULL,
+    gold_amount INTEGER,
+    item_count INTEGER,
+    item_description TEXT,
+    item_link TEXT,
+    item_value REAL,
+    PRIMARY KEY (guild, transaction_id)
+);
+CREATE INDEX IF NOT EXISTS transactions_time ON transactions (guild, timestamp);
+CREATE INDEX IF NOT EXISTS transactions_user_time ON transactions (guild, username, timestamp);
+CREATE INDEX IF NOT EXISTS transactions_type_time ON transactions (guild, transaction_type, timestamp);
+CREATE TABLE IF NOT EXISTS high_water (
+    guild TEXT PRIMARY KEY,
+    timestamp INTEGER NOT NULL
+);
+"""
+
+
+def _nullable(value: str, convert):
+    return None if value == "nil" else convert(value)
+
+
+class TransactionStore:
+    """
+    Parameters
+    ----------
+    path
+        The SQLite database file; created on first use
+    guild_name
+        The guild whose transactions are ingested and reported on
+    raffle
+        The raffle rules (see RAFFLE in guild_stats.py)
+    enable_raffle
+        If False no deposit counts as a raffle purchase
+    exclude_users
+        Usernames left out of every report
+    """
+
+    def __init__(self, path: str, guild_name: str, raffle: dict, enable_raffle: bool,
+                 exclude_users=()):
+        # Reports for several guilds may be built in parallel processes sharing one store, so
+        # writers wait for each other's ingest to commit rather than failing after the default 5s.
+        self.conn = sqlite3.connect(path, timeout=300)
+        self.conn.executescript(SCHEMA)
+        self.guild_name = guild_name
+        self.exclude_users = list(exclude_users)
+
+        if not enable_raffle:
+            self.eligible = "0"
+            self.modifier = 0
+        elif raffle["enable_requirements"]:
+            self.eligible = ("(transaction_type = 'dep_gold' AND gold_amount IS NOT NULL"
+                             " AND (gold_amount - :modifier) % :price = 0)")
+            self.modifier = raffle["deposit_modifier"]
+        else:
+            self.eligible = "(transaction_type = 'dep_gold' AND gold_amount IS NOT NULL)"
+            self.modifier = 0
+        self.price = raffle["ticket_price"]
+
+    def high_water(self):
+        """Return the newest timestamp stored for the guild, or None if nothing is stored."""
+        row = self.conn.execute("SELECT timestamp FROM high_water WHERE guild = ?",
+                                (self.guild_name,)).fetchone()
+        return row[0] if row else None
+
+    def ingest(self, rows, full: bool = False) -> int:
+        """
+        Store the raw GBL history ``rows`` that are at or after the high-water
+        mark (all of them if ``full``) and return how many were new. Rows
+        already stored are ignored by transactionId.
+        """
+        high_water = None if full else self.high_water()
+        newest = high_water
+        records = []
+        for row in rows:
+            # Only the leading timestamp is looked at for rows that were
+            # already ingested by an earlier run.
+            timestamp = int(row[:row.find("\\t")])
+            if high_water is not None and timestamp < high_water:
+                continue
+            fields = row.split("\\t")
+            records.append((self.guild_name, fields[8], timestamp, fields[1], fields[2],
+                            _nullable(fields[3], int), _nullable(fields[4], int),
+                            fields[5], fields[6], _nullable(fields[7], float)))
+            if newest is None or timestamp > newest:
+                newest = timestamp
+
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  records)
+            inserted = self.conn.total_changes - before
+            if newest is not None:
+                self.conn.execute("INSERT OR REPLACE INTO high_water VALUES (?, ?)",
+                                  (self.guild_name, newest))
+        return inserted
+
+    def _params(self, **extra) -> dict:
+        params = {"guild": self.guild_name, "modifier": self.modifier, "price": self.price}
+        params.update({f"exclude{i}": name for i, name in enumerate(self.exclude_users)})
+        params.update(extra)
+        return params
+
+    def _not_excluded(self) -> str:
+        names = ", ".join(f":exclude{i}" for i in range(len(self.exclude_users)))
+        return f"username NOT IN ({names})" if names else "1"
+
+    def usernames(self) -> list:
+        """Return the distinct usernames in the stored history, in order of first appearance."""
+        query = (f"SELECT username FROM transactions WHERE guild = :guild AND {self._not_excluded()}"
+                 " GROUP BY username ORDER BY MIN(rowid)")
+        return [row[0] for row in self.conn.execute(query, self._params())]
+
+    def user_totals(self, start: int, end: int) -> pd.DataFrame:
+        """
+        Sum the deposits, raffle and donations columns of the donation summary
+        per user for start <= timestamp <= end. Gold deposits that are raffle
+        purchases count towards raffle instead of deposits.
+        """
+        query = f"""
+            SELECT username, SUM(deposits) AS deposits, SUM(raffle) AS raffle, SUM(donations) AS donations
+            FROM ({self._amounts()})
+            WHERE guild = :guild AND timestamp BETWEEN :start AND :end AND {self._not_excluded()}
+            GROUP BY username
+        """
+        return pd.read_sql_query(query, self.conn, index_col="username",
+                                 params=self._params(start=start, end=end))
+
+    def _amounts(self) -> str:
+        # What each transaction adds to the deposits, raffle and donations columns.
+        return f"""
+            SELECT timestamp, username,
+                   CASE WHEN transaction_type = 'dep_gold' AND gold_amount IS NOT NULL
+                         AND NOT {self.eligible} THEN gold_amount ELSE 0 END AS deposits,
+                   CASE WHEN {self.eligible} THEN gold_amount - :modifier ELSE 0 END AS raffle,
+                   CASE WHEN transaction_type = 'dep_item' AND item_count IS NOT NULL
+                         AND item_value IS NOT NULL
+                        THEN item_count * CAST(item_value AS INTEGER) ELSE 0 END AS donations,
+                   guild
+            FROM transactions
+        """
+
+    def raffle_purchases(self, start: int, end: int) -> pd.DataFrame:
+        """Return the raffle-eligible deposits with start <= timestamp <= end, in ledger order."""
+        query = f"""
+            SELECT timestamp, username, gold_amount - :modifier AS raffleAmount,
+                   transaction_id AS transactionId
+            FROM transactions
+            WHERE guild = :guild AND transaction_type = 'dep_gold'
+                  AND timestamp BETWEEN :start AND :end
+                  AND {self.eligible} AND {self._not_excluded()}
+            ORDER BY rowid
+        """
+        return pd.read_sql_query(query, self.conn, params=self._params(start=start, end=end))
+
+    def time_range(self):
+        """Return the oldest and newest timestamp stored for the guild, or None if nothing is stored."""
+        row = self.conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM transactions WHERE guild = ?",
+                                (self.guild_name,)).fetchone()
+        return row if row[0] is not None else None
+
+    def weekly_totals(self, week_starts) -> pd.DataFrame:
+        """
+        Sum the deposits, raffle and donations columns per user and week over
+        the whole stored history (see gbl_frame.weekly_totals), reading it once.
+        """
+        query = f"""
+            SELECT timestamp, username, deposits, raffle, donations
+            FROM ({self._amounts()})
+            WHERE guild = :guild AND {self._not_excluded()}
+        """
+        amounts = pd.read_sql_query(query, self.conn, params=self._params())
+        return weekly_totals(amounts.drop(columns="timestamp"), amounts["timestamp"].to_numpy(), week_starts)
+
+    def weekly_raffle(self, week_starts) -> pd.DataFrame:
+        """Sum the raffle purchases per user and week over the whole stored history."""
+        purchases = pd.read_sql_query(f"""
+            SELECT timestamp, username, gold_amount - :modifier AS raffle
+            FROM transactions
+            WHERE guild = :guild AND transaction_type = 'dep_gold'
+                  AND {self.eligible} AND {self._not_excluded()}
+        """, self.conn, params=self._params())
+        return weekly_totals(purchases.drop(columns="timestamp"), purchases["timestamp"].to_numpy(), week_starts)
+
+    def close(self) -> None:
+        self.conn.close()
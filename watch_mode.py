@@ -0,0 +1,236 @@
+"""
+Resident watch mode: regenerate the reports whenever ESO saves new data.
+
+guild_stats.py --watch (and guild_stats_web.py --watch) stay running instead
+of exiting after one run. They watch the SavedVariables directory and, once
+ESO has finished writing after a /reloadui or logout, regenerate the reports
+with the engine they already have. Only the files whose contents changed are
+copied and decoded again; the rows of the other file are kept in memory from
+the last run. A save that leaves both files as they were regenerates
+nothing.
+
+The time from the file being written to the reports being updated is printed
+for every regeneration, and can be appended to a JSON lines log.
+
+watch_directory() is the debounced directory watch underneath, also used by
+aktt_receiver.py for the incoming push directory.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from savedvars import iter_gbl_history, iter_child_table_strings, gbl_history_path
+from snapshot_cache import source_digest
+
+
+class _DirectoryHandler(FileSystemEventHandler):
+
+    def __init__(self, directory: str, wanted, wake):
+        self.directory = os.path.abspath(directory)
+        self.wanted = wanted
+        self.wake = wake
+
+    def on_any_event(self, event):
+        # Reading a file isn't a change.
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        path = getattr(event, "dest_path", "") or event.src_path
+        if self.wanted(os.path.relpath(os.path.abspath(path), self.directory)):
+            self.wake()
+
+
+def watch_directory(directory: str, wanted, handle, debounce: float = 2, max_delay: float = 30,
+                    poll_interval: float = 300) -> None:
+    """
+    Run until interrupted, calling ``handle(first_change)`` whenever entries
+    of ``directory`` change.
+
+    Parameters
+    ----------
+    directory
+        The directory watched (not recursively)
+    wanted
+        Called with the name of a changed entry, relative to ``directory``;
+        only changes for which it returns True count
+    handle
+        Called with the time.time() of the first change of a burst, once no
+        change has come for ``debounce`` seconds (but no later than
+        ``max_delay`` after the first change). It is also called with None
+        once at the start and every ``poll_interval`` seconds without a
+        change, in case a file system event was missed.
+    """
+    lock = threading.Condition()
+    arrivals = {"first": None, "last": None, "first_time": None}
+
+    def wake():
+        with lock:
+            now = time.monotonic()
+            if arrivals["first"] is None:
+                arrivals["first"] = now
+                arrivals["first_time"] = time.time()
+            arrivals["last"] = now
+            lock.notify()
+
+    observer = Observer()
+    observer.schedule(_DirectoryHandler(directory, wanted, wake), directory, recursive=False)
+    observer.start()
+    try:
+        handle(None)
+        while True:
+            with lock:
+                if arrivals["first"] is None:
+                    lock.wait(poll_interval)
+                while arrivals["first"] is not None:
+                    due = min(arrivals["last"] + debounce, arrivals["first"] + max_delay)
+                    if time.monotonic() >= due:
+                        break
+                    lock.wait(due - time.monotonic())
+                first_change = arrivals["first_time"]
+                arrivals["first"] = arrivals["last"] = arrivals["first_time"] = None
+            handle(first_change)
+    finally:
+        observer.stop()
+        observer.join()
+
+
+class ReportWatcher:
+    """
+    Parameters
+    ----------
+    engine
+        The ReportEngine the reports are generated with
+    week, raffle_only, raffle_final
+        As for a single run (see ReportEngine.generate_windows)
+    sources
+        {"gbl": (saved, working), "mm": (saved, working)}: each file as ESO
+        saves it and the path the reports are read from, which it is copied to
+        when it changes. Give the same path twice to read it in place.
+    output_dir
+        Where the reports are written; with ``all_guilds`` each guild's go
+        into its own directory under it
+    all_guilds
+        Generate every guild's reports instead of only the configured guild's
+    latency_log
+        JSON lines file each regeneration's timings are appended to, or None
+    after
+        Called with no arguments after every regeneration, e.g. to push the
+        files on; an exception from it is printed and the watch goes on
+    """
+
+    def __init__(self, engine, week, sources: dict, output_dir: str = "", all_guilds=False,
+                 raffle_only=False, raffle_final=False, latency_log=None, after=None):
+        self.engine = engine
+        self.week = week
+        self.raffle_only = raffle_only
+        self.raffle_final = raffle_final
+        # Without a donation summary the MM export isn't read, so its changes don't matter.
+        self.sources = {kind: paths for kind, paths in sources.items() if kind != "mm" or not raffle_only}
+        self.output_dir = output_dir
+        self.all_guilds = all_guilds
+        self.latency_log = latency_log
+        self.after = after
+        self.digests = {}
+        self.rows = {"gbl": {} if all_guilds else [], "mm": {} if all_guilds else []}
+
+    def names(self) -> set:
+        """File names of the watched SavedVariables files."""
+        return {os.path.basename(saved) for saved, _ in self.sources.values()}
+
+    def refresh(self, first_change=None) -> bool:
+        """
+        Regenerate the reports if GBLData.lua or MasterMerchant.lua changed
+        since the last call, reading only the file(s) that did. Returns
+        whether the reports were regenerated.
+        """
+        changed = {}
+        for kind, (saved, _) in self.sources.items():
+            try:
+                digest = source_digest(saved)
+            except FileNotFoundError:
+                # ESO replaces the file; the event of it coming back triggers another refresh.
+                return False
+            if digest != self.digests.get(kind):
+                changed[kind] = digest
+        if not changed:
+            if first_change is not None:
+                self.engine.log("[watch] saved, but nothing changed")
+            return False
+
+        started = time.perf_counter()
+        try:
+            for kind in changed:
+                saved, working = self.sources[kind]
+                if os.path.abspath(saved) != os.path.abspath(working):
+                    shutil.copy2(saved, working)
+                self.rows[kind] = self.read(kind, working)
+            self.regenerate()
+            self.digests.update(changed)
+        except Exception as error:
+            # Keep watching; the next save, or the next poll, tries again.
+            self.engine.log(f"[watch] reports not regenerated: {error!r}")
+            return False
+        finished = time.time()
+
+        names = [os.path.basename(self.sources[kind][0]) for kind in changed]
+        if first_change is None:
+            self.engine.log(f"[watch] reports generated from {', '.join(names)} "
+                            f"in {time.perf_counter() - started:.2f} s")
+        else:
+            written_at = max(os.path.getmtime(self.sources[kind][0]) for kind in changed)
+            latency = finished - written_at
+            self.engine.log(f"[watch] {', '.join(names)} changed; reports updated {latency:.2f} s after "
+                            f"the write ({time.perf_counter() - started:.2f} s to regenerate)")
+            if self.latency_log:
+                with open(self.latency_log, "a", encoding="utf-8") as writer:
+                    writer.write(json.dumps({
+                        "updated_at": datetime.fromtimestamp(finished, timezone.utc).isoformat(),
+                        "changed": names,
+                        "first_event_s": finished - first_change,
+                        "latency_s": latency,
+                        "regenerate_s": time.perf_counter() - started,
+                    }) + "\n")
+
+        if self.after is not None:
+            try:
+                self.after()
+            except (Exception, SystemExit) as error:
+                self.engine.log(f"[watch] {error}")
+        return True
+
+    def read(self, kind: str, path: str):
+        engine, config = self.engine, self.engine.config
+        if kind == "mm":
+            return engine.read_mm_exports(path) if self.all_guilds else engine.read_mm_export(path)
+        if not self.all_guilds:
+            return list(iter_gbl_history(path, config.user, config.guild_name))
+        rows = {}
+        for guild_name, row in iter_child_table_strings(path, gbl_history_path(config.user)):
+            rows.setdefault(guild_name, []).append(row)
+        return rows
+
+    def regenerate(self) -> None:
+        engine = self.engine
+        windows = engine.generate_windows(self.week, self.raffle_only, self.raffle_final)
+        if self.all_guilds:
+            # build_all_guilds takes the guilds out of the dict it is given.
+            engine.build_all_guilds(dict(self.rows["gbl"]), self.rows["mm"], windows, self.output_dir)
+        else:
+            engine.build_reports(engine.config.guild_name, self.rows["gbl"], self.rows["mm"], windows,
+                                 self.output_dir)
+
+    def watch(self, debounce: float = 2, max_delay: float = 30) -> None:
+        """Regenerate now and then every time ESO saves new data, until interrupted."""
+        names = self.names()
+        directories = {os.path.dirname(os.path.abspath(saved)) for saved, _ in self.sources.values()}
+        if len(directories) != 1:
+            raise ValueError("GBLData.lua and MasterMerchant.lua have to be in the same directory to be watched")
+        directory = directories.pop()
+        self.engine.log(f"[watch] watching {directory} for changes to {', '.join(sorted(names))}")
+        watch_directory(directory, names.__contains__, self.refresh, debounce, max_delay)